@@ -0,0 +1,147 @@
+"""
+Compare the full page compositing of the accounting stamp with the region
+only compositing.
+
+Runs without Django or a Mayan database:
+
+    python benchmarks/stamp_compositing.py --rounds 5
+
+Every measurement runs in a forked child process, so that the reported peak
+memory is the growth of the resident set size caused by stamping alone.
+
+The full benchmark suite over page sizes, modes and text lengths is in
+"stamp_suite.py".
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from botech.edms.transformation_mixins import (  # NOQA
+    ANCHOR_RIGHT_ASCENDER, ANCHOR_RIGHT_DESCENDER,
+    TransformationStampAccountingMetadataMixin, fit_image, font_registry
+)
+
+A4_INCHES = (8.27, 11.69)
+# Width and height of the Mayan preview by default.
+PREVIEW_SIZE = (800, None)
+
+
+class Stamp(TransformationStampAccountingMetadataMixin):
+    acct_doc_number = '2022-004711'
+    acct_booked_stamp = 'BOOKED 2022-08-25'
+    acct_assignment = 'Cost center 4711, office supplies'
+
+    def __init__(self):
+        self.font = font_registry.get(name=self.font_name, size=self.font_size)
+
+
+def stamp_full_page(stamp, image):
+    """
+    The compositing as it was done before: full page RGBA canvases.
+    """
+    image = image.convert(mode='RGBA')
+    txt_image = Image.new(
+        mode='RGBA', size=image.size, color=(255, 255, 255, 0))
+    draw = ImageDraw.Draw(im=txt_image)
+
+    pos_x = image.size[0] - 200
+    text_color = (255, 0, 0, 155)
+
+    draw.text(
+        (pos_x, 100), stamp.acct_doc_number,
+        anchor=ANCHOR_RIGHT_ASCENDER, font=stamp.font, fill=text_color)
+    draw.text(
+        (pos_x, 200), stamp.acct_booked_stamp,
+        anchor=ANCHOR_RIGHT_ASCENDER, font=stamp.font, fill=text_color)
+    draw.text(
+        (pos_x, image.size[1] - 500), stamp.acct_assignment,
+        anchor=ANCHOR_RIGHT_DESCENDER, font=stamp.font, fill=text_color)
+
+    return Image.alpha_composite(image, txt_image)
+
+
+def stamp_region_only(stamp, image):
+    return stamp.stamp_accounting_data(image)
+
+
+def stamp_then_preview(stamp, image):
+    """
+    A stamped preview as Mayan renders it: stamp, then resize.
+    """
+    image = stamp.stamp_accounting_data(image)
+    return fit_image(image=image, size=PREVIEW_SIZE)
+
+
+def stamp_at_preview(stamp, image):
+    return stamp.stamp_accounting_data(image, output_size=PREVIEW_SIZE)
+
+
+VARIANTS = {
+    'full-page': stamp_full_page,
+    'preview-at-output-size': stamp_at_preview,
+    'preview-stamp-then-resize': stamp_then_preview,
+    'region-only': stamp_region_only,
+}
+
+
+def _measure(variant, mode, dpi, rounds, queue):
+    size = tuple(int(inches * dpi) for inches in A4_INCHES)
+    stamp = Stamp()
+    pages = [
+        Image.new(mode=mode, size=size, color='white') for _ in range(rounds)
+    ]
+    # Warm up on a small page, a full size page would already raise the
+    # peak memory of the process.
+    VARIANTS[variant](stamp, Image.new(mode=mode, size=(800, 800)))
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    for page in pages:
+        VARIANTS[variant](stamp, page)
+    elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    queue.put(
+        {
+            'peak_kib': rss_after - rss_before,
+            'time_ms': elapsed / rounds * 1000,
+        }
+    )
+
+
+def measure(variant, mode, dpi, rounds):
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    process = context.Process(
+        target=_measure, args=(variant, mode, dpi, rounds, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--dpi', default=300, type=int)
+    parser.add_argument('--rounds', default=5, type=int)
+    args = parser.parse_args()
+
+    print('{:<6} {:<26} {:>12} {:>14}'.format(
+        'mode', 'variant', 'ms / page', 'peak RSS KiB'))
+    for mode in ('1', 'L', 'RGB'):
+        for variant in VARIANTS:
+            result = measure(
+                variant=variant, mode=mode, dpi=args.dpi, rounds=args.rounds)
+            print('{:<6} {:<26} {:>12.1f} {:>14}'.format(
+                mode, variant, result['time_ms'], result['peak_kib']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+"""
+Benchmark suite of the accounting stamp over realistic page sizes and modes.
+
+Runs without Django or a Mayan database:
+
+    python benchmarks/stamp_suite.py --output results.json
+    python benchmarks/stamp_suite.py --compare results.json
+
+Drives "stamp_accounting_data" of the transformation mixin over synthetic
+pages in the modes "1", "L" and "RGB", at 150, 300 and 600 dpi, in A4 and A3
+and with short, typical and long texts. Every case runs in a forked child
+process and reports the time per page, the growth of the peak resident set
+size and the memory allocated by Python while stamping. The latter is traced
+with tracemalloc, which does not see the image buffers of Pillow, these show
+up in the resident set size only.
+
+The compositing variants of "stamp_compositing.py" can be selected with
+"--variants".
+
+The results are stored as JSON, "--compare" reports the change against an
+earlier run and fails if a case got slower than "--threshold".
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from botech.edms.transformation_mixins import (  # NOQA
+    stamp_overlay_cache
+)
+from stamp_compositing import VARIANTS, Stamp  # NOQA
+
+DPIS = (150, 300, 600)
+MODES = ('1', 'L', 'RGB')
+PAPER_SIZES = {
+    'A3': (11.69, 16.54),
+    'A4': (8.27, 11.69),
+}
+TEXTS = {
+    'short': ('4711', 'BOOKED', 'Office'),
+    'typical': (
+        '2022-004711', 'BOOKED 2022-08-25', 'Cost center 4711, office supplies'
+    ),
+    'long': (
+        '2022-004711-ACME-EUROPE-SUBSIDIARY',
+        'BOOKED 2022-08-25 BY ACCOUNTING',
+        'Cost center 4711, office supplies, split with cost center 4712 '
+        'and 4713 according to the agreement of 2022-01-01',
+    ),
+}
+
+
+class Case:
+    def __init__(self, mode, dpi, paper, texts, variant):
+        self.mode = mode
+        self.dpi = dpi
+        self.paper = paper
+        self.texts = texts
+        self.variant = variant
+
+    @property
+    def key(self):
+        return '{}/{}dpi/{}/{}/{}'.format(
+            self.mode, self.dpi, self.paper, self.texts, self.variant
+        )
+
+    @property
+    def size(self):
+        return tuple(
+            int(inches * self.dpi) for inches in PAPER_SIZES[self.paper]
+        )
+
+    def get_stamp(self, index):
+        stamp = Stamp()
+        doc_number, booked_stamp, assignment = TEXTS[self.texts]
+        # Note: Every page gets its own number, like in real life, so that
+        # the overlay cache does not turn the benchmark into cache hits.
+        stamp.acct_doc_number = '{}-{}'.format(doc_number, index)
+        stamp.acct_booked_stamp = booked_stamp
+        stamp.acct_assignment = assignment
+        return stamp
+
+
+def _measure(case, rounds, warm, queue):
+    pages = [
+        Image.new(mode=case.mode, size=case.size, color='white')
+        for index in range(rounds)
+    ]
+    stamps = [
+        case.get_stamp(index=0 if warm else index) for index in range(rounds)
+    ]
+    stamp_function = VARIANTS[case.variant]
+
+    # Warm up on a small page, a full size page would already raise the
+    # peak memory of the process.
+    stamp_function(
+        case.get_stamp(index=-1), Image.new(mode=case.mode, size=(800, 800))
+    )
+    stamp_overlay_cache.clear()
+    if warm:
+        stamp_function(stamps[0], pages[0].copy())
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    for stamp, page in zip(stamps, pages):
+        stamp_function(stamp, page)
+    elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Note: Tracing slows down Python code, so allocations are measured in
+    # a separate pass over one more page.
+    stamp_overlay_cache.clear()
+    page = Image.new(mode=case.mode, size=case.size, color='white')
+    stamp = case.get_stamp(index=rounds)
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    stamp_function(stamp, page)
+    snapshot_after = tracemalloc.take_snapshot()
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    statistics = snapshot_after.compare_to(snapshot_before, 'filename')
+
+    queue.put(
+        {
+            'allocated_blocks': sum(
+                max(statistic.count_diff, 0) for statistic in statistics
+            ),
+            'peak_rss_kib': rss_after - rss_before,
+            'time_ms': elapsed / rounds * 1000,
+            'traced_peak_kib': traced_peak // 1024,
+        }
+    )
+
+
+def measure(case, rounds, warm):
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    process = context.Process(
+        target=_measure, args=(case, rounds, warm, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def get_cases(options):
+    for mode, dpi, paper, texts, variant in itertools.product(
+        options.modes, options.dpis, options.papers, options.texts,
+        options.variants
+    ):
+        yield Case(
+            mode=mode, dpi=dpi, paper=paper, texts=texts, variant=variant
+        )
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the change of the time per page against the baseline and return
+    the keys of the cases which got slower than the threshold.
+    """
+    regressions = []
+    print('{:<40} {:>12} {:>12} {:>9}'.format(
+        'case', 'baseline ms', 'ms', 'change'))
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+
+        before = baseline[key]['time_ms']
+        change = (result['time_ms'] - before) / before if before else 0
+        print('{:<40} {:>12.1f} {:>12.1f} {:>+8.0%}'.format(
+            key, before, result['time_ms'], change))
+        if change > threshold:
+            regressions.append(key)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument(
+        '--compare', help='JSON file of an earlier run to compare with.')
+    parser.add_argument('--dpis', default=DPIS, nargs='+', type=int)
+    parser.add_argument('--modes', choices=MODES, default=MODES, nargs='+')
+    parser.add_argument('--output', help='JSON file to store the results in.')
+    parser.add_argument(
+        '--papers', choices=sorted(PAPER_SIZES), default=sorted(PAPER_SIZES),
+        nargs='+')
+    parser.add_argument('--rounds', default=3, type=int)
+    parser.add_argument(
+        '--texts', choices=sorted(TEXTS), default=sorted(TEXTS), nargs='+')
+    parser.add_argument(
+        '--threshold', default=0.2, type=float,
+        help='Relative slow down which counts as a regression.')
+    parser.add_argument(
+        '--variants', choices=sorted(VARIANTS), default=['region-only'],
+        nargs='+')
+    parser.add_argument(
+        '--warm', action='store_true',
+        help='Stamp the same texts on every page, the overlay cache hits.')
+    options = parser.parse_args()
+
+    results = {}
+    print('{:<40} {:>10} {:>14} {:>14} {:>10}'.format(
+        'case', 'ms / page', 'peak RSS KiB', 'traced KiB', 'blocks'))
+    for case in get_cases(options=options):
+        result = measure(case=case, rounds=options.rounds, warm=options.warm)
+        results[case.key] = result
+        print('{:<40} {:>10.1f} {:>14} {:>14} {:>10}'.format(
+            case.key, result['time_ms'], result['peak_rss_kib'],
+            result['traced_peak_kib'], result['allocated_blocks']))
+
+    if options.output:
+        with open(options.output, mode='w') as file_object:
+            json.dump(
+                {
+                    'machine': {
+                        'platform': platform.platform(),
+                        'python': platform.python_version(),
+                    },
+                    'options': {
+                        'rounds': options.rounds, 'warm': options.warm
+                    },
+                    'results': results,
+                }, file_object, indent=2, sort_keys=True
+            )
+
+    if options.compare:
+        with open(options.compare) as file_object:
+            baseline = json.load(file_object)['results']
+
+        regressions = compare(
+            results=results, baseline=baseline, threshold=options.threshold)
+        if regressions:
+            print('Slower than {:.0%}: {}'.format(
+                options.threshold, ', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
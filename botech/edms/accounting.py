@@ -0,0 +1,362 @@
+import collections
+
+from django.apps import apps
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, Max, OuterRef
+from django.utils.translation import ugettext_lazy as _
+
+from mayan.apps.acls.models import AccessControlList
+from mayan.apps.converter.layers import layer_decorations
+from mayan.apps.metadata.permissions import permission_document_metadata_edit
+from mayan.apps.tags.events import event_tag_attached
+
+from .classes import (
+    get_stamp_transformation_arguments, metadata_type_resolver,
+    stamp_data_provider
+)
+from .settings import (
+    setting_acct_assignment,
+    setting_acct_booked_date,
+    setting_acct_doc_number,
+    setting_acct_entity,
+    setting_acct_fiscal_year,
+    setting_acct_number_range,
+    setting_botech_booked_tag,
+)
+from .transformations import TransformationStampAccountingMetadata
+
+Booking = collections.namedtuple(
+    'Booking', ('document', 'doc_number', 'booked_date')
+)
+BookingResult = collections.namedtuple(
+    'BookingResult', ('document', 'doc_number', 'error')
+)
+
+
+class AccountingSnapshot:
+    """
+    The accounting state of one document, loaded up front with a fixed
+    number of queries.
+
+    The accounting view asks many small questions about a document: its
+    accounting metadata, whether it has a document number or the booked tag
+    and which page gets the stamp. The snapshot answers all of them from
+    memory. It reflects the state when it was loaded, writes made afterwards
+    are not visible in it.
+    """
+    editable_setting_list = (
+        setting_acct_entity,
+        setting_acct_fiscal_year,
+        setting_acct_number_range,
+    )
+    setting_list = editable_setting_list + (
+        setting_acct_assignment,
+        setting_acct_booked_date,
+        setting_acct_doc_number,
+    )
+
+    def __init__(self, document, user):
+        self.document = document
+        self.user = user
+
+        self._load_metadata()
+        self._load_booked_tag()
+        self._load_first_page()
+
+    def get_editable_metadata(self):
+        """
+        Return the DocumentMetadata instances of the editable accounting
+        metadata types which the user may edit.
+        """
+        return [
+            document_metadata for document_metadata in self.metadata.values()
+            if document_metadata.is_editable
+        ]
+
+    def get_metadata(self, setting):
+        """
+        Return the DocumentMetadata instance of the metadata type named by
+        the setting or None.
+        """
+        return self.metadata.get(metadata_type_resolver.get_id(setting=setting))
+
+    def get_value(self, setting):
+        document_metadata = self.get_metadata(setting=setting)
+        if document_metadata:
+            return document_metadata.value
+
+    @property
+    def has_doc_number(self):
+        return self.get_metadata(setting=setting_acct_doc_number) is not None
+
+    def _load_booked_tag(self):
+        # Note: A missing tag is only an error when the document is booked.
+        Tag = apps.get_model(app_label='tags', model_name='Tag')
+
+        self.booked_tag = Tag.objects.annotate(
+            is_attached=Exists(
+                Tag.documents.through.objects.filter(
+                    document_id=self.document.pk, tag_id=OuterRef('pk')
+                )
+            )
+        ).filter(label=setting_botech_booked_tag.value).first()
+
+    def _load_first_page(self):
+        DocumentVersionPage = apps.get_model(
+            app_label='documents', model_name='DocumentVersionPage')
+
+        self.first_page = DocumentVersionPage.objects.filter(
+            document_version__active=True,
+            document_version__document_id=self.document.pk
+        ).order_by('page_number').first()
+
+    def _load_metadata(self):
+        DocumentMetadata = apps.get_model(
+            app_label='metadata', model_name='DocumentMetadata')
+
+        editable_metadata_type_ids = metadata_type_resolver.get_ids(
+            *self.editable_setting_list)
+        restricted_queryset = AccessControlList.objects.restrict_queryset(
+            queryset=DocumentMetadata.objects.filter(
+                document_id=self.document.pk,
+                metadata_type_id__in=editable_metadata_type_ids
+            ), permission=permission_document_metadata_edit, user=self.user
+        )
+
+        queryset = DocumentMetadata.objects.filter(
+            document_id=self.document.pk,
+            metadata_type_id__in=metadata_type_resolver.get_ids(
+                *self.setting_list)
+        ).annotate(
+            is_editable=Exists(
+                restricted_queryset.filter(pk=OuterRef('pk'))
+            )
+        ).select_related('metadata_type')
+
+        self.metadata = {
+            document_metadata.metadata_type_id: document_metadata
+            for document_metadata in queryset
+        }
+
+
+def attach_stamp_accounting_metadata_transformations(
+    documents, first_pages=None
+):
+    """
+    Attach the stamp transformation to the first page of the active version
+    of each document.
+
+    "first_pages" can map document ids to already loaded first pages.
+
+    Attaching is idempotent: a page which already has the stamp gets its
+    arguments updated and surplus copies removed, a page without it gets
+    one appended after its other transformations.
+    """
+    DocumentVersionPage = apps.get_model(
+        app_label='documents', model_name='DocumentVersionPage')
+    LayerTransformation = apps.get_model(
+        app_label='converter', model_name='LayerTransformation')
+    ObjectLayer = apps.get_model(
+        app_label='converter', model_name='ObjectLayer')
+
+    document_ids = [document.pk for document in documents]
+
+    if first_pages is None:
+        first_pages = {}
+        for page in DocumentVersionPage.objects.filter(
+            document_version__active=True,
+            document_version__document_id__in=document_ids
+        ).select_related('document_version').order_by(
+            'document_version_id', 'page_number'
+        ):
+            first_pages.setdefault(page.document_version.document_id, page)
+
+    stamp_data_map = stamp_data_provider.get_many(document_ids=document_ids)
+
+    object_layers = {}
+    for document_id, first_page in first_pages.items():
+        object_layer, created = ObjectLayer.objects.get_for(
+            layer=layer_decorations, obj=first_page
+        )
+        object_layers[document_id] = object_layer
+
+    object_layer_ids = [
+        object_layer.pk for object_layer in object_layers.values()
+    ]
+    existing = collections.defaultdict(list)
+    for layer_transformation in LayerTransformation.objects.filter(
+        name=TransformationStampAccountingMetadata.name,
+        object_layer_id__in=object_layer_ids
+    ).order_by('order', 'pk'):
+        existing[layer_transformation.object_layer_id].append(
+            layer_transformation)
+    maximum_orders = dict(
+        LayerTransformation.objects.filter(
+            object_layer_id__in=object_layer_ids
+        ).values('object_layer_id').annotate(
+            maximum_order=Max('order')
+        ).values_list('object_layer_id', 'maximum_order')
+    )
+
+    layer_transformations = []
+    surplus_ids = []
+    for document_id, object_layer in object_layers.items():
+        arguments = get_stamp_transformation_arguments(
+            stamp_data=stamp_data_map[document_id])
+
+        if existing[object_layer.pk]:
+            layer_transformation = existing[object_layer.pk][0]
+            surplus_ids.extend(
+                duplicate.pk for duplicate in existing[object_layer.pk][1:]
+            )
+            if layer_transformation.arguments != arguments:
+                LayerTransformation.objects.filter(
+                    pk=layer_transformation.pk
+                ).update(arguments=arguments)
+        else:
+            layer_transformations.append(
+                LayerTransformation(
+                    object_layer=object_layer,
+                    order=(maximum_orders.get(object_layer.pk) or 0) + 1,
+                    name=TransformationStampAccountingMetadata.name,
+                    arguments=arguments,
+                )
+            )
+
+    if surplus_ids:
+        LayerTransformation.objects.filter(pk__in=surplus_ids).delete()
+
+    LayerTransformation.objects.bulk_create(layer_transformations)
+
+
+def book_documents(bookings, user):
+    """
+    Book a batch of documents in one transaction.
+
+    All checks are done up front with one query per check for the whole
+    batch. Documents which fail a check are skipped and reported, the others
+    get their document number and booked date, the booked tag and the stamp
+    transformation. A document number which is already registered for
+    another document is reported as well.
+
+    Returns one BookingResult per booking.
+    """
+    DocumentMetadata = apps.get_model(
+        app_label='metadata', model_name='DocumentMetadata')
+    Tag = apps.get_model(app_label='tags', model_name='Tag')
+
+    bookings = list(bookings)
+    document_ids = [booking.document.pk for booking in bookings]
+
+    metadata_type_doc_number_id, metadata_type_booked_date_id = (
+        metadata_type_resolver.get_ids(
+            setting_acct_doc_number, setting_acct_booked_date, required=True
+        )
+    )
+    booked_tag = Tag.objects.get(label=setting_botech_booked_tag.value)
+
+    existing_metadata = collections.defaultdict(dict)
+    for document_metadata in DocumentMetadata.objects.filter(
+        document_id__in=document_ids, metadata_type_id__in=(
+            metadata_type_doc_number_id, metadata_type_booked_date_id
+        )
+    ):
+        existing_metadata[document_metadata.document_id][
+            document_metadata.metadata_type_id
+        ] = document_metadata
+
+    tagged_document_ids = set(
+        booked_tag.documents.filter(pk__in=document_ids).values_list(
+            'pk', flat=True)
+    )
+
+    results = []
+    valid_bookings = []
+    for booking in bookings:
+        document_id = booking.document.pk
+        if metadata_type_doc_number_id in existing_metadata[document_id]:
+            error = _('Document number is already set.')
+        elif document_id in tagged_document_ids:
+            error = _('Document is already tagged as booked.')
+        else:
+            error = None
+            valid_bookings.append((len(results), booking))
+
+        results.append(
+            BookingResult(
+                document=booking.document, doc_number=booking.doc_number,
+                error=error
+            )
+        )
+
+    if not valid_bookings:
+        return results
+
+    AccountingDocumentNumber = apps.get_model(
+        app_label='edms', model_name='AccountingDocumentNumber')
+
+    with AccountingDocumentNumber.objects.enforce_unique():
+        with transaction.atomic():
+            documents = []
+            for index, booking in valid_bookings:
+                try:
+                    # Note: The savepoint skips a booking whose document
+                    # number is a duplicate according to the registry.
+                    with transaction.atomic():
+                        _save_booking_metadata(
+                            booking=booking,
+                            booked_date_metadata=existing_metadata[
+                                booking.document.pk
+                            ].get(metadata_type_booked_date_id),
+                            metadata_type_ids=(
+                                metadata_type_doc_number_id,
+                                metadata_type_booked_date_id
+                            ), user=user
+                        )
+                except IntegrityError:
+                    results[index] = results[index]._replace(
+                        error=_(
+                            'Document number is already used for the same '
+                            'entity, fiscal year and number range.'
+                        )
+                    )
+                else:
+                    documents.append(booking.document)
+
+            if documents:
+                booked_tag.documents.add(*documents)
+                for document in documents:
+                    event_tag_attached.commit(
+                        action_object=booked_tag, actor=user, target=document)
+
+                attach_stamp_accounting_metadata_transformations(
+                    documents=documents)
+
+    return results
+
+
+def _save_booking_metadata(
+    booking, booked_date_metadata, metadata_type_ids, user
+):
+    DocumentMetadata = apps.get_model(
+        app_label='metadata', model_name='DocumentMetadata')
+
+    metadata_type_doc_number_id, metadata_type_booked_date_id = (
+        metadata_type_ids
+    )
+
+    # Note: The metadata is saved per instance, so that the events and the
+    # signal handlers keep working.
+    document_metadata = DocumentMetadata(
+        document=booking.document,
+        metadata_type_id=metadata_type_doc_number_id,
+        value=booking.doc_number)
+    document_metadata._event_actor = user
+    document_metadata.save()
+
+    document_metadata = booked_date_metadata or DocumentMetadata(
+        document=booking.document,
+        metadata_type_id=metadata_type_booked_date_id)
+    document_metadata.value = booking.booked_date
+    document_metadata._event_actor = user
+    document_metadata.save()
@@ -1,12 +1,30 @@
 from django.apps import apps
+from django.db.models.signals import post_delete, post_save
 
 from mayan.apps.common.apps import MayanAppConfig
-from mayan.apps.common.menus import menu_object
+from mayan.apps.common.menus import (
+    menu_multi_item, menu_object, menu_tools)
+from mayan.apps.documents.signals import signal_post_document_type_change
 
+from .handlers import (
+    handler_clear_metadata_type_resolver, handler_invalidate_stamp_data,
+    handler_sync_acct_doc_number, handler_sync_acct_doc_number_document_type
+)
 from .links import (
     link_acct_document_edit_view,
+    link_acct_document_multiple_book,
+    link_booked_document_export_csv,
+    link_booked_document_export_jsonl,
+    link_pre_process_cabinet_queue_start,
     link_pre_process_document_edit_view,
+    link_pre_process_document_multiple_queue_start,
+)
+from .settings import (
+    setting_stamp_overlay_cache_directory,
+    setting_stamp_overlay_cache_directory_maximum_size,
+    setting_stamp_overlay_cache_maximum_size,
 )
+from .transformation_mixins import font_registry, stamp_overlay_cache
 
 
 class BotechEdmsConfig(MayanAppConfig):
@@ -17,8 +35,27 @@ class BotechEdmsConfig(MayanAppConfig):
     def ready(self):
         super().ready()
 
+        # Parse the stamp font once per worker process instead of on the
+        # first rendered page.
+        font_registry.warm()
+
+        stamp_overlay_cache.directory = (
+            setting_stamp_overlay_cache_directory.value
+        )
+        stamp_overlay_cache.directory_maximum_size = (
+            setting_stamp_overlay_cache_directory_maximum_size.value
+        )
+        stamp_overlay_cache.maximum_size = (
+            setting_stamp_overlay_cache_maximum_size.value
+        )
+
+        Cabinet = apps.get_model(app_label='cabinets', model_name='Cabinet')
         Document = apps.get_model(
             app_label='documents', model_name='Document')
+        DocumentMetadata = apps.get_model(
+            app_label='metadata', model_name='DocumentMetadata')
+        MetadataType = apps.get_model(
+            app_label='metadata', model_name='MetadataType')
 
         menu_object.bind_links(
             links=(
@@ -31,3 +68,59 @@ class BotechEdmsConfig(MayanAppConfig):
                 link_pre_process_document_edit_view,
             ), sources=(Document,)
         )
+
+        menu_object.bind_links(
+            links=(
+                link_pre_process_cabinet_queue_start,
+            ), sources=(Cabinet,)
+        )
+
+        menu_multi_item.bind_links(
+            links=(
+                link_acct_document_multiple_book,
+                link_pre_process_document_multiple_queue_start,
+            ), sources=(Document,)
+        )
+
+        menu_tools.bind_links(
+            links=(
+                link_booked_document_export_csv,
+                link_booked_document_export_jsonl,
+            )
+        )
+
+        post_delete.connect(
+            dispatch_uid='botech_edms_handler_clear_metadata_type_resolver_delete',
+            receiver=handler_clear_metadata_type_resolver,
+            sender=MetadataType
+        )
+        post_save.connect(
+            dispatch_uid='botech_edms_handler_clear_metadata_type_resolver_save',
+            receiver=handler_clear_metadata_type_resolver,
+            sender=MetadataType
+        )
+        post_delete.connect(
+            dispatch_uid='botech_edms_handler_invalidate_stamp_data_delete',
+            receiver=handler_invalidate_stamp_data,
+            sender=DocumentMetadata
+        )
+        post_save.connect(
+            dispatch_uid='botech_edms_handler_invalidate_stamp_data_save',
+            receiver=handler_invalidate_stamp_data,
+            sender=DocumentMetadata
+        )
+        post_delete.connect(
+            dispatch_uid='botech_edms_handler_sync_acct_doc_number_delete',
+            receiver=handler_sync_acct_doc_number,
+            sender=DocumentMetadata
+        )
+        post_save.connect(
+            dispatch_uid='botech_edms_handler_sync_acct_doc_number_save',
+            receiver=handler_sync_acct_doc_number,
+            sender=DocumentMetadata
+        )
+        signal_post_document_type_change.connect(
+            dispatch_uid='botech_edms_handler_sync_acct_doc_number_document_type',
+            receiver=handler_sync_acct_doc_number_document_type,
+            sender=Document
+        )
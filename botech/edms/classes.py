@@ -0,0 +1,493 @@
+import collections
+import contextlib
+import functools
+import hashlib
+import logging
+import threading
+import uuid
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from mayan.apps.common.serialization import yaml_dump
+
+from .settings import (
+    setting_acct_assignment,
+    setting_acct_booked_date,
+    setting_acct_doc_number,
+    setting_acct_entity,
+    setting_acct_fiscal_year,
+    setting_acct_number_range,
+)
+
+
+logger = logging.getLogger(name=__name__)
+
+
+class StampData(
+    collections.namedtuple(
+        'StampData', ('acct_doc_number', 'acct_booked_date', 'acct_assignment')
+    )
+):
+    @property
+    def digest(self):
+        """
+        Digest of the stamped values, used as the argument of the stamp
+        transformation so that its cache identity follows the values.
+        """
+        digest = hashlib.sha256()
+        for value in self:
+            digest.update(value.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+
+class DeferredEventQueue:
+    """
+    Collect events during a transaction and commit every distinct event
+    once, after the transaction has been committed.
+
+    Workflow transitions are triggered by events. Committing them only
+    after the transaction means that no workflow sees half applied changes,
+    and an event which is queued several times triggers only once.
+    """
+
+    def __init__(self):
+        self._events = collections.OrderedDict()
+
+    def add(self, event_type, action_object=None, actor=None, target=None):
+        key = (
+            event_type.id, _get_instance_key(actor),
+            _get_instance_key(action_object), _get_instance_key(target)
+        )
+        self._events.setdefault(
+            key, {
+                'action_object': action_object, 'actor': actor,
+                'event_type': event_type, 'target': target,
+            }
+        )
+
+    def flush(self):
+        events, self._events = self._events, collections.OrderedDict()
+
+        for event in events.values():
+            event['event_type'].commit(
+                action_object=event['action_object'], actor=event['actor'],
+                target=event['target']
+            )
+
+        return len(events)
+
+
+class MetadataTypeResolver:
+    """
+    Resolve the settings which name a MetadataType to the id of that type.
+
+    All settings are resolved together with one query on the first lookup
+    and kept for the lifetime of the process. The mapping is keyed by the
+    name, so that a changed setting value is resolved again. The signal
+    handlers clear it when MetadataType rows change.
+    """
+
+    def __init__(self, setting_list):
+        self.setting_list = setting_list
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._ids = {}
+
+    def get_id(self, setting, required=False):
+        """
+        Return the id of the MetadataType named by the setting or None if
+        there is no such type. With "required" a missing type raises
+        MetadataType.DoesNotExist instead.
+        """
+        name = setting.value
+
+        with self._lock:
+            ids = self._ids
+
+        if name not in ids:
+            ids = self._resolve()
+
+        metadata_type_id = ids.get(name)
+        if metadata_type_id is None and required:
+            MetadataType = apps.get_model(
+                app_label='metadata', model_name='MetadataType')
+            raise MetadataType.DoesNotExist(
+                'MetadataType "{}" does not exist.'.format(name)
+            )
+
+        return metadata_type_id
+
+    def get_ids(self, *settings, required=False):
+        return [
+            self.get_id(required=required, setting=setting)
+            for setting in settings
+        ]
+
+    def _resolve(self):
+        MetadataType = apps.get_model(
+            app_label='metadata', model_name='MetadataType')
+
+        names = [setting.value for setting in self.setting_list]
+        # Note: Missing types are kept as None, so that they are not looked
+        # up again on every call.
+        ids = dict.fromkeys(names)
+        ids.update(
+            MetadataType.objects.filter(name__in=names).values_list(
+                'name', 'pk')
+        )
+
+        with self._lock:
+            self._ids = ids
+
+        return ids
+
+
+class PreProcessQueue:
+    """
+    A list of documents to pre process one after the other, kept in the
+    session of the user.
+    """
+    maximum_queues = 5
+    session_key = 'botech_edms_pre_process_queues'
+
+    def __init__(self, session, queue_id):
+        self.session = session
+        self.queue_id = queue_id
+
+    @classmethod
+    def create(cls, session, document_ids):
+        queues = session.get(cls.session_key, {})
+
+        # Note: Only the newest queues are kept, so that the session does
+        # not grow without bounds.
+        for queue_id in list(queues)[:-cls.maximum_queues + 1]:
+            del queues[queue_id]
+
+        queue_id = uuid.uuid4().hex
+        queues[queue_id] = list(document_ids)
+        session[cls.session_key] = queues
+
+        return cls(session=session, queue_id=queue_id)
+
+    @classmethod
+    def get(cls, session, queue_id):
+        """
+        Return the queue or None if it does not exist (anymore).
+        """
+        if queue_id in session.get(cls.session_key, {}):
+            return cls(session=session, queue_id=queue_id)
+
+    @property
+    def document_ids(self):
+        return self.session[self.session_key][self.queue_id]
+
+    def get_next_document_id(self, document_id):
+        try:
+            index = self.document_ids.index(document_id)
+        except ValueError:
+            return None
+
+        if index + 1 < len(self.document_ids):
+            return self.document_ids[index + 1]
+
+    def get_url(self, document_id):
+        return '{}?{}'.format(
+            reverse(
+                viewname='botech_edms:document_pre_process_view', kwargs={
+                    'document_id': document_id
+                }
+            ), urlencode(query={'queue': self.queue_id})
+        )
+
+    def get_position(self, document_id):
+        """
+        Return the 1 based position of the document in the queue.
+        """
+        try:
+            return self.document_ids.index(document_id) + 1
+        except ValueError:
+            return None
+
+
+class StampCacheInvalidator:
+    """
+    Evict the cached images of the version pages which carry the stamp of
+    a document, leaving all other cached pages alone.
+
+    Keeps counters of the invalidated edits and the evicted cache entries.
+    """
+
+    def __init__(self):
+        self.edits = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+    def get_pages(self, document_id):
+        DocumentVersionPage = apps.get_model(
+            app_label='documents', model_name='DocumentVersionPage')
+
+        return DocumentVersionPage.objects.filter(
+            pk__in=get_stamp_transformations(
+                document_id=document_id
+            ).values('object_layer__object_id')
+        )
+
+    def get_statistics(self):
+        with self._lock:
+            return {'edits': self.edits, 'evicted': self.evicted}
+
+    def invalidate(self, document_id):
+        """
+        Purge the cached images of the stamped pages of the document and
+        return the number of evicted cache entries.
+        """
+        evicted = 0
+        for page in self.get_pages(document_id=document_id):
+            cache_partition = page.cache_partition
+            evicted += cache_partition.files.count()
+            cache_partition.purge()
+
+        with self._lock:
+            self.edits += 1
+            self.evicted += evicted
+
+        logger.debug(
+            'Evicted %d cached stamped page images of document %s.',
+            evicted, document_id)
+
+        return evicted
+
+
+class StampDataProvider:
+    """
+    Provide the values which are stamped onto a document.
+
+    All values of a document are fetched in one query and memoized in the
+    cache. The signal handlers invalidate the entry whenever metadata of the
+    document changes.
+    """
+    cache_key_template = 'botech_edms.stamp_data.{}'
+    setting_list = (
+        setting_acct_doc_number,
+        setting_acct_booked_date,
+        setting_acct_assignment,
+    )
+
+    def get(self, document_id, digest=None):
+        """
+        Return the StampData of the document.
+
+        A given "digest" is the one the caller expects. A memoized entry
+        with a different digest is stale, e.g. because the metadata was
+        changed in another process, and is fetched again.
+        """
+        cache_key = self.cache_key_template.format(document_id)
+
+        stamp_data = cache.get(cache_key)
+        if stamp_data is None or (digest and stamp_data.digest != digest):
+            stamp_data = self._fetch(document_id=document_id)
+            cache.set(cache_key, stamp_data)
+
+        return stamp_data
+
+    def get_many(self, document_ids):
+        """
+        Return a dictionary of document id to StampData, fetching all
+        documents which are not memoized with one query.
+        """
+        cache_keys = {
+            self.cache_key_template.format(document_id): document_id
+            for document_id in document_ids
+        }
+        result = {
+            cache_keys[cache_key]: stamp_data
+            for cache_key, stamp_data in cache.get_many(cache_keys).items()
+        }
+
+        missing = [
+            document_id for document_id in document_ids
+            if document_id not in result
+        ]
+        if missing:
+            fetched = self._fetch_many(document_ids=missing)
+            cache.set_many(
+                {
+                    self.cache_key_template.format(document_id): stamp_data
+                    for document_id, stamp_data in fetched.items()
+                }
+            )
+            result.update(fetched)
+
+        return result
+
+    def invalidate(self, document_id):
+        cache.delete(self.cache_key_template.format(document_id))
+
+    def _fetch(self, document_id):
+        return self._fetch_many(document_ids=(document_id,))[document_id]
+
+    def _fetch_many(self, document_ids):
+        DocumentMetadata = apps.get_model(
+            app_label='metadata', model_name='DocumentMetadata')
+
+        metadata_type_ids = metadata_type_resolver.get_ids(*self.setting_list)
+
+        queryset = DocumentMetadata.objects.filter(
+            document_id__in=document_ids, metadata_type_id__in=metadata_type_ids
+        ).values_list('document_id', 'metadata_type_id', 'value')
+
+        values = collections.defaultdict(dict)
+        for document_id, metadata_type_id, value in queryset:
+            values[document_id][metadata_type_id] = value
+
+        # TODO: Missing metadata is exceptional, work on better handling of
+        # this situation. Unresolved metadata types are stamped as empty
+        # values as well.
+        return {
+            document_id: StampData(
+                *(
+                    values[document_id].get(metadata_type_id) or ''
+                    for metadata_type_id in metadata_type_ids
+                )
+            ) for document_id in document_ids
+        }
+
+
+def get_stamp_transformations(document_id):
+    """
+    Return the stamp transformations attached to the version pages of the
+    document.
+    """
+    ContentType = apps.get_model(
+        app_label='contenttypes', model_name='ContentType')
+    DocumentVersionPage = apps.get_model(
+        app_label='documents', model_name='DocumentVersionPage')
+    LayerTransformation = apps.get_model(
+        app_label='converter', model_name='LayerTransformation')
+
+    # Note: Importing at module level would create an import cycle.
+    from .transformations import TransformationStampAccountingMetadata
+
+    return LayerTransformation.objects.filter(
+        name=TransformationStampAccountingMetadata.name,
+        object_layer__content_type=ContentType.objects.get_for_model(
+            model=DocumentVersionPage),
+        object_layer__object_id__in=DocumentVersionPage.objects.filter(
+            document_version__document_id=document_id
+        ).values('pk')
+    )
+
+
+def get_stamp_transformation_arguments(stamp_data):
+    return yaml_dump(data={'digest': stamp_data.digest})
+
+
+def get_stamp_only_page_ids(page_ids):
+    """
+    Return the ids of the version pages among "page_ids" which have no other
+    enabled transformation than the stamp, with one query.
+
+    Only on these pages the stamp may be drawn at a reduced output size.
+    """
+    ContentType = apps.get_model(
+        app_label='contenttypes', model_name='ContentType')
+    DocumentVersionPage = apps.get_model(
+        app_label='documents', model_name='DocumentVersionPage')
+    LayerTransformation = apps.get_model(
+        app_label='converter', model_name='LayerTransformation')
+
+    # Note: Importing at module level would create an import cycle.
+    from .transformations import TransformationStampAccountingMetadata
+
+    other_page_ids = LayerTransformation.objects.filter(
+        enabled=True,
+        object_layer__content_type=ContentType.objects.get_for_model(
+            model=DocumentVersionPage),
+        object_layer__object_id__in=page_ids
+    ).exclude(
+        name=TransformationStampAccountingMetadata.name
+    ).values_list('object_layer__object_id', flat=True)
+
+    return set(page_ids).difference(other_page_ids)
+
+
+def update_stamp_transformation_arguments(document_id):
+    """
+    Store the digest of the current stamp data into the stamp
+    transformations of the document.
+
+    The digest is part of the cache hash of the transformation, so only the
+    pages which carry the stamp get a new cache identity and are rendered
+    again.
+    """
+    transformations = get_stamp_transformations(document_id=document_id)
+    if not transformations.exists():
+        return 0
+
+    arguments = get_stamp_transformation_arguments(
+        stamp_data=stamp_data_provider.get(document_id=document_id))
+
+    return transformations.exclude(arguments=arguments).update(
+        arguments=arguments)
+
+
+@contextlib.contextmanager
+def deferred_events():
+    """
+    Run the block in a transaction and yield a DeferredEventQueue which is
+    flushed once the transaction has been committed.
+    """
+    event_queue = DeferredEventQueue()
+
+    with transaction.atomic():
+        transaction.on_commit(event_queue.flush)
+        yield event_queue
+
+
+@functools.lru_cache(maxsize=1024)
+def document_id_for_page(content_type_id, object_id):
+    """
+    Return the document id of a file or version page with a single query.
+
+    Pages never move between documents, so the result is memoized.
+    """
+    ContentType = apps.get_model(
+        app_label='contenttypes', model_name='ContentType')
+
+    model = ContentType.objects.get_for_id(content_type_id).model_class()
+    # TODO: This is internal knowledge of the documents app, compare
+    # transformations._document_from_file_or_version_page.
+    parent_field = model._paged_model_parent_field
+
+    return model._default_manager.filter(pk=object_id).values_list(
+        '{}__document_id'.format(parent_field), flat=True
+    ).first()
+
+
+def _get_instance_key(instance):
+    if instance is None:
+        return None
+
+    return (instance._meta.label, instance.pk)
+
+
+metadata_type_resolver = MetadataTypeResolver(
+    setting_list=(
+        setting_acct_assignment,
+        setting_acct_booked_date,
+        setting_acct_doc_number,
+        setting_acct_entity,
+        setting_acct_fiscal_year,
+        setting_acct_number_range,
+    )
+)
+stamp_cache_invalidator = StampCacheInvalidator()
+stamp_data_provider = StampDataProvider()
@@ -0,0 +1,116 @@
+import csv
+import itertools
+import json
+
+from django.apps import apps
+
+from .classes import metadata_type_resolver
+from .settings import (
+    setting_acct_assignment,
+    setting_acct_booked_date,
+    setting_acct_doc_number,
+    setting_acct_entity,
+    setting_acct_fiscal_year,
+    setting_acct_number_range,
+    setting_botech_booked_tag,
+)
+
+# Field name and the setting naming the metadata type of its value.
+EXPORT_METADATA_FIELDS = (
+    ('doc_number', setting_acct_doc_number),
+    ('booked_date', setting_acct_booked_date),
+    ('entity', setting_acct_entity),
+    ('fiscal_year', setting_acct_fiscal_year),
+    ('number_range', setting_acct_number_range),
+    ('assignment', setting_acct_assignment),
+)
+EXPORT_FIELD_NAMES = ('document_id', 'document_label') + tuple(
+    name for name, setting in EXPORT_METADATA_FIELDS
+)
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """
+    File like object which returns what is written, for csv.writer.
+    """
+
+    def write(self, value):
+        return value
+
+
+def get_booked_documents(queryset=None):
+    """
+    Return the documents tagged as booked, optionally limited to
+    "queryset".
+    """
+    Document = apps.get_model(app_label='documents', model_name='Document')
+
+    if queryset is None:
+        queryset = Document.valid.all()
+
+    return queryset.filter(tags__label=setting_botech_booked_tag.value)
+
+
+def iter_booked_documents(queryset=None):
+    """
+    Yield one dictionary per booked document with its accounting metadata.
+
+    The documents and their metadata are read with two server side cursors
+    in document order and merged, so the memory use does not depend on the
+    number of documents.
+    """
+    DocumentMetadata = apps.get_model(
+        app_label='metadata', model_name='DocumentMetadata')
+
+    documents = get_booked_documents(queryset=queryset)
+    field_names = {
+        metadata_type_resolver.get_id(setting=setting): name
+        for name, setting in EXPORT_METADATA_FIELDS
+    }
+
+    metadata_rows = DocumentMetadata.objects.filter(
+        document__in=documents.values('pk'),
+        metadata_type_id__in=list(field_names)
+    ).order_by('document_id').values_list(
+        'document_id', 'metadata_type_id', 'value'
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    metadata_groups = itertools.groupby(
+        metadata_rows, key=lambda row: row[0]
+    )
+    metadata_group = next(metadata_groups, None)
+
+    for document_id, label in documents.order_by('pk').values_list(
+        'pk', 'label'
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        row = dict.fromkeys(EXPORT_FIELD_NAMES, '')
+        row.update({'document_id': document_id, 'document_label': label})
+
+        while metadata_group and metadata_group[0] < document_id:
+            metadata_group = next(metadata_groups, None)
+
+        if metadata_group and metadata_group[0] == document_id:
+            for row_document_id, metadata_type_id, value in metadata_group[1]:
+                row[field_names[metadata_type_id]] = value or ''
+            metadata_group = next(metadata_groups, None)
+
+        yield row
+
+
+def iter_csv_lines(rows):
+    writer = csv.DictWriter(Echo(), fieldnames=EXPORT_FIELD_NAMES)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_json_lines(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+# Format name: line iterator, content type and file extension.
+EXPORT_FORMATS = {
+    'csv': (iter_csv_lines, 'text/csv', 'csv'),
+    'jsonl': (iter_json_lines, 'application/x-ndjson', 'jsonl'),
+}
@@ -1,13 +1,87 @@
+import functools
+
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 
-from mayan.apps.metadata.models import DocumentMetadata, MetadataType
+from mayan.apps.acls.models import AccessControlList
+from mayan.apps.document_states.handlers import (
+    handler_launch_workflow_on_type_change)
+from mayan.apps.documents.events import event_document_type_changed
+from mayan.apps.documents.signals import signal_post_document_type_change
+from mayan.apps.metadata.events import (
+    event_document_metadata_added, event_document_metadata_edited)
+from mayan.apps.metadata.models import (
+    DocumentMetadata, DocumentTypeMetadataType, MetadataType)
+from mayan.apps.metadata.permissions import permission_document_metadata_edit
+
+
+# TODO: This is a copy from mayan.apps.metadata.views.document_views, check
+# if it can be shared upstream.
+def get_metadata_formset_initial(
+    document, user=None, document_metadata_list=None, include_addable=False
+):
+    """
+    Return the initial data of the metadata formset of a document.
+
+    The existing metadata is taken from "document_metadata_list" or loaded
+    with one query restricted to what the user may edit. With
+    "include_addable" the metadata types of the document type which the
+    document does not have yet are added with a second query.
+    """
+    document_type = document.document_type
+
+    if document_metadata_list is None:
+        document_metadata_list = AccessControlList.objects.restrict_queryset(
+            queryset=document.metadata.all(),
+            permission=permission_document_metadata_edit, user=user
+        ).select_related('metadata_type')
+
+    metadata = {}
+    for document_metadata in document_metadata_list:
+        # Metadata value cannot be None here, fallback to an empty string.
+        values = metadata.setdefault(document_metadata.metadata_type, [])
+        value = document_metadata.value or ''
+        if value and value not in values:
+            values.append(value)
+
+    if include_addable:
+        document_type_metadata_types = DocumentTypeMetadataType.objects.filter(
+            document_type_id=document_type.pk
+        ).exclude(
+            metadata_type_id__in=[
+                metadata_type.pk for metadata_type in metadata
+            ]
+        ).select_related('metadata_type').order_by('metadata_type__label')
+
+        for document_type_metadata_type in document_type_metadata_types:
+            metadata[document_type_metadata_type.metadata_type] = []
+
+    initial = []
+    for metadata_type, values in metadata.items():
+        value = ', '.join(values)
+        initial.append(
+            {
+                'document_type': document_type,
+                'metadata_type': metadata_type,
+                'update': False,
+                'value': value,
+                'value_existing': value
+            }
+        )
+
+    return initial
 
 
 # TODO: Fix this upstream in mayan.apps.metadata.api
-def save_metadata(metadata_dict, document, create=False, _user=None):
+def save_metadata(
+    metadata_dict, document, create=False, _user=None, event_queue=None
+):
     """
     Take a dictionary of metadata type & value and associate it to a
     document
+
+    If an "event_queue" is given, the events are added to it instead of
+    being committed right away.
     """
     parameters = {
         'document': document,
@@ -17,16 +91,82 @@ def save_metadata(metadata_dict, document, create=False, _user=None):
     }
 
     document_metadata = None
+    event = event_document_metadata_edited
     try:
         document_metadata = DocumentMetadata.objects.get(**parameters)
     except DocumentMetadata.DoesNotExist:
         if create:
             # Use matched metadata now to create document metadata.
             document_metadata = DocumentMetadata(**parameters)
-            document_metadata._event_actior = _user
-            document_metadata.save()
+            event = event_document_metadata_added
 
     if document_metadata:
         document_metadata.value = metadata_dict['value']
         document_metadata._event_actor = _user
+        if event_queue is not None:
+            document_metadata._event_ignore = True
         document_metadata.save()
+
+        # Note: Queued only after the save succeeded, a failed entry must
+        # not trigger anything.
+        if event_queue is not None:
+            event_queue.add(
+                action_object=document_metadata.metadata_type, actor=_user,
+                event_type=event, target=document
+            )
+
+
+# TODO: This is a copy of Document.document_type_change, check if the
+# event can be deferred upstream.
+def change_document_type(
+    document, document_type, _user=None, event_queue=None
+):
+    """
+    Change the document type of the document.
+
+    If an "event_queue" is given, the event is added to it instead of being
+    committed right away.
+    """
+    if document.document_type == document_type:
+        return
+
+    document.document_type = document_type
+    document._event_ignore = True
+    document.save(update_fields=('document_type',))
+
+    if _user:
+        document.add_as_recent_document_for_user(user=_user)
+
+    send_post_document_type_change(document=document)
+
+    if event_queue is None:
+        event_document_type_changed.commit(
+            action_object=document_type, actor=_user, target=document
+        )
+    else:
+        event_queue.add(
+            action_object=document_type, actor=_user,
+            event_type=event_document_type_changed, target=document
+        )
+
+
+def send_post_document_type_change(document):
+    """
+    Send "signal_post_document_type_change" for the document.
+
+    The workflow handler queues a task right away, it is only called once
+    the transaction has been committed, so that the task does see the new
+    document type. All other receivers are called immediately.
+    """
+    signal = signal_post_document_type_change
+    sender = document.__class__
+
+    # TODO: Uses the internal "_live_receivers" of Django, check if the
+    # handler can use transaction.on_commit upstream.
+    for receiver in signal._live_receivers(sender):
+        callback = functools.partial(
+            receiver, instance=document, sender=sender, signal=signal)
+        if receiver is handler_launch_workflow_on_type_change:
+            transaction.on_commit(callback)
+        else:
+            callback()
@@ -8,6 +8,8 @@ from mayan.apps.documents.models.document_type_models import DocumentType
 from mayan.apps.documents.utils import get_language_choices
 from mayan.apps.metadata.forms import DocumentMetadataForm as BaseDocumentMetadataForm
 
+from .widgets import AjaxSelect, AjaxSelectMultiple
+
 
 class CommentForm(forms.Form):
 
@@ -20,10 +22,126 @@ class CommentForm(forms.Form):
         label=_('ACCT Document Number'),
         required=True)
 
+    # The number proposed from the number range, it is allocated only if
+    # the user keeps it.
+    doc_number_proposed = forms.CharField(
+        required=False,
+        widget=forms.HiddenInput)
+
+    booked_date = forms.CharField(
+        label=_('ACCT Booked Date'),
+        required=True)
+
+    def is_doc_number_proposed(self):
+        proposed = self.cleaned_data.get('doc_number_proposed')
+        return bool(proposed) and proposed == self.cleaned_data['doc_number']
+
+
+class BulkBookingForm(forms.Form):
+    """
+    Booked date for all documents and one document number per document.
+    """
+
     booked_date = forms.CharField(
         label=_('ACCT Booked Date'),
         required=True)
 
+    def __init__(self, *args, **kwargs):
+        self.document_list = kwargs.pop('document_list')
+        super().__init__(*args, **kwargs)
+
+        for document in self.document_list:
+            self.fields[self.get_doc_number_field_name(document)] = forms.CharField(
+                label=_('ACCT Document Number for %s') % document,
+                required=True)
+
+    def clean(self):
+        cleaned_data = super().clean()
+
+        seen = {}
+        for document in self.document_list:
+            field_name = self.get_doc_number_field_name(document)
+            doc_number = cleaned_data.get(field_name)
+            if not doc_number:
+                continue
+
+            if doc_number in seen:
+                self.add_error(
+                    field_name, _(
+                        'Document number "%(doc_number)s" is also given for '
+                        '%(document)s.'
+                    ) % {'doc_number': doc_number, 'document': seen[doc_number]}
+                )
+            else:
+                seen[doc_number] = document
+
+        return cleaned_data
+
+    @staticmethod
+    def get_doc_number_field_name(document):
+        return 'doc_number_{}'.format(document.pk)
+
+    def get_doc_numbers(self):
+        """
+        Return a list of (document, doc number) tuples.
+        """
+        return [
+            (
+                document,
+                self.cleaned_data[self.get_doc_number_field_name(document)]
+            ) for document in self.document_list
+        ]
+
+
+class MembershipDeltaForm(forms.Form):
+    """
+    Multiple selection which also submits the selection as it was shown.
+
+    This allows the view to apply only what the user did add or remove.
+    Changes which have been made in parallel, e.g. by a workflow, are not
+    reverted by the submit.
+    """
+
+    choices_url_name = None
+    field_label = None
+    field_name = None
+
+    def __init__(self, *args, **kwargs):
+        queryset = kwargs.pop('queryset')
+        super().__init__(*args, **kwargs)
+
+        self.fields[self.field_name] = forms.ModelMultipleChoiceField(
+            label=self.field_label,
+            queryset=queryset,
+            required=False,
+            widget=AjaxSelectMultiple(url_name=self.choices_url_name),
+        )
+        self.fields['shown'] = forms.ModelMultipleChoiceField(
+            queryset=queryset,
+            required=False,
+            widget=forms.MultipleHiddenInput,
+        )
+
+    def get_added(self):
+        return set(self.cleaned_data[self.field_name]) - set(
+            self.cleaned_data['shown'])
+
+    def get_removed(self):
+        return set(self.cleaned_data['shown']) - set(
+            self.cleaned_data[self.field_name])
+
+
+class CabinetDeltaForm(MembershipDeltaForm):
+    choices_url_name = 'botech_edms:cabinet_choices'
+    field_label = _('Cabinets')
+    field_name = 'cabinets'
+
+
+class TagDeltaForm(MembershipDeltaForm):
+    choices_url_name = 'botech_edms:tag_choices'
+    field_label = _('Tags')
+    field_name = 'tags'
+
 
 class OptionalCommentForm(forms.Form):
 
@@ -41,7 +159,7 @@ class DocumentForm(forms.ModelForm):
         label=_('Document type'),
         help_text=_('Changes are applied automatically and the form will be reloaded.'),
         queryset=DocumentType.objects.order_by('label'),
-        widget=forms.Select(attrs={'class': 'select2'}),
+        widget=AjaxSelect(url_name='botech_edms:document_type_choices'),
     )
 
     class Meta:
@@ -49,8 +167,10 @@ class DocumentForm(forms.ModelForm):
         model = Document
 
     def __init__(self, *args, **kwargs):
+        queryset = kwargs.pop('document_type_queryset')
         super().__init__(*args, **kwargs)
 
+        self.fields['document_type'].queryset = queryset.order_by('label')
         self.fields['language'].widget = forms.Select(
             choices=get_language_choices(), attrs={
                 'class': 'select2'
@@ -58,6 +178,21 @@ class DocumentForm(forms.ModelForm):
         )
 
 
+class DocumentTypeRefreshForm(forms.Form):
+    """
+    Only the document type of the properties form.
+    """
+
+    document_type = forms.ModelChoiceField(
+        queryset=DocumentType.objects.none(), required=True)
+
+    def __init__(self, *args, **kwargs):
+        queryset = kwargs.pop('queryset')
+        super().__init__(*args, **kwargs)
+
+        self.fields['document_type'].queryset = queryset
+
+
 class DocumentMetadataForm(BaseDocumentMetadataForm):
 
     remove = forms.BooleanField(
@@ -0,0 +1,72 @@
+import logging
+
+from django.apps import apps
+from django.db import IntegrityError
+
+from .classes import (
+    metadata_type_resolver, stamp_cache_invalidator, stamp_data_provider,
+    update_stamp_transformation_arguments
+)
+
+logger = logging.getLogger(name=__name__)
+
+
+def handler_clear_metadata_type_resolver(sender, **kwargs):
+    metadata_type_resolver.clear()
+
+
+def handler_invalidate_stamp_data(sender, instance, **kwargs):
+    if instance.metadata_type_id not in metadata_type_resolver.get_ids(
+        *stamp_data_provider.setting_list
+    ):
+        return
+
+    stamp_data_provider.invalidate(document_id=instance.document_id)
+
+    if update_stamp_transformation_arguments(document_id=instance.document_id):
+        # The stamped values did change, the cached images of the stamped
+        # pages will not be used anymore.
+        stamp_cache_invalidator.invalidate(document_id=instance.document_id)
+
+
+def handler_sync_acct_doc_number(sender, instance, **kwargs):
+    AccountingDocumentNumber = apps.get_model(
+        app_label='edms', model_name='AccountingDocumentNumber')
+
+    if not AccountingDocumentNumber.objects.is_configured():
+        return
+
+    if instance.metadata_type_id in (
+        AccountingDocumentNumber.objects.get_metadata_type_ids()
+    ):
+        _sync_acct_doc_number(document_id=instance.document_id)
+
+
+def handler_sync_acct_doc_number_document_type(sender, instance, **kwargs):
+    AccountingDocumentNumber = apps.get_model(
+        app_label='edms', model_name='AccountingDocumentNumber')
+
+    if AccountingDocumentNumber.objects.is_configured():
+        _sync_acct_doc_number(document_id=instance.pk)
+
+
+def _sync_acct_doc_number(document_id):
+    AccountingDocumentNumber = apps.get_model(
+        app_label='edms', model_name='AccountingDocumentNumber')
+
+    try:
+        AccountingDocumentNumber.objects.sync_for_document(
+            document_id=document_id)
+    except IntegrityError:
+        if AccountingDocumentNumber.objects.is_enforcing_unique():
+            raise
+
+        # Note: The metadata views and the API of Mayan cannot report the
+        # duplicate, the edit is kept and the document is unregistered. The
+        # command "botech_rebuild_acct_doc_numbers" lists such documents.
+        logger.warning(
+            'Document number of document %s is already registered for '
+            'another document, the document is not registered.', document_id
+        )
+        AccountingDocumentNumber.objects.filter(
+            document_id=document_id).delete()
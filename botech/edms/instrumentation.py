@@ -0,0 +1,226 @@
+import collections
+import contextlib
+import functools
+import json
+import logging
+import threading
+import time
+
+from django.db import connection
+
+from .settings import setting_view_instrumentation
+
+logger = logging.getLogger(name=__name__)
+
+# Name of the metric and its help text per counter of a phase.
+PHASE_METRICS = (
+    ('calls', 'botech_view_phase_calls_total', 'Number of runs of the phase.'),
+    (
+        'seconds', 'botech_view_phase_seconds_total',
+        'Time spent in the phase, including nested phases.'
+    ),
+    (
+        'queries', 'botech_view_phase_queries_total',
+        'Number of SQL queries run directly in the phase.'
+    ),
+    (
+        'query_seconds', 'botech_view_phase_query_seconds_total',
+        'Time spent in SQL queries run directly in the phase.'
+    ),
+)
+
+
+class RequestMetrics:
+    """
+    Timings and SQL queries of the phases of one request.
+
+    Phases can be nested, the time of a phase includes its nested phases.
+    A query is counted for the innermost phase which is running.
+    """
+
+    def __init__(self, view_name):
+        self.view_name = view_name
+        self.phases = {}
+        self._stack = []
+
+    def as_dict(self):
+        return {
+            'phases': self.phases,
+            'queries': sum(phase['queries'] for phase in self.phases.values()),
+            'view': self.view_name,
+        }
+
+    def get_phase(self, name):
+        return self.phases.setdefault(
+            name, {
+                'calls': 0, 'queries': 0, 'query_seconds': 0.0, 'seconds': 0.0
+            }
+        )
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self._stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._stack.pop()
+            phase = self.get_phase(name=name)
+            phase['calls'] += 1
+            phase['seconds'] += elapsed
+
+    def query_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            phase = self.get_phase(
+                name=self._stack[-1] if self._stack else 'other'
+            )
+            phase['queries'] += 1
+            phase['query_seconds'] += elapsed
+
+
+class ViewMetricsRegistry:
+    """
+    Sums of the request metrics per view and phase of this process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._phases = collections.defaultdict(
+            lambda: collections.defaultdict(float)
+        )
+
+    def add(self, request_metrics):
+        with self._lock:
+            for name, values in request_metrics.phases.items():
+                phase = self._phases[(request_metrics.view_name, name)]
+                for key, value in values.items():
+                    phase[key] += value
+
+    def clear(self):
+        with self._lock:
+            self._phases.clear()
+
+    def render_prometheus(self):
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            phases = sorted(self._phases.items())
+
+        lines = []
+        for key, metric_name, help_text in PHASE_METRICS:
+            lines.append('# HELP {} {}'.format(metric_name, help_text))
+            lines.append('# TYPE {} counter'.format(metric_name))
+            for (view_name, phase_name), values in phases:
+                lines.append(
+                    '{}{{view="{}",phase="{}"}} {}'.format(
+                        metric_name, view_name, phase_name, values[key]
+                    )
+                )
+
+        return '\n'.join(lines) + '\n'
+
+
+view_metrics = ViewMetricsRegistry()
+
+
+class InstrumentedViewMixin:
+    """
+    Records the timings and SQL queries of the phases of a request if the
+    setting "BOTECH_VIEW_INSTRUMENTATION" is enabled.
+
+    The phases are "dispatch", "form.<name>" for the construction of each
+    form, "get_initial__<name>", "validation", each "form_valid_<name>"
+    and "render". Every request is logged as one JSON line and summed up in
+    "view_metrics".
+    """
+
+    instrumented_method_prefixes = ('form_valid_', 'get_initial__')
+
+    def setup(self, request, *args, **kwargs):
+        super().setup(request, *args, **kwargs)
+
+        self.request_metrics = None
+        if setting_view_instrumentation.value:
+            self.request_metrics = RequestMetrics(
+                view_name=self.__class__.__name__)
+            self._instrument_methods()
+
+    def instrument(self, phase):
+        """
+        Return a context manager which records "phase", does nothing if the
+        instrumentation is disabled.
+        """
+        if self.request_metrics is None:
+            return contextlib.nullcontext()
+
+        return self.request_metrics.phase(name=phase)
+
+    def _instrument_methods(self):
+        # Note: The wrappers are set on the instance, so that the methods of
+        # the subclasses are covered as well, including "dispatch".
+        self.dispatch = self._wrap_dispatch(method=self.dispatch)
+        if hasattr(self, '_create_form'):
+            self._create_form = self._wrap_create_form(
+                method=self._create_form)
+        self.render_to_response = self._wrap_render_to_response(
+            method=self.render_to_response)
+
+        for name in dir(self):
+            if name.startswith(self.instrumented_method_prefixes):
+                method = getattr(self, name)
+                if callable(method):
+                    method = self._wrap_method(method=method, phase=name)
+                    setattr(self, name, method)
+
+    def _wrap_create_form(self, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            form_name = kwargs.get('form_name', args[0] if args else '')
+            with self.instrument(phase='form.{}'.format(form_name)):
+                return method(*args, **kwargs)
+
+        return wrapper
+
+    def _wrap_dispatch(self, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            with connection.execute_wrapper(
+                self.request_metrics.query_wrapper
+            ):
+                with self.instrument(phase='dispatch'):
+                    response = method(*args, **kwargs)
+
+            view_metrics.add(request_metrics=self.request_metrics)
+            logger.info(json.dumps(self.request_metrics.as_dict()))
+
+            return response
+
+        return wrapper
+
+    def _wrap_method(self, method, phase):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            with self.instrument(phase=phase):
+                return method(*args, **kwargs)
+
+        return wrapper
+
+    def _wrap_render_to_response(self, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            with self.instrument(phase='render'):
+                response = method(*args, **kwargs)
+                # Note: A TemplateResponse is rendered lazily after the view
+                # returned, it is rendered here to be measured.
+                if hasattr(response, 'render'):
+                    response.render()
+
+            return response
+
+        return wrapper
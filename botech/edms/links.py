@@ -8,8 +8,36 @@ link_acct_document_edit_view = Link(
     view='botech_edms:document_acct_edit_view'
 )
 
+link_acct_document_multiple_book = Link(
+    text=_('Book for Accounting'),
+    view='botech_edms:document_multiple_acct_book'
+)
+
+link_booked_document_export_csv = Link(
+    text=_('Export booked documents (CSV)'),
+    query={'format': '"csv"'},
+    view='botech_edms:booked_document_export'
+)
+
+link_booked_document_export_jsonl = Link(
+    text=_('Export booked documents (JSON lines)'),
+    query={'format': '"jsonl"'},
+    view='botech_edms:booked_document_export'
+)
+
+link_pre_process_cabinet_queue_start = Link(
+    args='resolved_object.id',
+    text=_('Pre process documents'),
+    view='botech_edms:cabinet_pre_process_queue_start'
+)
+
 link_pre_process_document_edit_view = Link(
     args='resolved_object.id',
     text=_('Pre process document'),
     view='botech_edms:document_pre_process_view'
 )
+
+link_pre_process_document_multiple_queue_start = Link(
+    text=_('Pre process documents'),
+    view='botech_edms:document_multiple_pre_process_queue_start'
+)
@@ -1,3 +1,6 @@
+import os
+import tempfile
+
 
 DEFAULT_BOTECH_BOOKED_TAG = 'Booked'
 
@@ -7,3 +10,21 @@ DEFAULT_ACCT_DOC_NUMBER = 'acct_doc_number'
 DEFAULT_ACCT_ENTITY = 'acct_entity'
 DEFAULT_ACCT_FISCAL_YEAR = 'acct_fiscal_year'
 DEFAULT_ACCT_NUMBER_RANGE = 'acct_number_range'
+
+DEFAULT_ACCT_ALLOCATED_NUMBER_RANGES = {}
+DEFAULT_ACCT_DOC_NUMBER_UNIQUE_EXEMPT_DOCUMENT_TYPES = []
+
+DEFAULT_BOTECH_STAMP_OVERLAY_CACHE_DIRECTORY = os.path.join(
+    tempfile.gettempdir(), 'botech_stamp_overlays')
+DEFAULT_BOTECH_STAMP_OVERLAY_CACHE_DIRECTORY_MAXIMUM_SIZE = 512 * 1024 * 1024
+DEFAULT_BOTECH_STAMP_OVERLAY_CACHE_MAXIMUM_SIZE = 64 * 1024 * 1024
+
+DEFAULT_BOTECH_VIEW_INSTRUMENTATION = False
+DEFAULT_BOTECH_VIEW_METRICS_TOKEN = None
+
+DEFAULT_BOTECH_PROFILER_DIRECTORY = os.path.join(
+    tempfile.gettempdir(), 'botech_profiles')
+DEFAULT_BOTECH_PROFILER_DIRECTORY_MAXIMUM_FILES = 200
+DEFAULT_BOTECH_PROFILER_RENDER_RATE = 0
+DEFAULT_BOTECH_PROFILER_REQUEST_RATE = 0
+DEFAULT_BOTECH_PROFILER_SAMPLE_INTERVAL = 0.005
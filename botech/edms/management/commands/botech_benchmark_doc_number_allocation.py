@@ -0,0 +1,120 @@
+import threading
+import time
+import uuid
+
+from django.core import management
+from django.db import connection, transaction
+
+from ...models import AccountingNumberSequence
+
+
+class Command(management.BaseCommand):
+    help = (
+        'Measure the document number allocation with many parallel '
+        'allocations on the same number range.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--allocations', default=100, type=int,
+            help='Number of allocations per worker.'
+        )
+        parser.add_argument(
+            '--hold', default=0.0, type=float,
+            help=(
+                'Seconds each transaction waits after the allocation, '
+                'simulates the remainder of a booking.'
+            )
+        )
+        parser.add_argument(
+            '--number-range', required=True,
+            help=(
+                'An allocated number range from '
+                'BOTECH_ACCT_ALLOCATED_NUMBER_RANGES.'
+            )
+        )
+        parser.add_argument(
+            '--workers', default=8, type=int,
+            help='Number of parallel workers, each with its own connection.'
+        )
+
+    def handle(self, *args, **options):
+        number_range = options['number_range']
+        if not AccountingNumberSequence.objects.get_number_format(
+            number_range=number_range
+        ):
+            raise management.CommandError(
+                'Number range "{}" is not allocated by the EDMS.'.format(
+                    number_range
+                )
+            )
+
+        # Note: A separate entity keeps the benchmark away from real numbers.
+        key = {
+            'entity': 'benchmark-{}'.format(uuid.uuid4().hex),
+            'fiscal_year': '', 'number_range': number_range
+        }
+        numbers = []
+        waits = []
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                for index in range(options['allocations']):
+                    start = time.perf_counter()
+                    with transaction.atomic():
+                        number = AccountingNumberSequence.objects.allocate(
+                            **key)
+                        wait = time.perf_counter() - start
+                        time.sleep(options['hold'])
+                    with lock:
+                        numbers.append(number)
+                        waits.append(wait)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=worker) for index in range(
+                options['workers']
+            )
+        ]
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        sequence = AccountingNumberSequence.objects.get(**key)
+        sequence.delete()
+
+        expected = options['workers'] * options['allocations']
+        waits.sort()
+        self.stdout.write(
+            'Allocated {} numbers in {:.2f}s, {:.1f} per second.'.format(
+                len(numbers), elapsed, len(numbers) / elapsed
+            )
+        )
+        if waits:
+            self.stdout.write(
+                'Wait for the lock: median {:.1f}ms, 95th percentile '
+                '{:.1f}ms, maximum {:.1f}ms.'.format(
+                    waits[len(waits) // 2] * 1000,
+                    waits[int(len(waits) * 0.95)] * 1000,
+                    waits[-1] * 1000
+                )
+            )
+
+        if sequence.next_number - 1 != expected:
+            raise management.CommandError(
+                'Expected {} allocations, the sequence did advance by '
+                '{}.'.format(expected, sequence.next_number - 1)
+            )
+
+        if len(set(numbers)) != expected:
+            raise management.CommandError(
+                'Expected {} distinct numbers, got {}.'.format(
+                    expected, len(set(numbers))
+                )
+            )
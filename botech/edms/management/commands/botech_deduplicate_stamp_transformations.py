@@ -0,0 +1,73 @@
+from django.apps import apps
+from django.core import management
+from django.db import transaction
+from django.db.models import Count
+
+from ...transformations import TransformationStampAccountingMetadata
+
+
+class Command(management.BaseCommand):
+    help = (
+        'Remove the surplus copies of the stamp transformation, so that each '
+        'page carries the stamp at most once.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report what would be removed.'
+        )
+
+    def handle(self, *args, **options):
+        LayerTransformation = apps.get_model(
+            app_label='converter', model_name='LayerTransformation')
+
+        queryset = LayerTransformation.objects.filter(
+            name=TransformationStampAccountingMetadata.name
+        )
+        object_layer_ids = list(
+            queryset.values('object_layer_id').annotate(
+                count=Count('pk')
+            ).filter(count__gt=1).values_list('object_layer_id', flat=True)
+        )
+
+        surplus_ids = []
+        kept_object_layer_id = None
+        for layer_transformation in queryset.filter(
+            object_layer_id__in=object_layer_ids
+        ).order_by('object_layer_id', 'order', 'pk').only(
+            'pk', 'object_layer_id'
+        ):
+            # Note: The first transformation per layer is kept.
+            if layer_transformation.object_layer_id == kept_object_layer_id:
+                surplus_ids.append(layer_transformation.pk)
+            else:
+                kept_object_layer_id = layer_transformation.object_layer_id
+
+        if not options['dry_run'] and surplus_ids:
+            with transaction.atomic():
+                LayerTransformation.objects.filter(pk__in=surplus_ids).delete()
+
+            self.purge_cached_images(object_layer_ids=object_layer_ids)
+
+        self.stdout.write(
+            '{} {} surplus stamp transformations on {} pages. Rendering each '
+            'of these pages once runs {} stamp transformations less.'.format(
+                'Would remove' if options['dry_run'] else 'Removed',
+                len(surplus_ids), len(object_layer_ids), len(surplus_ids)
+            )
+        )
+
+    def purge_cached_images(self, object_layer_ids):
+        ObjectLayer = apps.get_model(
+            app_label='converter', model_name='ObjectLayer')
+
+        # Note: The cached images still show the stacked stamps.
+        for object_layer in ObjectLayer.objects.filter(
+            pk__in=object_layer_ids
+        ).prefetch_related('content_object'):
+            content_object = object_layer.content_object
+            if content_object is not None and hasattr(
+                content_object, 'cache_partition'
+            ):
+                content_object.cache_partition.purge()
@@ -0,0 +1,39 @@
+import sys
+
+from django.core import management
+
+from ...exports import EXPORT_FORMATS, iter_booked_documents
+
+
+class Command(management.BaseCommand):
+    help = (
+        'Export all booked documents with their accounting metadata for the '
+        'reconciliation with the accounting system.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', choices=sorted(EXPORT_FORMATS), default='csv',
+            help='Output format, CSV or JSON lines.'
+        )
+        parser.add_argument(
+            '--output', default='-',
+            help='File to write into, "-" for standard output.'
+        )
+
+    def handle(self, *args, **options):
+        iter_lines = EXPORT_FORMATS[options['format']][0]
+
+        if options['output'] == '-':
+            file_object = sys.stdout
+        else:
+            file_object = open(
+                options['output'], mode='w', encoding='utf-8', newline=''
+            )
+
+        try:
+            for line in iter_lines(rows=iter_booked_documents()):
+                file_object.write(line)
+        finally:
+            if file_object is not sys.stdout:
+                file_object.close()
@@ -0,0 +1,342 @@
+import collections
+import csv
+import itertools
+import json
+import os
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core import management
+from django.db import transaction
+
+from mayan.apps.documents.models import Document
+
+from ...accounting import Booking, book_documents
+
+MATCH_FIELDS = ('document_id', 'label', 'uuid')
+
+
+class Command(management.BaseCommand):
+    help = (
+        'Import document numbers and booked dates from a CSV export of the '
+        'accounting system and book the matching documents.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file to import.')
+        parser.add_argument(
+            '--batch-size', default=100, type=int,
+            help='Number of rows booked per transaction.'
+        )
+        parser.add_argument(
+            '--booked-date-column', default='booked_date',
+            help='Column with the booked date.'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help=(
+                'File which records the progress. An interrupted import '
+                'continues after the last committed batch.'
+            )
+        )
+        parser.add_argument(
+            '--delimiter', default=',', help='Delimiter of the CSV file.'
+        )
+        parser.add_argument(
+            '--doc-number-column', default='doc_number',
+            help='Column with the document number.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help=(
+                'Check all rows, but roll back every batch. Duplicates '
+                'within the file are found as well.'
+            )
+        )
+        parser.add_argument(
+            '--match-column', default='document_id',
+            help='Column which identifies the document.'
+        )
+        parser.add_argument(
+            '--match-field', choices=MATCH_FIELDS, default='document_id',
+            help='Document field which the match column is compared to.'
+        )
+        parser.add_argument(
+            '--username',
+            help='User recorded as the actor of the events.'
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.user = None
+        if options['username']:
+            self.user = get_user_model().objects.get(
+                username=options['username'])
+
+        start_line = self.read_checkpoint()
+        if start_line:
+            self.stdout.write(
+                'Continuing after line {}.'.format(start_line)
+            )
+
+        self.counts = {'booked': 0, 'errors': 0, 'rows': 0}
+        self.start_time = time.perf_counter()
+
+        # Note: Duplicates are searched in the whole file up front, the
+        # batches are committed or, in a dry run, rolled back one by one and
+        # cannot see each other.
+        self.duplicates = self.find_duplicates()
+
+        with open(
+            options['path'], encoding='utf-8-sig', newline=''
+        ) as file_object:
+            reader = self.get_reader(file_object=file_object)
+
+            # Note: The line number of a row is the one of its last line,
+            # which is what the checkpoint records.
+            rows = (
+                (reader.line_num, row) for row in reader
+            )
+            rows = (
+                (line, row) for line, row in rows if line > start_line
+            )
+
+            while True:
+                batch = list(
+                    itertools.islice(rows, options['batch_size'])
+                )
+                if not batch:
+                    break
+
+                self.import_batch(batch=batch)
+
+                if not options['dry_run']:
+                    self.write_checkpoint(line=batch[-1][0])
+                self.write_progress()
+
+        self.stdout.write(
+            '{} rows, {} documents booked, {} errors{}.'.format(
+                self.counts['rows'], self.counts['booked'],
+                self.counts['errors'],
+                ' (dry run, nothing was saved)' if options['dry_run'] else ''
+            )
+        )
+
+    def find_duplicates(self):
+        """
+        Return a dictionary of line number to error message for the rows
+        which repeat the document number or the document of an earlier row.
+        """
+        duplicates = {}
+        seen = {'doc_number': {}, 'match': {}}
+
+        with open(
+            self.options['path'], encoding='utf-8-sig', newline=''
+        ) as file_object:
+            reader = self.get_reader(file_object=file_object)
+            for row in reader:
+                for key, column, template in (
+                    (
+                        'doc_number', self.options['doc_number_column'],
+                        'Document number "{value}" is also on line {line}.'
+                    ),
+                    (
+                        'match', self.options['match_column'],
+                        'Document "{value}" is also on line {line}.'
+                    ),
+                ):
+                    value = row[column].strip()
+                    if key == 'match':
+                        value = self.clean_value(value=value)
+                    if not value:
+                        continue
+
+                    line = seen[key].setdefault(value, reader.line_num)
+                    if line != reader.line_num:
+                        duplicates.setdefault(
+                            reader.line_num, template.format(
+                                line=line, value=value
+                            )
+                        )
+
+        return duplicates
+
+    def get_documents(self, values):
+        """
+        Return a dictionary of cleaned value to the list of valid documents
+        matching it.
+        """
+        match_field = self.options['match_field']
+        if match_field == 'document_id':
+            match_field = 'pk'
+
+        documents = collections.defaultdict(list)
+        valid_values = [value for value in values if value is not None]
+        if valid_values:
+            for document in Document.valid.filter(
+                **{'{}__in'.format(match_field): valid_values}
+            ):
+                documents[str(getattr(document, match_field))].append(
+                    document
+                )
+
+        return documents
+
+    def get_reader(self, file_object):
+        reader = csv.DictReader(
+            file_object, delimiter=self.options['delimiter']
+        )
+        for column in (
+            self.options['booked_date_column'],
+            self.options['doc_number_column'],
+            self.options['match_column'],
+        ):
+            if column not in (reader.fieldnames or ()):
+                raise management.CommandError(
+                    'Column "{}" is missing.'.format(column)
+                )
+
+        return reader
+
+    def import_batch(self, batch):
+        raw_values = [
+            row[self.options['match_column']].strip() for line, row in batch
+        ]
+        values = [self.clean_value(value=value) for value in raw_values]
+        documents = self.get_documents(values=values)
+
+        bookings = []
+        lines = {}
+        for (line, row), raw_value, value in zip(batch, raw_values, values):
+            self.counts['rows'] += 1
+
+            if line in self.duplicates:
+                self.report_error(line=line, message=self.duplicates[line])
+                continue
+
+            if value is None:
+                self.report_error(
+                    line=line, message='"{}" is not a valid {}.'.format(
+                        raw_value, self.options['match_field']
+                    )
+                )
+                continue
+
+            matches = documents.get(value, ())
+            if not matches:
+                self.report_error(
+                    line=line, message='No document matches "{}".'.format(
+                        raw_value
+                    )
+                )
+                continue
+
+            if len(matches) > 1:
+                # Note: Labels are not unique, guessing would book the
+                # wrong document.
+                self.report_error(
+                    line=line, message='"{}" matches {} documents.'.format(
+                        raw_value, len(matches)
+                    )
+                )
+                continue
+
+            document = matches[0]
+            if document.pk in lines:
+                self.report_error(
+                    line=line, message='{} is also on line {}.'.format(
+                        document, lines[document.pk]
+                    )
+                )
+                continue
+
+            booking = Booking(
+                document=document,
+                doc_number=row[self.options['doc_number_column']].strip(),
+                booked_date=row[self.options['booked_date_column']].strip()
+            )
+            if not booking.doc_number:
+                self.report_error(line=line, message='Empty document number.')
+                continue
+
+            bookings.append(booking)
+            lines[document.pk] = line
+
+        with transaction.atomic():
+            results = book_documents(bookings=bookings, user=self.user)
+            if self.options['dry_run']:
+                transaction.set_rollback(True)
+
+        for result in results:
+            if result.error:
+                self.report_error(
+                    line=lines[result.document.pk], message='{}: {}'.format(
+                        result.document, result.error
+                    )
+                )
+            else:
+                self.counts['booked'] += 1
+
+    def clean_value(self, value):
+        """
+        Return the value of the match column in the form of the match field
+        or None if it is not valid for it.
+        """
+        match_field = self.options['match_field']
+        if match_field == 'document_id':
+            # Note: Compared as the text of the id, "007" is document 7.
+            try:
+                return str(int(value))
+            except ValueError:
+                return None
+        elif match_field == 'uuid':
+            try:
+                return str(uuid.UUID(value))
+            except ValueError:
+                return None
+
+        return value or None
+
+    def read_checkpoint(self):
+        path = self.options['checkpoint']
+        if not path or not os.path.exists(path):
+            return 0
+
+        with open(path) as file_object:
+            checkpoint = json.load(file_object)
+
+        if checkpoint['path'] != os.path.abspath(self.options['path']):
+            raise management.CommandError(
+                'The checkpoint belongs to "{}".'.format(checkpoint['path'])
+            )
+
+        return checkpoint['line']
+
+    def report_error(self, line, message):
+        self.counts['errors'] += 1
+        self.stderr.write('Line {}: {}'.format(line, message))
+
+    def write_checkpoint(self, line):
+        path = self.options['checkpoint']
+        if not path:
+            return
+
+        temporary_path = '{}.tmp'.format(path)
+        with open(temporary_path, mode='w') as file_object:
+            json.dump(
+                {
+                    'line': line,
+                    'path': os.path.abspath(self.options['path'])
+                }, file_object
+            )
+        os.replace(temporary_path, path)
+
+    def write_progress(self):
+        elapsed = time.perf_counter() - self.start_time
+        self.stdout.write(
+            '{} rows, {} booked, {} errors, {:.1f} rows per second.'.format(
+                self.counts['rows'], self.counts['booked'],
+                self.counts['errors'], self.counts['rows'] / elapsed
+            )
+        )
@@ -0,0 +1,26 @@
+from django.core import management
+
+from ...models import AccountingDocumentNumber
+
+
+class Command(management.BaseCommand):
+    help = (
+        'Rebuild the registry of accounting document numbers from the '
+        'document metadata.'
+    )
+
+    def handle(self, *args, **options):
+        count, duplicates = AccountingDocumentNumber.objects.rebuild()
+
+        for document_id, doc_number in duplicates:
+            self.stderr.write(
+                'Duplicate document number "{}" of document {}.'.format(
+                    doc_number, document_id
+                )
+            )
+
+        self.stdout.write(
+            'Registered {} document numbers, {} duplicates.'.format(
+                count, len(duplicates)
+            )
+        )
@@ -0,0 +1,155 @@
+import contextlib
+import multiprocessing
+import os
+import time
+import traceback
+
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.core import management
+from django.db import connections
+
+from mayan.apps.converter.transformations import TransformationResize
+from mayan.apps.documents.settings import (
+    setting_preview_height,
+    setting_preview_width)
+
+from ...classes import get_stamp_only_page_ids
+from ...transformation_mixins import stamp_output_size
+from ...transformations import TransformationStampAccountingMetadata
+
+
+def get_stamped_page_ids(document_ids=None):
+    DocumentVersionPage = apps.get_model(
+        app_label='documents', model_name='DocumentVersionPage')
+    LayerTransformation = apps.get_model(
+        app_label='converter', model_name='LayerTransformation')
+
+    queryset = DocumentVersionPage.objects.filter(
+        pk__in=LayerTransformation.objects.filter(
+            name=TransformationStampAccountingMetadata.name,
+            object_layer__content_type=ContentType.objects.get_for_model(
+                model=DocumentVersionPage)
+        ).values('object_layer__object_id')
+    )
+    if document_ids:
+        queryset = queryset.filter(
+            document_version__document_id__in=document_ids)
+
+    return list(queryset.order_by('pk').values_list('pk', flat=True))
+
+
+def restamp_page(page_id, preview=False):
+    """
+    Evict the cached images of the page and render it again.
+
+    Returns the page id and None or the formatted exception.
+    """
+    DocumentVersionPage = apps.get_model(
+        app_label='documents', model_name='DocumentVersionPage')
+
+    try:
+        page = DocumentVersionPage.objects.get(pk=page_id)
+        page.cache_partition.purge()
+        page.generate_image(transformation_instance_list=None)
+        if preview:
+            # Note: The stamp of the preview is drawn at the preview size
+            # where no other transformation follows it.
+            if get_stamp_only_page_ids(page_ids=(page.pk,)):
+                context = stamp_output_size.request(
+                    height=setting_preview_height.value,
+                    width=setting_preview_width.value
+                )
+            else:
+                context = contextlib.nullcontext()
+
+            with context:
+                page.generate_image(
+                    transformation_instance_list=(
+                        TransformationResize(
+                            height=setting_preview_height.value,
+                            width=setting_preview_width.value
+                        ),
+                    )
+                )
+    except Exception:
+        return page_id, traceback.format_exc()
+
+    return page_id, None
+
+
+def _restamp_page_star(arguments):
+    return restamp_page(*arguments)
+
+
+class Command(management.BaseCommand):
+    help = (
+        'Render the stamped pages of all booked documents again, e.g. after '
+        'the stamp layout has changed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--document-id', action='append', dest='document_ids', type=int,
+            help='Limit to the given document, can be repeated.'
+        )
+        parser.add_argument(
+            '--preview', action='store_true',
+            help='Also render the page in the preview size.'
+        )
+        parser.add_argument(
+            '--workers', default=os.cpu_count(), type=int,
+            help='Number of worker processes.'
+        )
+
+    def handle(self, *args, **options):
+        page_ids = get_stamped_page_ids(document_ids=options['document_ids'])
+        self.stdout.write('Re-stamping {} pages.'.format(len(page_ids)))
+
+        arguments = [(page_id, options['preview']) for page_id in page_ids]
+        start = time.perf_counter()
+
+        if options['workers'] > 1:
+            # Note: The forked workers must not share the database
+            # connections of the parent, each opens its own.
+            connections.close_all()
+            context = multiprocessing.get_context('fork')
+            with context.Pool(processes=options['workers']) as pool:
+                failures = self.collect(
+                    results=pool.imap_unordered(
+                        _restamp_page_star, arguments, chunksize=4
+                    ), start=start, total=len(page_ids)
+                )
+        else:
+            failures = self.collect(
+                results=map(_restamp_page_star, arguments), start=start,
+                total=len(page_ids)
+            )
+
+        elapsed = time.perf_counter() - start
+        for page_id, error in failures:
+            self.stderr.write('Page {} failed:\n{}'.format(page_id, error))
+
+        self.stdout.write(
+            'Re-stamped {} pages in {:.1f}s, {:.1f} pages per second, {} '
+            'failures.'.format(
+                len(page_ids) - len(failures), elapsed,
+                len(page_ids) / elapsed if elapsed else 0, len(failures)
+            )
+        )
+
+    def collect(self, results, start, total):
+        failures = []
+        for index, (page_id, error) in enumerate(results, start=1):
+            if error:
+                failures.append((page_id, error))
+
+            if index % 100 == 0:
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    '{}/{} pages, {:.1f} pages per second.'.format(
+                        index, total, index / elapsed
+                    )
+                )
+
+        return failures
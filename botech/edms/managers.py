@@ -0,0 +1,277 @@
+import contextlib
+import logging
+import re
+import string
+import threading
+
+from django.apps import apps
+from django.db import IntegrityError, models, transaction
+
+from .classes import metadata_type_resolver
+from .settings import (
+    setting_acct_allocated_number_ranges,
+    setting_acct_doc_number,
+    setting_acct_doc_number_unique_exempt_document_types,
+    setting_acct_entity,
+    setting_acct_fiscal_year,
+    setting_acct_number_range,
+)
+
+logger = logging.getLogger(name=__name__)
+
+
+class AccountingDocumentNumberManager(models.Manager):
+    setting_list = (
+        setting_acct_entity,
+        setting_acct_fiscal_year,
+        setting_acct_number_range,
+        setting_acct_doc_number,
+    )
+
+    # Note: Shared by all instances of the manager, the flag is per thread.
+    _local = threading.local()
+
+    @contextlib.contextmanager
+    def enforce_unique(self):
+        """
+        Let the signal handlers raise IntegrityError for a duplicate number
+        inside the block, the caller reports it to the user. Outside of it a
+        duplicate is logged and the document is left unregistered.
+        """
+        previous = self.is_enforcing_unique()
+        self._local.enforce_unique = True
+        try:
+            yield
+        finally:
+            self._local.enforce_unique = previous
+
+    def get_metadata_type_ids(self):
+        return metadata_type_resolver.get_ids(*self.setting_list)
+
+    def is_configured(self):
+        """
+        Return True if the metadata type of the document number exists.
+        """
+        return metadata_type_resolver.get_id(
+            setting=setting_acct_doc_number
+        ) is not None
+
+    def is_enforcing_unique(self):
+        return getattr(self._local, 'enforce_unique', False)
+
+    def rebuild(self):
+        """
+        Synchronize the registry with the metadata of all documents.
+
+        Returns the number of registered documents and a list of
+        (document id, doc number) tuples which are duplicates.
+        """
+        Document = apps.get_model(app_label='documents', model_name='Document')
+        DocumentMetadata = apps.get_model(
+            app_label='metadata', model_name='DocumentMetadata')
+
+        document_ids = set(
+            DocumentMetadata.objects.filter(
+                metadata_type_id=metadata_type_resolver.get_id(
+                    setting=setting_acct_doc_number)
+            ).values_list('document_id', flat=True)
+        )
+
+        # Note: Entries of documents which lost their number are removed
+        # upfront, they would block the numbers of the other documents.
+        self.exclude(document_id__in=document_ids).delete()
+
+        count = 0
+        duplicates = []
+        for document_id in Document.objects.filter(
+            pk__in=document_ids
+        ).order_by('pk').values_list('pk', flat=True).iterator():
+            try:
+                registered = self.sync_for_document(document_id=document_id)
+            except IntegrityError:
+                duplicates.append(
+                    (document_id, self.get_values(document_id=document_id)[3])
+                )
+            else:
+                if registered:
+                    count += 1
+
+        return count, duplicates
+
+    def get_values(self, document_id):
+        """
+        Return entity, fiscal year, number range and doc number of the
+        document.
+        """
+        DocumentMetadata = apps.get_model(
+            app_label='metadata', model_name='DocumentMetadata')
+
+        metadata_type_ids = self.get_metadata_type_ids()
+        values = dict(
+            DocumentMetadata.objects.filter(
+                document_id=document_id, metadata_type_id__in=metadata_type_ids
+            ).values_list('metadata_type_id', 'value')
+        )
+
+        return [
+            values.get(metadata_type_id) or ''
+            for metadata_type_id in metadata_type_ids
+        ]
+
+    def is_exempt(self, document_id):
+        Document = apps.get_model(app_label='documents', model_name='Document')
+
+        exempt_labels = (
+            setting_acct_doc_number_unique_exempt_document_types.value or ()
+        )
+        if not exempt_labels:
+            return False
+
+        return Document.objects.filter(
+            pk=document_id, document_type__label__in=exempt_labels
+        ).exists()
+
+    def sync_for_document(self, document_id):
+        """
+        Bring the entry of the document in line with its metadata.
+
+        Raises IntegrityError if the number is already registered for
+        another document. Returns the entry or None if the document is not
+        registered.
+        """
+        entity, fiscal_year, number_range, doc_number = self.get_values(
+            document_id=document_id)
+
+        if not doc_number or self.is_exempt(document_id=document_id):
+            self.filter(document_id=document_id).delete()
+            return None
+
+        # Note: The savepoint keeps a surrounding transaction usable, the
+        # caller decides what a duplicate means.
+        with transaction.atomic():
+            instance, created = self.update_or_create(
+                document_id=document_id, defaults={
+                    'doc_number': doc_number,
+                    'entity': entity,
+                    'fiscal_year': fiscal_year,
+                    'number_range': number_range,
+                }
+            )
+
+        return instance
+
+
+class AccountingNumberSequenceManager(models.Manager):
+    def allocate(self, entity, fiscal_year, number_range):
+        """
+        Return the next document number of the number range.
+
+        Has to be called inside of the transaction which stores the number,
+        the sequence row stays locked until it ends. A rolled back booking
+        also gives back its number.
+        """
+        number_format = self.get_number_format(number_range=number_range)
+        if not number_format:
+            return None
+
+        key = {
+            'entity': entity, 'fiscal_year': fiscal_year,
+            'number_range': number_range
+        }
+
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    self.get_or_create(**key)
+            except IntegrityError:
+                # Note: Created by a parallel allocation in the meantime.
+                pass
+
+            sequence = self.select_for_update().get(**key)
+            number = self.get_free_number(
+                number=sequence.next_number, number_format=number_format,
+                **key
+            )
+            sequence.next_number = number + 1
+            sequence.save(update_fields=('next_number',))
+
+        return number_format.format(number=number, **key)
+
+    def get_free_number(self, number, number_format, **key):
+        """
+        Return "number" or, if it is registered already, the number after
+        the highest registered number of the number range.
+
+        Numbers can also be entered by hand or imported, the sequence does
+        not know about these.
+        """
+        AccountingDocumentNumber = apps.get_model(
+            app_label='edms', model_name='AccountingDocumentNumber')
+
+        registered = AccountingDocumentNumber.objects.filter(**key)
+        if not registered.filter(
+            doc_number=number_format.format(number=number, **key)
+        ).exists():
+            return number
+
+        pattern = _get_number_pattern(number_format=number_format, **key)
+        highest = 0
+        for doc_number in registered.values_list(
+            'doc_number', flat=True
+        ).iterator():
+            match = pattern.fullmatch(doc_number)
+            if match:
+                highest = max(highest, int(match.group('number')))
+
+        return max(number, highest + 1)
+
+    def get_number_format(self, number_range):
+        return (setting_acct_allocated_number_ranges.value or {}).get(
+            number_range
+        )
+
+    def peek(self, entity, fiscal_year, number_range):
+        """
+        Return the number which the next allocation would return, without
+        reserving it.
+        """
+        number_format = self.get_number_format(number_range=number_range)
+        if not number_format:
+            return None
+
+        key = {
+            'entity': entity, 'fiscal_year': fiscal_year,
+            'number_range': number_range
+        }
+        number = self.get_free_number(
+            number=self.filter(**key).values_list(
+                'next_number', flat=True
+            ).first() or 1, number_format=number_format, **key
+        )
+
+        return number_format.format(number=number, **key)
+
+
+def _get_number_pattern(number_format, **key):
+    """
+    Return a regular expression which matches the document numbers of the
+    format and captures the sequence number as "number".
+    """
+    parts = []
+    has_number = False
+    for literal, field_name, format_spec, conversion in (
+        string.Formatter().parse(number_format)
+    ):
+        parts.append(re.escape(literal))
+        if field_name is None:
+            continue
+
+        if field_name == 'number':
+            parts.append(r'(?P=number)' if has_number else r'(?P<number>\d+)')
+            has_number = True
+        else:
+            parts.append(
+                re.escape(format(key[field_name], format_spec or ''))
+            )
+
+    return re.compile(''.join(parts))
@@ -0,0 +1,64 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('documents', '__first__'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountingDocumentNumber',
+            fields=[
+                (
+                    'id', models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False,
+                        verbose_name='ID'
+                    )
+                ),
+                (
+                    'entity', models.CharField(
+                        blank=True, max_length=255, verbose_name='Entity'
+                    )
+                ),
+                (
+                    'fiscal_year', models.CharField(
+                        blank=True, max_length=255, verbose_name='Fiscal year'
+                    )
+                ),
+                (
+                    'number_range', models.CharField(
+                        blank=True, max_length=255,
+                        verbose_name='Number range'
+                    )
+                ),
+                (
+                    'doc_number', models.CharField(
+                        max_length=255, verbose_name='Document number'
+                    )
+                ),
+                (
+                    'document', models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='botech_acct_doc_number',
+                        to='documents.Document', verbose_name='Document'
+                    )
+                ),
+            ],
+            options={
+                'verbose_name': 'Accounting document number',
+                'verbose_name_plural': 'Accounting document numbers',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='accountingdocumentnumber',
+            constraint=models.UniqueConstraint(
+                fields=('entity', 'fiscal_year', 'number_range', 'doc_number'),
+                name='botech_edms_unique_acct_doc_number'
+            ),
+        ),
+    ]
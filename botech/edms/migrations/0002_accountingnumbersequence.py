@@ -0,0 +1,53 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('edms', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountingNumberSequence',
+            fields=[
+                (
+                    'id', models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False,
+                        verbose_name='ID'
+                    )
+                ),
+                (
+                    'entity', models.CharField(
+                        blank=True, max_length=255, verbose_name='Entity'
+                    )
+                ),
+                (
+                    'fiscal_year', models.CharField(
+                        blank=True, max_length=255, verbose_name='Fiscal year'
+                    )
+                ),
+                (
+                    'number_range', models.CharField(
+                        max_length=255, verbose_name='Number range'
+                    )
+                ),
+                (
+                    'next_number', models.PositiveIntegerField(
+                        default=1, verbose_name='Next number'
+                    )
+                ),
+            ],
+            options={
+                'verbose_name': 'Accounting number sequence',
+                'verbose_name_plural': 'Accounting number sequences',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='accountingnumbersequence',
+            constraint=models.UniqueConstraint(
+                fields=('entity', 'fiscal_year', 'number_range'),
+                name='botech_edms_unique_acct_number_sequence'
+            ),
+        ),
+    ]
@@ -1,6 +1,91 @@
 from django.db import models
+from django.utils.translation import ugettext_lazy as _
+
+from mayan.apps.documents.models import Document
 
 # TODO: Check if this is the right place to trigger the import
-from . import transformations
+from . import transformations  # NOQA
+from .managers import (
+    AccountingDocumentNumberManager, AccountingNumberSequenceManager
+)
+
+
+class AccountingDocumentNumber(models.Model):
+    """
+    Registry of the document numbers given in accounting.
+
+    Mirrors the accounting metadata of each document which has a document
+    number, so that a duplicate number is found by an index lookup. The
+    unique constraint also holds under concurrent bookings.
+    """
+
+    document = models.OneToOneField(
+        on_delete=models.CASCADE, related_name='botech_acct_doc_number',
+        to=Document, verbose_name=_('Document')
+    )
+    entity = models.CharField(
+        blank=True, max_length=255, verbose_name=_('Entity')
+    )
+    fiscal_year = models.CharField(
+        blank=True, max_length=255, verbose_name=_('Fiscal year')
+    )
+    number_range = models.CharField(
+        blank=True, max_length=255, verbose_name=_('Number range')
+    )
+    doc_number = models.CharField(
+        max_length=255, verbose_name=_('Document number')
+    )
+
+    objects = AccountingDocumentNumberManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=('entity', 'fiscal_year', 'number_range', 'doc_number'),
+                name='botech_edms_unique_acct_doc_number'
+            ),
+        ]
+        verbose_name = _('Accounting document number')
+        verbose_name_plural = _('Accounting document numbers')
+
+    def __str__(self):
+        return self.doc_number
+
+
+class AccountingNumberSequence(models.Model):
+    """
+    The next document number of a number range which the EDMS hands out.
+
+    The row is locked while a number is allocated, so the numbers are gap
+    free as long as the allocation is part of the booking transaction.
+    """
+
+    entity = models.CharField(
+        blank=True, max_length=255, verbose_name=_('Entity')
+    )
+    fiscal_year = models.CharField(
+        blank=True, max_length=255, verbose_name=_('Fiscal year')
+    )
+    number_range = models.CharField(
+        max_length=255, verbose_name=_('Number range')
+    )
+    next_number = models.PositiveIntegerField(
+        default=1, verbose_name=_('Next number')
+    )
+
+    objects = AccountingNumberSequenceManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=('entity', 'fiscal_year', 'number_range'),
+                name='botech_edms_unique_acct_number_sequence'
+            ),
+        ]
+        verbose_name = _('Accounting number sequence')
+        verbose_name_plural = _('Accounting number sequences')
 
-# Create your models here.
+    def __str__(self):
+        return '{}/{}/{}'.format(
+            self.entity, self.fiscal_year, self.number_range
+        )
@@ -0,0 +1,9 @@
+from django.utils.translation import ugettext_lazy as _
+
+from mayan.apps.permissions import PermissionNamespace
+
+namespace = PermissionNamespace(label=_('bo-tech'), name='botech')
+
+permission_view_metrics = namespace.add_permission(
+    label=_('View the metrics of the views'), name='view_metrics'
+)
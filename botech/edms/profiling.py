@@ -0,0 +1,214 @@
+import collections
+import cProfile
+import functools
+import itertools
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from .settings import (
+    setting_profiler_directory,
+    setting_profiler_directory_maximum_files,
+    setting_profiler_render_rate,
+    setting_profiler_request_rate,
+    setting_profiler_sample_interval,
+)
+
+logger = logging.getLogger(name=__name__)
+
+PROFILE_FILE_NAME_TEMPLATE = (
+    '{timestamp}_{kind}_{name}_document-{document_id}_{pid}-{counter}'
+)
+
+# Note: The timestamp has a resolution of seconds, the counter keeps the
+# profiles of one process apart.
+_profile_counter = itertools.count(start=1)
+
+
+class SampledProfile:
+    """
+    Profile a block of code in the current thread.
+
+    cProfile records the exact call statistics. A sampler thread in addition
+    takes the stack of the profiled thread every "interval" seconds, the
+    stacks are written in the collapsed format of the flamegraph tools.
+    Both files are written into "directory", which keeps only the newest
+    "maximum_files" profiles.
+    """
+
+    def __init__(
+        self, kind, name, directory, interval, maximum_files, document_id=None
+    ):
+        if maximum_files < 1:
+            raise ValueError('maximum_files has to be at least 1.')
+
+        self.directory = directory
+        self.document_id = document_id
+        self.interval = interval
+        self.kind = kind
+        self.maximum_files = maximum_files
+        self.name = name
+        self.stacks = collections.Counter()
+        self._profile = cProfile.Profile()
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self._thread_id = threading.get_ident()
+        self._sampler = threading.Thread(
+            daemon=True, name='botech-profile-sampler', target=self._sample
+        )
+        self._sampler.start()
+        try:
+            self._profile.enable()
+        except ValueError:
+            # Note: Another profiler is active, e.g. a render inside of a
+            # profiled request. The samples are still taken.
+            self._profile = None
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._profile:
+            self._profile.disable()
+        self._stop.set()
+        self._sampler.join()
+
+        try:
+            self.write()
+        except OSError as exception:
+            # Note: Profiling must never fail the profiled request.
+            logger.warning('Cannot write the profile: %s', exception)
+
+    def get_base_name(self):
+        return PROFILE_FILE_NAME_TEMPLATE.format(
+            counter=next(_profile_counter),
+            document_id=self.document_id or 'none', kind=self.kind,
+            name=re.sub(r'[^\w.-]', '_', self.name), pid=os.getpid(),
+            timestamp=time.strftime('%Y%m%dT%H%M%S')
+        )
+
+    def write(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, self.get_base_name())
+
+        if self._profile:
+            self._profile.dump_stats('{}.pstats'.format(path))
+        with open('{}.collapsed'.format(path), mode='w') as file_object:
+            for stack, count in self.stacks.most_common():
+                file_object.write('{} {}\n'.format(stack, count))
+
+        self._rotate()
+
+    def _rotate(self):
+        # Note: A profile consists of a ".pstats" and a ".collapsed" file,
+        # both are kept or removed together.
+        profiles = collections.defaultdict(list)
+        mtimes = {}
+        for entry in os.scandir(self.directory):
+            try:
+                mtime = entry.stat().st_mtime
+            except OSError:
+                continue
+            stem = os.path.splitext(entry.name)[0]
+            profiles[stem].append(entry.path)
+            mtimes[stem] = max(mtime, mtimes.get(stem, mtime))
+
+        stems = sorted(profiles, key=lambda stem: (mtimes[stem], stem))
+        for stem in stems[:-self.maximum_files]:
+            for path in profiles[stem]:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+
+    def _sample(self):
+        while not self._stop.wait(timeout=self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    '{}:{}'.format(
+                        os.path.basename(code.co_filename), code.co_name
+                    )
+                )
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+
+def get_sampled_profile(kind, name, rate, document_id=None):
+    """
+    Return a SampledProfile for the given fraction of the calls, None for
+    all others.
+    """
+    if not rate or random.random() >= rate:
+        return None
+
+    maximum_files = setting_profiler_directory_maximum_files.value
+    if maximum_files < 1:
+        # Note: No profile would be kept, so none is taken.
+        return None
+
+    return SampledProfile(
+        directory=setting_profiler_directory.value, document_id=document_id,
+        interval=setting_profiler_sample_interval.value, kind=kind,
+        maximum_files=maximum_files, name=name
+    )
+
+
+def profile_render(name):
+    """
+    Decorator which profiles a sampled fraction of the renders of a
+    transformation. The transformation has to provide "get_document_id".
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(self, *args, **kwargs):
+            profile = get_sampled_profile(
+                kind='render', name=name,
+                rate=setting_profiler_render_rate.value
+            )
+            if profile is None:
+                return function(self, *args, **kwargs)
+
+            profile.document_id = self.get_document_id()
+            with profile:
+                return function(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def profile_view(view):
+    """
+    Decorator which profiles a sampled fraction of the requests of a view.
+    """
+    view_class = getattr(view, 'view_class', None)
+    name = view_class.__name__ if view_class else view.__name__
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        profile = get_sampled_profile(
+            document_id=kwargs.get('document_id'), kind='request', name=name,
+            rate=setting_profiler_request_rate.value
+        )
+        if profile is None:
+            return view(request, *args, **kwargs)
+
+        with profile:
+            response = view(request, *args, **kwargs)
+            # Note: Template responses are rendered lazily, the rendering is
+            # part of the request.
+            if hasattr(response, 'render') and not getattr(
+                response, 'is_rendered', True
+            ):
+                response.render()
+
+        return response
+
+    return wrapper
@@ -0,0 +1,12 @@
+from django.utils.translation import ugettext_lazy as _
+
+from mayan.apps.task_manager.classes import CeleryQueue
+from mayan.apps.task_manager.workers import worker_b
+
+queue_botech_edms = CeleryQueue(
+    label=_('bo-tech EDMS'), name='botech_edms', worker=worker_b
+)
+queue_botech_edms.add_task_type(
+    dotted_path='botech.edms.tasks.task_pre_process_warm',
+    label=_('Warm the pre processing view of a document')
+)
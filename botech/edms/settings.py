@@ -12,6 +12,15 @@ setting_botech_booked_tag = namespace.add_setting(
     global_name='BOTECH_BOOKED_TAG',
     help_text = _('Tag to flag documents as booked in accounting.'))
 
+setting_acct_allocated_number_ranges = namespace.add_setting(
+    default=literals.DEFAULT_ACCT_ALLOCATED_NUMBER_RANGES,
+    global_name='BOTECH_ACCT_ALLOCATED_NUMBER_RANGES',
+    help_text = _(
+        'Number ranges for which the document numbers are handed out by the '
+        'EDMS. Maps the number range to the format of the number, e.g. '
+        '"{number_range}-{fiscal_year}-{number:05d}". The format can use '
+        '"entity", "fiscal_year", "number_range" and "number".'))
+
 setting_acct_assignment = namespace.add_setting(
     default=literals.DEFAULT_ACCT_ASSIGNMENT,
     global_name='BOTECH_ACCT_ASSIGNMENT',
@@ -27,6 +36,13 @@ setting_acct_doc_number = namespace.add_setting(
     global_name='BOTECH_ACCT_DOC_NUMBER',
     help_text = _('Name of MetadataType to store the document number into.'))
 
+setting_acct_doc_number_unique_exempt_document_types = namespace.add_setting(
+    default=literals.DEFAULT_ACCT_DOC_NUMBER_UNIQUE_EXEMPT_DOCUMENT_TYPES,
+    global_name='BOTECH_ACCT_DOC_NUMBER_UNIQUE_EXEMPT_DOCUMENT_TYPES',
+    help_text = _(
+        'Labels of the document types whose document numbers do not have to '
+        'be unique, e.g. bank account statements.'))
+
 setting_acct_entity = namespace.add_setting(
     default=literals.DEFAULT_ACCT_ENTITY,
     global_name='BOTECH_ACCT_ENTITY',
@@ -44,3 +60,74 @@ setting_acct_number_range = namespace.add_setting(
     global_name='BOTECH_ACCT_NUMBER_RANGE',
     help_text = _(
         'Name of MetadataType to store the document accounting number range into.'))
+
+setting_stamp_overlay_cache_directory = namespace.add_setting(
+    default=literals.DEFAULT_BOTECH_STAMP_OVERLAY_CACHE_DIRECTORY,
+    global_name='BOTECH_STAMP_OVERLAY_CACHE_DIRECTORY',
+    help_text = _(
+        'Directory into which rendered stamp overlays are spilled when they '
+        'are evicted from memory. Leave empty to disable spilling.'))
+
+setting_stamp_overlay_cache_directory_maximum_size = namespace.add_setting(
+    default=literals.DEFAULT_BOTECH_STAMP_OVERLAY_CACHE_DIRECTORY_MAXIMUM_SIZE,
+    global_name='BOTECH_STAMP_OVERLAY_CACHE_DIRECTORY_MAXIMUM_SIZE',
+    help_text = _(
+        'Maximum size in bytes of the stamp overlay spill directory.'))
+
+setting_stamp_overlay_cache_maximum_size = namespace.add_setting(
+    default=literals.DEFAULT_BOTECH_STAMP_OVERLAY_CACHE_MAXIMUM_SIZE,
+    global_name='BOTECH_STAMP_OVERLAY_CACHE_MAXIMUM_SIZE',
+    help_text = _(
+        'Maximum size in bytes of the rendered stamp overlays kept in memory '
+        'per process.'))
+
+setting_view_instrumentation = namespace.add_setting(
+    default=literals.DEFAULT_BOTECH_VIEW_INSTRUMENTATION,
+    global_name='BOTECH_VIEW_INSTRUMENTATION',
+    help_text = _(
+        'Record the timings and SQL queries per phase of the accounting and '
+        'pre processing views. Every request is logged and the sums are '
+        'served as Prometheus metrics.'))
+
+setting_view_metrics_token = namespace.add_setting(
+    default=literals.DEFAULT_BOTECH_VIEW_METRICS_TOKEN,
+    global_name='BOTECH_VIEW_METRICS_TOKEN',
+    help_text = _(
+        'Bearer token which a scraper like Prometheus sends to read the view '
+        'metrics without a login. Without a token only users with the '
+        'permission to view the metrics can read them.'))
+
+setting_profiler_directory = namespace.add_setting(
+    default=literals.DEFAULT_BOTECH_PROFILER_DIRECTORY,
+    global_name='BOTECH_PROFILER_DIRECTORY',
+    help_text = _(
+        'Directory into which the profiles of the sampled requests and stamp '
+        'renders are written.'))
+
+setting_profiler_directory_maximum_files = namespace.add_setting(
+    default=literals.DEFAULT_BOTECH_PROFILER_DIRECTORY_MAXIMUM_FILES,
+    global_name='BOTECH_PROFILER_DIRECTORY_MAXIMUM_FILES',
+    help_text = _(
+        'Maximum number of profiles kept in the profile directory, the '
+        'oldest profiles are removed first. Each profile consists of a '
+        '".pstats" and a ".collapsed" file. Use 0 to disable profiling.'))
+
+setting_profiler_render_rate = namespace.add_setting(
+    default=literals.DEFAULT_BOTECH_PROFILER_RENDER_RATE,
+    global_name='BOTECH_PROFILER_RENDER_RATE',
+    help_text = _(
+        'Fraction between 0 and 1 of the stamp renders which are profiled. '
+        'Use 0 to disable profiling.'))
+
+setting_profiler_request_rate = namespace.add_setting(
+    default=literals.DEFAULT_BOTECH_PROFILER_REQUEST_RATE,
+    global_name='BOTECH_PROFILER_REQUEST_RATE',
+    help_text = _(
+        'Fraction between 0 and 1 of the requests to the botech views which '
+        'are profiled. Use 0 to disable profiling.'))
+
+setting_profiler_sample_interval = namespace.add_setting(
+    default=literals.DEFAULT_BOTECH_PROFILER_SAMPLE_INTERVAL,
+    global_name='BOTECH_PROFILER_SAMPLE_INTERVAL',
+    help_text = _(
+        'Seconds between two stack samples of a profiled request or render.'))
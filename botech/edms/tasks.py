@@ -0,0 +1,63 @@
+import contextlib
+import logging
+
+from django.apps import apps
+
+from mayan.apps.converter.transformations import TransformationResize
+from mayan.apps.documents.settings import (
+    setting_preview_height,
+    setting_preview_width)
+from mayan.celery import app
+
+from .classes import get_stamp_only_page_ids
+from .transformation_mixins import stamp_output_size
+
+logger = logging.getLogger(name=__name__)
+
+
+@app.task(ignore_result=True)
+def task_pre_process_warm(document_id):
+    """
+    Render the preview images of the document, so that they are in the
+    cache once the user opens it in the pre processing view.
+    """
+    Document = apps.get_model(app_label='documents', model_name='Document')
+
+    try:
+        document = Document.valid.get(pk=document_id)
+    except Document.DoesNotExist:
+        return
+
+    version = document.version_active
+    if not version:
+        return
+
+    # Note: Same transformations as in the preview of the view, otherwise
+    # the cached images would not be used.
+    transformation_instance_list = (
+        TransformationResize(
+            height=setting_preview_height.value,
+            width=setting_preview_width.value
+        ),
+    )
+
+    pages = list(version.version_pages.all())
+    stamp_only_page_ids = get_stamp_only_page_ids(
+        page_ids=[page.pk for page in pages])
+
+    for page in pages:
+        # Note: The stamp is drawn at the preview size instead of on the
+        # full resolution page where no other transformation follows it.
+        if page.pk in stamp_only_page_ids:
+            context = stamp_output_size.request(
+                height=setting_preview_height.value,
+                width=setting_preview_width.value
+            )
+        else:
+            context = contextlib.nullcontext()
+
+        with context:
+            page.generate_image(
+                transformation_instance_list=transformation_instance_list)
+
+    logger.debug('Warmed pre processing preview of document %s.', document_id)
@@ -1,3 +1,840 @@
-from django.test import TestCase
+import csv
+import io
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.contenttypes.models import ContentType
+from django.core import management
+from django.db import IntegrityError, connection, transaction
+from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext
+
+from mayan.apps.converter.layers import layer_decorations
+from mayan.apps.converter.models import LayerTransformation
+from mayan.apps.converter.transformations import TransformationDrawRectangle
+from mayan.apps.documents.events import (
+    event_document_edited, event_document_type_changed
+)
+from mayan.apps.documents.permissions import permission_document_edit
+from mayan.apps.documents.tests.base import (
+    GenericDocumentTestCase, GenericDocumentViewTestCase
+)
+from mayan.apps.metadata.models import MetadataType
+from mayan.apps.metadata.permissions import permission_document_metadata_edit
+from mayan.apps.tags.models import Tag
+from mayan.apps.tags.permissions import permission_tag_attach
+from mayan.apps.testing.tests.base import GenericViewTestCase
+
+from . import literals
+from .accounting import attach_stamp_accounting_metadata_transformations
+from .classes import deferred_events
+from .exports import iter_booked_documents
+from .fixes import change_document_type, get_metadata_formset_initial
+from .forms import TagDeltaForm
+from .managers import _get_number_pattern
+from .models import AccountingDocumentNumber, AccountingNumberSequence
+from .permissions import permission_view_metrics
+from .profiling import SampledProfile
+from .settings import (
+    setting_acct_allocated_number_ranges,
+    setting_acct_doc_number_unique_exempt_document_types,
+    setting_view_instrumentation, setting_view_metrics_token
+)
+from .transformation_mixins import (
+    TransformationStampAccountingMetadataMixin
+)
+from .transformations import TransformationStampAccountingMetadata
+
+
+class MetadataTypeTestMixin:
+    def _create_test_document_metadata_type(self, name, value=None):
+        metadata_type = MetadataType.objects.create(label=name, name=name)
+        self._test_document_type.metadata.create(metadata_type=metadata_type)
+        if value is not None:
+            self._test_document.metadata.create(
+                metadata_type=metadata_type, value=value)
+        return metadata_type
+
+
+class AccountingMetadataTestMixin(MetadataTypeTestMixin):
+    def setUp(self):
+        super().setUp()
+
+        for name in (
+            literals.DEFAULT_ACCT_BOOKED_DATE,
+            literals.DEFAULT_ACCT_DOC_NUMBER,
+            literals.DEFAULT_ACCT_ENTITY,
+            literals.DEFAULT_ACCT_FISCAL_YEAR,
+            literals.DEFAULT_ACCT_NUMBER_RANGE,
+        ):
+            self._create_test_document_metadata_type(name=name)
+
+    def _get_test_acct_metadata(self, document, name):
+        return document.metadata.filter(
+            metadata_type__name=name
+        ).values_list('value', flat=True).first()
+
+    def _set_test_acct_metadata(self, document, **values):
+        for name, value in values.items():
+            document.metadata.create(
+                metadata_type=MetadataType.objects.get(name=name), value=value)
+
+
+class AccountingDocumentNumberTestCase(
+    AccountingMetadataTestMixin, GenericDocumentTestCase
+):
+    def setUp(self):
+        super().setUp()
+
+        self._test_booked_document = self._test_document
+        self._set_test_acct_metadata(
+            document=self._test_booked_document,
+            **{literals.DEFAULT_ACCT_DOC_NUMBER: '4711'}
+        )
+        self._create_test_document_stub()
+
+    def _set_test_document_doc_number(self):
+        self._set_test_acct_metadata(
+            document=self._test_document,
+            **{literals.DEFAULT_ACCT_DOC_NUMBER: '4711'}
+        )
+
+    def test_duplicate_raises_when_enforced(self):
+        with self.assertRaises(IntegrityError):
+            with AccountingDocumentNumber.objects.enforce_unique():
+                with transaction.atomic():
+                    self._set_test_document_doc_number()
+
+        self.assertEqual(
+            list(
+                AccountingDocumentNumber.objects.values_list(
+                    'document_id', flat=True)
+            ), [self._test_booked_document.pk]
+        )
+
+    def test_duplicate_is_logged_when_not_enforced(self):
+        with self.assertLogs(logger='botech.edms.handlers', level='WARNING'):
+            self._set_test_document_doc_number()
+
+        self.assertTrue(
+            self._test_document.metadata.filter(
+                metadata_type__name=literals.DEFAULT_ACCT_DOC_NUMBER
+            ).exists()
+        )
+        self.assertFalse(
+            AccountingDocumentNumber.objects.filter(
+                document_id=self._test_document.pk).exists()
+        )
+
+    def test_exempt_document_type(self):
+        setting_acct_doc_number_unique_exempt_document_types.set(
+            value=[self._test_document_type.label])
+
+        with AccountingDocumentNumber.objects.enforce_unique():
+            self._set_test_document_doc_number()
+
+        self.assertFalse(
+            AccountingDocumentNumber.objects.filter(
+                document_id=self._test_document.pk).exists()
+        )
+
+    def test_rebuild_reports_duplicates(self):
+        with self.assertLogs(logger='botech.edms.handlers', level='WARNING'):
+            self._set_test_document_doc_number()
+        AccountingDocumentNumber.objects.all().delete()
+
+        count, duplicates = AccountingDocumentNumber.objects.rebuild()
+
+        # Note: The documents are registered in the order of their ids.
+        registered_id, duplicate_id = sorted(
+            (self._test_booked_document.pk, self._test_document.pk)
+        )
+        self.assertEqual(count, 1)
+        self.assertEqual(duplicates, [(duplicate_id, '4711')])
+        self.assertEqual(
+            list(
+                AccountingDocumentNumber.objects.values_list(
+                    'document_id', flat=True)
+            ), [registered_id]
+        )
+
+
+class AccountingNumberSequenceTestCase(
+    AccountingMetadataTestMixin, GenericDocumentTestCase
+):
+    def setUp(self):
+        super().setUp()
+
+        setting_acct_allocated_number_ranges.set(
+            value={'ER': '{number_range}-{fiscal_year}-{number:04d}'})
+        self._test_key = {
+            'entity': '', 'fiscal_year': '2022', 'number_range': 'ER'
+        }
+
+    def test_allocate_advances_the_sequence(self):
+        self.assertEqual(
+            AccountingNumberSequence.objects.peek(**self._test_key),
+            'ER-2022-0001'
+        )
+        self.assertEqual(
+            AccountingNumberSequence.objects.allocate(**self._test_key),
+            'ER-2022-0001'
+        )
+        self.assertEqual(
+            AccountingNumberSequence.objects.allocate(**self._test_key),
+            'ER-2022-0002'
+        )
+        self.assertEqual(
+            AccountingNumberSequence.objects.peek(**self._test_key),
+            'ER-2022-0003'
+        )
+
+    def test_allocate_skips_registered_numbers(self):
+        self._set_test_acct_metadata(
+            document=self._test_document, **{
+                literals.DEFAULT_ACCT_FISCAL_YEAR: '2022',
+                literals.DEFAULT_ACCT_NUMBER_RANGE: 'ER',
+                literals.DEFAULT_ACCT_DOC_NUMBER: 'ER-2022-0007',
+            }
+        )
+
+        self.assertEqual(
+            AccountingNumberSequence.objects.peek(**self._test_key),
+            'ER-2022-0001'
+        )
+
+        self._create_test_document_stub()
+        self._set_test_acct_metadata(
+            document=self._test_document, **{
+                literals.DEFAULT_ACCT_FISCAL_YEAR: '2022',
+                literals.DEFAULT_ACCT_NUMBER_RANGE: 'ER',
+                literals.DEFAULT_ACCT_DOC_NUMBER: 'ER-2022-0001',
+            }
+        )
+
+        self.assertEqual(
+            AccountingNumberSequence.objects.peek(**self._test_key),
+            'ER-2022-0008'
+        )
+        self.assertEqual(
+            AccountingNumberSequence.objects.allocate(**self._test_key),
+            'ER-2022-0008'
+        )
+
+    def test_rolled_back_allocation_returns_the_number(self):
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                AccountingNumberSequence.objects.allocate(**self._test_key)
+                raise ValueError
+
+        self.assertEqual(
+            AccountingNumberSequence.objects.allocate(**self._test_key),
+            'ER-2022-0001'
+        )
+
+    def test_unknown_number_range(self):
+        self._test_key['number_range'] = 'AR'
+
+        self.assertEqual(
+            AccountingNumberSequence.objects.allocate(**self._test_key), None
+        )
+        self.assertEqual(
+            AccountingNumberSequence.objects.peek(**self._test_key), None
+        )
+
+
+class NumberPatternTestCase(SimpleTestCase):
+    def test_number_is_captured(self):
+        pattern = _get_number_pattern(
+            number_format='{entity}.{fiscal_year}/{number:04d}',
+            entity='A+B', fiscal_year='2022', number_range='ER'
+        )
+
+        self.assertEqual(
+            pattern.fullmatch('A+B.2022/0042').group('number'), '0042'
+        )
+        self.assertEqual(pattern.fullmatch('AAB.2022/0042'), None)
+        self.assertEqual(pattern.fullmatch('A+B.2023/0042'), None)
+
+    def test_repeated_number(self):
+        pattern = _get_number_pattern(
+            number_format='{number}-{number}', entity='', fiscal_year='',
+            number_range=''
+        )
+
+        self.assertEqual(pattern.fullmatch('7-7').group('number'), '7')
+        self.assertEqual(pattern.fullmatch('7-8'), None)
+
+
+class ImportDocNumbersCommandTestCase(
+    AccountingMetadataTestMixin, GenericDocumentTestCase
+):
+    def setUp(self):
+        super().setUp()
+
+        Tag.objects.create(
+            color='#ff0000', label=literals.DEFAULT_BOTECH_BOOKED_TAG)
+
+        self._test_import_path = os.path.join(
+            tempfile.mkdtemp(), 'import.csv')
+        self.addCleanup(
+            shutil.rmtree, os.path.dirname(self._test_import_path))
+
+    def _call_test_command(self, rows, **options):
+        with open(self._test_import_path, mode='w', newline='') as file_object:
+            writer = csv.writer(file_object)
+            writer.writerow(('document_id', 'doc_number', 'booked_date'))
+            writer.writerows(rows)
+
+        stderr = io.StringIO()
+        management.call_command(
+            'botech_import_doc_numbers', self._test_import_path,
+            stderr=stderr, stdout=io.StringIO(), **options
+        )
+
+        return stderr.getvalue()
+
+    def test_import(self):
+        errors = self._call_test_command(
+            rows=(
+                ('00{}'.format(self._test_document.pk), '4711', '2022-08-25'),
+            )
+        )
+
+        self.assertEqual(errors, '')
+        self.assertEqual(
+            self._get_test_acct_metadata(
+                document=self._test_document,
+                name=literals.DEFAULT_ACCT_DOC_NUMBER
+            ), '4711'
+        )
+        self.assertEqual(
+            self._get_test_acct_metadata(
+                document=self._test_document,
+                name=literals.DEFAULT_ACCT_BOOKED_DATE
+            ), '2022-08-25'
+        )
+
+    def test_dry_run(self):
+        errors = self._call_test_command(
+            dry_run=True, rows=(
+                (self._test_document.pk, '4711', '2022-08-25'),
+            )
+        )
+
+        self.assertEqual(errors, '')
+        self.assertEqual(
+            self._get_test_acct_metadata(
+                document=self._test_document,
+                name=literals.DEFAULT_ACCT_DOC_NUMBER
+            ), None
+        )
+
+    def test_invalid_rows(self):
+        errors = self._call_test_command(
+            rows=(
+                ('x', '4711', '2022-08-25'),
+                (self._test_document.pk + 1000, '4712', '2022-08-25'),
+                (self._test_document.pk, '4713', '2022-08-25'),
+                ('0{}'.format(self._test_document.pk), '4714', '2022-08-25'),
+            )
+        )
+
+        self.assertEqual(
+            errors.splitlines(), [
+                'Line 2: "x" is not a valid document_id.',
+                'Line 3: No document matches "{}".'.format(
+                    self._test_document.pk + 1000
+                ),
+                'Line 5: Document "{}" is also on line 4.'.format(
+                    self._test_document.pk
+                ),
+            ]
+        )
+        self.assertEqual(
+            self._get_test_acct_metadata(
+                document=self._test_document,
+                name=literals.DEFAULT_ACCT_DOC_NUMBER
+            ), '4713'
+        )
+
+
+class DeferredEventsTestCase(GenericDocumentTestCase):
+    def setUp(self):
+        super().setUp()
+        self._clear_events()
+
+    def test_events_are_committed_after_the_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with deferred_events() as event_queue:
+                for index in range(2):
+                    event_queue.add(
+                        actor=self._test_case_user,
+                        event_type=event_document_edited,
+                        target=self._test_document
+                    )
+
+                self.assertEqual(self._get_test_events().count(), 0)
+
+        events = self._get_test_events()
+        self.assertEqual(events.count(), 1)
+        self.assertEqual(events[0].verb, event_document_edited.id)
+        self.assertEqual(events[0].target, self._test_document)
+
+    def test_events_are_dropped_on_rollback(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(ValueError):
+                with deferred_events() as event_queue:
+                    event_queue.add(
+                        actor=self._test_case_user,
+                        event_type=event_document_edited,
+                        target=self._test_document
+                    )
+                    raise ValueError
+
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self._get_test_events().count(), 0)
+
+    def test_document_type_change_launches_workflows_after_commit(self):
+        document_type = self._test_document_type
+        self._create_test_document_type()
+        self._clear_events()
+
+        with mock.patch(
+            target='mayan.apps.document_states.handlers.'
+            'task_launch_all_workflow_for'
+        ) as task:
+            with self.captureOnCommitCallbacks(execute=True):
+                with deferred_events() as event_queue:
+                    change_document_type(
+                        document=self._test_document,
+                        document_type=self._test_document_type,
+                        event_queue=event_queue
+                    )
+
+                    task.apply_async.assert_not_called()
+                    self.assertEqual(self._get_test_events().count(), 0)
+
+            task.apply_async.assert_called_once_with(
+                kwargs={'document_id': self._test_document.pk}
+            )
+
+        self._test_document.refresh_from_db()
+        self.assertNotEqual(self._test_document.document_type, document_type)
+        self.assertEqual(
+            [event.verb for event in self._get_test_events()],
+            [event_document_type_changed.id]
+        )
+
+
+class MembershipDeltaFormTestCase(GenericDocumentViewTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self._test_tags = [
+            Tag.objects.create(
+                color='#ff0000', label='test_tag_{}'.format(index)
+            ) for index in range(3)
+        ]
+        for tag in self._test_tags:
+            self.grant_access(obj=tag, permission=permission_tag_attach)
+        self.grant_access(
+            obj=self._test_document, permission=permission_document_edit)
+
+    def _request_pre_process_view(self, tags, shown):
+        return self.post(
+            viewname='botech_edms:document_pre_process_view', kwargs={
+                'document_id': self._test_document.pk
+            }, data={
+                'metadata-INITIAL_FORMS': '0',
+                'metadata-TOTAL_FORMS': '0',
+                'properties-document_type': self._test_document_type.pk,
+                'properties-label': self._test_document.label,
+                'properties-language': self._test_document.language,
+                'tags-shown': [tag.pk for tag in shown],
+                'tags-tags': [tag.pk for tag in tags],
+            }
+        )
+
+    def test_added_and_removed(self):
+        form = TagDeltaForm(
+            data={
+                'shown': [self._test_tags[0].pk, self._test_tags[1].pk],
+                'tags': [self._test_tags[0].pk, self._test_tags[2].pk],
+            }, queryset=Tag.objects.all()
+        )
+
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.get_added(), {self._test_tags[2]})
+        self.assertEqual(form.get_removed(), {self._test_tags[1]})
+
+    def test_parallel_changes_are_kept(self):
+        self._test_document.tags.add(self._test_tags[0])
+        shown = [self._test_tags[0]]
+
+        # Note: Attached e.g. by a workflow after the form was rendered.
+        self._test_document.tags.add(self._test_tags[1])
+
+        response = self._request_pre_process_view(
+            shown=shown, tags=[self._test_tags[2]])
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            set(self._test_document.tags.all()),
+            {self._test_tags[1], self._test_tags[2]}
+        )
+
+    def test_tag_without_access_is_rejected(self):
+        tag = Tag.objects.create(color='#ff0000', label='test_tag_no_access')
+
+        response = self._request_pre_process_view(shown=(), tags=(tag,))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(self._test_document.tags.exists())
+
+    def test_current_tag_without_access_is_kept(self):
+        tag = Tag.objects.create(color='#ff0000', label='test_tag_no_access')
+        self._test_document.tags.add(tag)
+
+        response = self._request_pre_process_view(shown=(tag,), tags=(tag,))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(self._test_document.tags.all()), [tag])
+
+
+class StampTransformationAttachTestCase(
+    AccountingMetadataTestMixin, GenericDocumentTestCase
+):
+    def setUp(self):
+        super().setUp()
+
+        self._test_first_page = self._test_document_version_pages[0]
+
+    def _attach_test_stamp(self):
+        attach_stamp_accounting_metadata_transformations(
+            documents=(self._test_document,))
+
+    def _get_test_stamps(self):
+        return LayerTransformation.objects.filter(
+            name=TransformationStampAccountingMetadata.name,
+            object_layer__content_type=ContentType.objects.get_for_model(
+                model=self._test_first_page),
+            object_layer__object_id=self._test_first_page.pk
+        )
+
+    def test_attach_is_idempotent(self):
+        self._attach_test_stamp()
+        self._attach_test_stamp()
+
+        self.assertEqual(self._get_test_stamps().count(), 1)
+
+    def test_attach_after_other_transformations(self):
+        layer_decorations.add_transformation_to(
+            obj=self._test_first_page,
+            transformation_class=TransformationDrawRectangle, order=5)
+
+        self._attach_test_stamp()
+
+        self.assertEqual(
+            list(self._get_test_stamps().values_list('order', flat=True)),
+            [6]
+        )
+
+    def test_attach_removes_surplus_stamps(self):
+        for index in range(2):
+            layer_decorations.add_transformation_to(
+                obj=self._test_first_page,
+                transformation_class=TransformationStampAccountingMetadata)
+
+        self._attach_test_stamp()
+
+        self.assertEqual(self._get_test_stamps().count(), 1)
+
+
+class AccountingDocumentEditViewTestCase(
+    MetadataTypeTestMixin, GenericDocumentViewTestCase
+):
+    def setUp(self):
+        super().setUp()
+
+        for name in (
+            literals.DEFAULT_ACCT_ASSIGNMENT,
+            literals.DEFAULT_ACCT_BOOKED_DATE,
+            literals.DEFAULT_ACCT_DOC_NUMBER,
+            literals.DEFAULT_ACCT_ENTITY,
+            literals.DEFAULT_ACCT_FISCAL_YEAR,
+            literals.DEFAULT_ACCT_NUMBER_RANGE,
+        ):
+            self._create_test_document_metadata_type(name=name)
+
+        Tag.objects.create(
+            color='#ff0000', label=literals.DEFAULT_BOTECH_BOOKED_TAG)
+
+        self.grant_access(
+            obj=self._test_document, permission=permission_document_edit)
+        self.grant_access(
+            obj=self._test_document,
+            permission=permission_document_metadata_edit)
+
+    def _request_accounting_view(self):
+        response = self.get(
+            viewname='botech_edms:document_acct_edit_view', kwargs={
+                'document_id': self._test_document.pk
+            }
+        )
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def _request_accounting_view_query_count(self):
+        with CaptureQueriesContext(connection=connection) as context:
+            self._request_accounting_view()
+
+        return len(context.captured_queries)
+
+    def _request_accounting_view_post(self, doc_number):
+        return self.post(
+            viewname='botech_edms:document_acct_edit_view', kwargs={
+                'document_id': self._test_document.pk
+            }, data={
+                'comment-booked_date': '2022-08-25',
+                'comment-doc_number': doc_number,
+                'metadata-INITIAL_FORMS': '0',
+                'metadata-TOTAL_FORMS': '0',
+            }
+        )
+
+    def _get_test_document_doc_number(self):
+        return self._test_document.metadata.filter(
+            metadata_type__name=literals.DEFAULT_ACCT_DOC_NUMBER
+        ).values_list('value', flat=True).first()
+
+    def test_book(self):
+        response = self._request_accounting_view_post(doc_number='4711')
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self._get_test_document_doc_number(), '4711')
+        self.assertTrue(
+            self._test_document.tags.filter(
+                label=literals.DEFAULT_BOTECH_BOOKED_TAG).exists()
+        )
+
+    def test_missing_booked_tag(self):
+        Tag.objects.filter(
+            label=literals.DEFAULT_BOTECH_BOOKED_TAG).delete()
+
+        self._request_accounting_view()
+
+        response = self._request_accounting_view_post(doc_number='4711')
+
+        self.assertContains(
+            response=response, status_code=200, text='does not exist')
+        self.assertEqual(self._get_test_document_doc_number(), None)
+
+    def test_query_count(self):
+        # Note: The first request fills the process wide caches.
+        self._request_accounting_view()
+
+        with self.assertNumQueries(99):
+            self._request_accounting_view()
+
+    def test_query_count_does_not_grow_with_metadata_types(self):
+        # Note: The first request fills the process wide caches.
+        self._request_accounting_view_query_count()
+        query_count = self._request_accounting_view_query_count()
+
+        for index in range(10):
+            self._create_test_document_metadata_type(
+                name='test_metadata_type_{}'.format(index), value='test')
+
+        self.assertEqual(
+            self._request_accounting_view_query_count(), query_count)
+
+
+class MetadataFormsetInitialTestCase(
+    MetadataTypeTestMixin, GenericDocumentViewTestCase
+):
+    def _create_test_document_metadata_type(self, name, value=None):
+        # Note: Document metadata inherits the access of its metadata type.
+        metadata_type = super()._create_test_document_metadata_type(
+            name=name, value=value)
+        self.grant_access(
+            obj=metadata_type, permission=permission_document_metadata_edit)
+        return metadata_type
+
+    def _get_initial(self):
+        # Note: A fresh instance, the document type must not be cached.
+        document = type(self._test_document).objects.get(
+            pk=self._test_document.pk)
+
+        with CaptureQueriesContext(connection=connection) as context:
+            initial = get_metadata_formset_initial(
+                document=document, include_addable=True,
+                user=self._test_case_user
+            )
+
+        return initial, len(context.captured_queries)
+
+    def test_existing_and_addable_metadata(self):
+        self._create_test_document_metadata_type(
+            name='test_existing', value='test value')
+        self._create_test_document_metadata_type(name='test_addable')
+
+        initial, query_count = self._get_initial()
+
+        self.assertEqual(
+            [
+                (entry['metadata_type'].name, entry['value'])
+                for entry in initial
+            ], [('test_existing', 'test value'), ('test_addable', '')]
+        )
+
+    def test_query_count_does_not_grow_with_metadata_types(self):
+        self._create_test_document_metadata_type(
+            name='test_existing', value='test value')
+        self._create_test_document_metadata_type(name='test_addable')
+
+        initial, query_count = self._get_initial()
+
+        for index in range(10):
+            self._create_test_document_metadata_type(
+                name='test_existing_{}'.format(index), value='test')
+            self._create_test_document_metadata_type(
+                name='test_addable_{}'.format(index))
+
+        initial, query_count_more = self._get_initial()
+
+        self.assertEqual(len(initial), 22)
+        self.assertEqual(query_count_more, query_count)
+
+
+class BookedDocumentExportTestCase(
+    MetadataTypeTestMixin, GenericDocumentViewTestCase
+):
+    def setUp(self):
+        super().setUp()
+
+        for name in (
+            literals.DEFAULT_ACCT_ASSIGNMENT,
+            literals.DEFAULT_ACCT_BOOKED_DATE,
+            literals.DEFAULT_ACCT_ENTITY,
+            literals.DEFAULT_ACCT_FISCAL_YEAR,
+            literals.DEFAULT_ACCT_NUMBER_RANGE,
+        ):
+            self._create_test_document_metadata_type(name=name)
+        self._create_test_document_metadata_type(
+            name=literals.DEFAULT_ACCT_DOC_NUMBER, value='4711')
+
+        self._test_booked_tag = Tag.objects.create(
+            color='#ff0000', label=literals.DEFAULT_BOTECH_BOOKED_TAG)
+
+    def test_only_booked_documents(self):
+        self.assertEqual(list(iter_booked_documents()), [])
+
+        self._test_booked_tag.documents.add(self._test_document)
+
+        rows = list(iter_booked_documents())
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['document_id'], self._test_document.pk)
+        self.assertEqual(rows[0]['doc_number'], '4711')
+        self.assertEqual(rows[0]['booked_date'], '')
+
+
+class ViewMetricsViewTestCase(GenericViewTestCase):
+    expected_content_types = None
+
+    def setUp(self):
+        super().setUp()
+        setting_view_instrumentation.set(value=True)
+        setting_view_metrics_token.set(value='test-token')
+
+    def _request_view_metrics_view(self, token=None):
+        headers = {}
+        if token:
+            headers['HTTP_AUTHORIZATION'] = 'Bearer {}'.format(token)
+        return self.get(
+            viewname='botech_edms:view_metrics', headers=headers)
+
+    def test_disabled(self):
+        setting_view_instrumentation.set(value=False)
+        self.grant_permission(permission=permission_view_metrics)
+
+        response = self._request_view_metrics_view()
+        self.assertEqual(response.status_code, 404)
+
+    def test_no_permission(self):
+        response = self._request_view_metrics_view()
+        self.assertEqual(response.status_code, 403)
+
+    def test_with_permission(self):
+        self.grant_permission(permission=permission_view_metrics)
+
+        response = self._request_view_metrics_view()
+        self.assertEqual(response.status_code, 200)
+
+    def test_token_without_login(self):
+        self.logout()
+
+        response = self._request_view_metrics_view(token='test-token')
+        self.assertEqual(response.status_code, 200)
+
+        response = self._request_view_metrics_view(token='wrong-token')
+        self.assertEqual(response.status_code, 401)
+
+        response = self._request_view_metrics_view()
+        self.assertEqual(response.status_code, 401)
+
+
+class SampledProfileRotateTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self._test_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._test_directory)
+
+    def _create_test_profile(self, stem, mtime):
+        for suffix in ('.collapsed', '.pstats'):
+            path = os.path.join(self._test_directory, stem + suffix)
+            open(path, mode='w').close()
+            os.utime(path, times=(mtime, mtime))
+
+    def test_rotate_per_profile(self):
+        for index in range(3):
+            self._create_test_profile(
+                stem='profile-{}'.format(index), mtime=1000 + index)
+
+        SampledProfile(
+            directory=self._test_directory, interval=1, kind='request',
+            maximum_files=2, name='test'
+        )._rotate()
+
+        self.assertEqual(
+            sorted(os.listdir(self._test_directory)), [
+                'profile-1.collapsed', 'profile-1.pstats',
+                'profile-2.collapsed', 'profile-2.pstats'
+            ]
+        )
+
+
+class StampLayoutTestCase(SimpleTestCase):
+    def setUp(self):
+        self._test_stamp = TransformationStampAccountingMetadataMixin()
+        self._test_stamp.acct_doc_number = '4711'
+        self._test_stamp.acct_booked_stamp = 'BOOKED 2022-08-25'
+        self._test_stamp.acct_assignment = 'Office'
+
+    def test_layout_scales_with_the_page(self):
+        reference_size = self._test_stamp.reference_size
+        texts = self._test_stamp.get_stamp_texts(size=reference_size)
+        quarter_texts = self._test_stamp.get_stamp_texts(
+            size=(reference_size[0] // 4, reference_size[1] // 4))
+
+        for text, quarter_text in zip(texts, quarter_texts):
+            self.assertEqual(
+                quarter_text[0], (text[0][0] // 4, text[0][1] // 4)
+            )
+        self.assertEqual(
+            self._test_stamp.get_font_size(
+                size=(reference_size[0] // 4, reference_size[1] // 4)
+            ), self._test_stamp.font_size // 4
+        )
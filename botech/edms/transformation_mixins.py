@@ -1,61 +1,526 @@
+import collections
+import contextlib
+import functools
+import hashlib
 import io
+import os
 import pkgutil
+import struct
+import tempfile
+import threading
+import zlib
 
-from PIL import Image, ImageColor, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont
 
 
 ANCHOR_RIGHT_ASCENDER = 'ra'
 ANCHOR_RIGHT_DESCENDER = 'rd'
 
+DEFAULT_FONT_NAME = 'Roboto-Bold'
+DEFAULT_FONT_SIZE = 80
+DEFAULT_FONT_REGISTRY_MAXIMUM_SIZE = 16
+# A4 at 300 dpi, the page for which the stamp layout is given in pixels.
+DEFAULT_STAMP_REFERENCE_SIZE = (2480, 3508)
+DEFAULT_TEXT_COLOR = (255, 0, 0, 155)
+DEFAULT_STAMP_OVERLAY_CACHE_MAXIMUM_SIZE = 64 * 1024 * 1024
+DEFAULT_STAMP_OVERLAY_CACHE_DIRECTORY_MAXIMUM_SIZE = 512 * 1024 * 1024
+
+STAMP_OVERLAY_FILE_HEADER = struct.Struct('!iiII')
+
+
+class FontRegistry:
+    """
+    Bounded, thread-safe registry of parsed fonts keyed by name and size.
+
+    Parsing a TrueType font is too expensive to repeat on every page render,
+    so the parsed instances are shared by all stamp transformations of a
+    process. The least recently used entry is evicted once the registry is
+    full.
+    """
+
+    def __init__(self, maximum_size=DEFAULT_FONT_REGISTRY_MAXIMUM_SIZE):
+        self.maximum_size = maximum_size
+        self.hits = 0
+        self.misses = 0
+        self._fonts = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._fonts.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get(self, name=DEFAULT_FONT_NAME, size=DEFAULT_FONT_SIZE):
+        key = (name, size)
+
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self._fonts.move_to_end(key)
+                self.hits += 1
+                return font
+
+            self.misses += 1
+
+        # Note: Parsing happens outside of the lock, two threads missing the
+        # same key at the same time only cost one redundant parse.
+        font = _load_font(name=name, size=size)
+
+        with self._lock:
+            self._fonts[key] = font
+            self._fonts.move_to_end(key)
+            while len(self._fonts) > self.maximum_size:
+                self._fonts.popitem(last=False)
+
+        return font
+
+    def get_statistics(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'maximum_size': self.maximum_size,
+                'misses': self.misses,
+                'size': len(self._fonts),
+            }
+
+    def warm(self, fonts=((DEFAULT_FONT_NAME, DEFAULT_FONT_SIZE),)):
+        """
+        Load the given (name, size) pairs, intended to run once per worker
+        process before the first page is rendered.
+        """
+        for name, size in fonts:
+            self.get(name=name, size=size)
+
+
+font_registry = FontRegistry()
+
+
+StampPatch = collections.namedtuple('StampPatch', ('position', 'image'))
+
+
+class StampOverlayCache:
+    """
+    Content addressed cache of rendered stamp overlays.
+
+    An overlay is the list of patches produced for one set of stamp inputs,
+    the key is a hash over these inputs. Entries are held in memory up to
+    "maximum_size" bytes. The least recently used entries are spilled into
+    "directory" if one is configured, which again is pruned by modification
+    time once it grows beyond "directory_maximum_size" bytes.
+    """
+
+    def __init__(
+        self, directory=None,
+        directory_maximum_size=DEFAULT_STAMP_OVERLAY_CACHE_DIRECTORY_MAXIMUM_SIZE,
+        maximum_size=DEFAULT_STAMP_OVERLAY_CACHE_MAXIMUM_SIZE
+    ):
+        self.directory = directory
+        self.directory_maximum_size = directory_maximum_size
+        self.maximum_size = maximum_size
+        self.directory_hits = 0
+        self.hits = 0
+        self.misses = 0
+        self._directory_size = None
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+
+    @staticmethod
+    def get_key(**inputs):
+        digest = hashlib.sha256()
+        for name in sorted(inputs):
+            digest.update(repr((name, inputs[name])).encode('utf-8'))
+        return digest.hexdigest()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        patches = self._directory_get(key=key)
+
+        with self._lock:
+            if patches is None:
+                self.misses += 1
+                return None
+
+            self.directory_hits += 1
+
+        self.set(key=key, patches=patches)
+        return patches
+
+    def get_statistics(self):
+        with self._lock:
+            return {
+                'directory_hits': self.directory_hits,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'maximum_size': self.maximum_size,
+                'misses': self.misses,
+                'size': self._size,
+            }
+
+    def set(self, key, patches):
+        size = sum(
+            patch.image.width * patch.image.height * 4 for patch in patches
+        )
+        evicted = []
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous:
+                self._size -= previous[1]
+
+            self._entries[key] = (patches, size)
+            self._size += size
+
+            while self._size > self.maximum_size and len(self._entries) > 1:
+                evicted_key, (evicted_patches, evicted_size) = (
+                    self._entries.popitem(last=False)
+                )
+                self._size -= evicted_size
+                evicted.append((evicted_key, evicted_patches))
+
+        for evicted_key, evicted_patches in evicted:
+            self._directory_set(key=evicted_key, patches=evicted_patches)
+
+    def _directory_get(self, key):
+        if not self.directory:
+            return None
+
+        path = os.path.join(self.directory, key)
+        try:
+            with open(path, mode='rb') as file_object:
+                data = file_object.read()
+        except OSError:
+            return None
+
+        try:
+            patches = _decode_stamp_patches(data=zlib.decompress(data))
+        except (EOFError, struct.error, ValueError, zlib.error):
+            # Note: A truncated or corrupt file is a miss, it is removed so
+            # that the overlay gets spilled again.
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return patches
+
+    def _directory_prune(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = sum(entry[1] for entry in entries)
+        for mtime, file_size, path in sorted(entries):
+            if size <= self.directory_maximum_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            size -= file_size
+
+        return size
+
+    def _directory_set(self, key, patches):
+        if not self.directory:
+            return
+
+        data = b''.join(
+            STAMP_OVERLAY_FILE_HEADER.pack(
+                *patch.position, patch.image.width, patch.image.height
+            ) + patch.image.tobytes() for patch in patches
+        )
+        data = zlib.compress(data)
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Note: The temporary file name is unique across the processes
+            # and threads which share the directory.
+            with tempfile.NamedTemporaryFile(
+                delete=False, dir=self.directory, prefix=key, suffix='.tmp'
+            ) as file_object:
+                file_object.write(data)
+            os.replace(file_object.name, os.path.join(self.directory, key))
+        except OSError:
+            # Note: The spill directory is an optimization only, a failure to
+            # write into it must not fail the page rendering.
+            return
+
+        with self._lock:
+            if self._directory_size is None:
+                self._directory_size = 0
+                prune = True
+            else:
+                self._directory_size += len(data)
+                prune = self._directory_size > self.directory_maximum_size
+
+        if prune:
+            directory_size = self._directory_prune()
+            with self._lock:
+                self._directory_size = directory_size
+
+
+stamp_overlay_cache = StampOverlayCache()
+
+
+class StampOutputSize(threading.local):
+    """
+    The size of the image which the current thread is rendering.
+
+    The decorations of a page are applied before the resize of a preview or
+    thumbnail, so the stamp transformation does not know the final size by
+    itself. Code which renders a page at a reduced size can announce it
+    here, the stamp then shrinks the page first and is drawn at the output
+    size instead of the full resolution.
+
+    The caller announces it only for pages on which the stamp is the only
+    transformation, others work in absolute pixels, see
+    "get_stamp_only_page_ids".
+    """
+    size = None
+
+    def get(self):
+        return self.size
+
+    @contextlib.contextmanager
+    def request(self, width, height):
+        previous, self.size = self.size, (width, height)
+        try:
+            yield
+        finally:
+            self.size = previous
+
+
+stamp_output_size = StampOutputSize()
+
 
 class TransformationStampAccountingMetadataMixin:
+    """
+    The offsets and the font size of the stamp are given for the reference
+    page and scaled with the short side of the actual page, so that a stamp
+    looks the same at every resolution.
+    """
+    font_name = DEFAULT_FONT_NAME
+    font_size = DEFAULT_FONT_SIZE
+    reference_size = DEFAULT_STAMP_REFERENCE_SIZE
+    text_color = DEFAULT_TEXT_COLOR
+
+    # Offsets on the reference page: from the right border, from the top
+    # border for the first two texts, from the bottom border for the last.
+    offset_right = 200
+    offset_top = (100, 200)
+    offset_bottom = 500
+
+    def get_font(self, size):
+        return font_registry.get(
+            name=self.font_name, size=self.get_font_size(size=size))
+
+    def get_font_size(self, size):
+        return max(1, round(self.font_size * self.get_scale(size=size)))
+
+    def get_scale(self, size):
+        """
+        Returns the factor from the reference page to a page of the given
+        size.
+        """
+        return min(size) / min(self.reference_size)
+
+    def get_stamp_texts(self, size):
+        """
+        Returns the texts to stamp as (position, text, anchor) tuples for a
+        page of the given size.
+        """
+        scale = self.get_scale(size=size)
+        pos_x = size[0] - round(self.offset_right * scale)
+        pos_y_doc_number, pos_y_booked_stamp = (
+            round(offset * scale) for offset in self.offset_top
+        )
+
+        return (
+            (
+                (pos_x, pos_y_doc_number), self.acct_doc_number,
+                ANCHOR_RIGHT_ASCENDER
+            ),
+            (
+                (pos_x, pos_y_booked_stamp), self.acct_booked_stamp,
+                ANCHOR_RIGHT_ASCENDER
+            ),
+            (
+                (pos_x, size[1] - round(self.offset_bottom * scale)),
+                self.acct_assignment, ANCHOR_RIGHT_DESCENDER
+            ),
+        )
+
+    def render_stamp_patches(self, size):
+        """
+        Renders the stamp for a page of the given size as a list of small
+        RGBA patches which only cover the bounding boxes of the texts.
+        """
+        font = self.get_font(size=size)
+        patches = []
+        for position, text, anchor in self.get_stamp_texts(size=size):
+            patch = _render_text_patch(
+                anchor=anchor, color=self.text_color, font=font,
+                page_size=size, position=position, text=text)
+            if patch:
+                patches.append(patch)
+
+        return patches
 
-    def execute_on(self, *args, **kwargs):
-        super().execute_on(*args, **kwargs)
+    def get_stamp_patches(self, size):
+        """
+        Returns the patches for a page of the given size, rendering them only
+        if the same overlay is not yet in the cache.
+        """
+        key = stamp_overlay_cache.get_key(
+            color=self.text_color,
+            font=(self.font_name, self.get_font_size(size=size)),
+            size=size, texts=self.get_stamp_texts(size=size))
 
-        self.font = _get_font()
+        patches = stamp_overlay_cache.get(key=key)
+        if patches is None:
+            patches = self.render_stamp_patches(size=size)
+            stamp_overlay_cache.set(key=key, patches=patches)
 
-    def stamp_accounting_data(self, image):
+        return patches
+
+    def stamp_accounting_data(self, image, output_size=None):
         """
         Stamps accounting data into the document
+
+        With "output_size" the page is first shrunk to fit into it and the
+        stamp is drawn at that size.
         """
+        if output_size:
+            image = fit_image(image=image, size=output_size)
 
-        image = image.convert(mode='RGBA')
-        txt_image = Image.new(
-            mode='RGBA', size=image.size, color=(255, 255, 255, 0))
-        draw = ImageDraw.Draw(im=txt_image)
+        patches = self.get_stamp_patches(size=image.size)
+        return blend_stamp_patches(image=image, patches=patches)
 
-        # TODO: calculated positions better:
-        # - x percent from the right
-        # - x percent from the bottom
-        pos_x = image.size[0] - 200
-        pos_y = 100
-        text_color = (255, 0, 0, 155)
 
-        draw.text(
-            (pos_x, pos_y), self.acct_doc_number,
-            anchor=ANCHOR_RIGHT_ASCENDER, font=self.font,
-            fill=text_color)
+def blend_stamp_patches(image, patches):
+    """
+    Blend the patches into the image in place.
 
-        pos_y = 200
+    Only the regions covered by the patches are touched. Pages which cannot
+    show the colored stamp are converted first, "RGB" and "RGBA" pages keep
+    their mode.
+    """
+    if not patches:
+        return image
 
-        draw.text(
-            (pos_x, pos_y), self.acct_booked_stamp,
-            anchor=ANCHOR_RIGHT_ASCENDER, font=self.font, fill=text_color)
+    image = _ensure_color_mode(image)
 
-        pos_y = image.size[1] - 500
+    for patch in patches:
+        if image.mode == 'RGBA':
+            image.alpha_composite(patch.image, dest=patch.position)
+        else:
+            image.paste(patch.image, box=patch.position, mask=patch.image)
 
-        draw.text(
-            (pos_x, pos_y), self.acct_assignment,
-            anchor=ANCHOR_RIGHT_DESCENDER, font=self.font, fill=text_color)
+    return image
 
-        image = Image.alpha_composite(image, txt_image)
 
+def fit_image(image, size):
+    """
+    Shrink the image to fit into the size keeping its aspect ratio, like
+    the resize transformation does. A height of None fits the width only.
+    Images which already fit are returned unchanged.
+    """
+    width, height = size[0], size[1] or image.height
+    if image.width <= width and image.height <= height:
         return image
 
+    image.thumbnail(size=(width, height), resample=Image.LANCZOS)
+    return image
+
+
+def _decode_stamp_patches(data):
+    patches = []
+    offset = 0
+    while offset < len(data):
+        left, top, width, height = STAMP_OVERLAY_FILE_HEADER.unpack_from(
+            data, offset)
+        offset += STAMP_OVERLAY_FILE_HEADER.size
+        length = width * height * 4
+        if offset + length > len(data):
+            raise ValueError('Truncated stamp overlay patch.')
+        image = Image.frombytes(
+            mode='RGBA', size=(width, height),
+            data=data[offset:offset + length])
+        offset += length
+        patches.append(StampPatch(position=(left, top), image=image))
+
+    return patches
+
+
+def _ensure_color_mode(image):
+    if image.mode in ('RGB', 'RGBA'):
+        return image
+
+    if image.mode in ('LA', 'PA') or 'transparency' in image.info:
+        return image.convert(mode='RGBA')
+
+    return image.convert(mode='RGB')
+
+
+def _render_text_patch(anchor, color, font, page_size, position, text):
+    if not text:
+        return None
+
+    pos_x, pos_y = position
+    left, top, right, bottom = _measure_draw.textbbox(
+        (pos_x, pos_y), text, anchor=anchor, font=font)
+
+    # Clip to the page, texts may partially run over the border.
+    left, top = max(left, 0), max(top, 0)
+    right, bottom = min(right, page_size[0]), min(bottom, page_size[1])
+    if right <= left or bottom <= top:
+        return None
+
+    mask = Image.new(mode='L', size=(right - left, bottom - top), color=0)
+    ImageDraw.Draw(im=mask).text(
+        (pos_x - left, pos_y - top), text, anchor=anchor, font=font,
+        fill=color[3])
+
+    # Note: The color channels are filled completely, so that anti-aliased
+    # edges carry the text color and only the alpha channel fades out.
+    patch = Image.new(mode='RGBA', size=mask.size, color=color[:3] + (0,))
+    patch.putalpha(mask)
+
+    return StampPatch(position=(left, top), image=patch)
+
+
+# Measuring only needs a draw instance, the image behind it is never touched.
+_measure_draw = ImageDraw.Draw(im=Image.new(mode='L', size=(1, 1)))
+
+
+@functools.lru_cache(maxsize=None)
+def _get_font_bytes(name):
+    return pkgutil.get_data('botech.edms', 'fonts/{}.ttf'.format(name))
+
 
-def _get_font():
-    font_bytes = pkgutil.get_data('botech.edms', 'fonts/Roboto-Bold.ttf')
-    font_file = io.BytesIO(font_bytes)
-    font = ImageFont.truetype(font=font_file, size=80)
-    return font
+def _load_font(name, size):
+    font_file = io.BytesIO(_get_font_bytes(name))
+    return ImageFont.truetype(font=font_file, size=size)
@@ -3,15 +3,13 @@ from django.utils.translation import ugettext_lazy as _
 
 from mayan.apps.converter.layers import layer_decorations
 from mayan.apps.converter.transformations import BaseTransformation
-from mayan.apps.metadata.models import DocumentMetadata
 from mayan.apps.views.forms import Form
 
-from .settings import (
-    setting_acct_assignment,
-    setting_acct_booked_date,
-    setting_acct_doc_number,
+from .classes import document_id_for_page, stamp_data_provider
+from .profiling import profile_render
+from .transformation_mixins import (
+    TransformationStampAccountingMetadataMixin, stamp_output_size
 )
-from .transformation_mixins import TransformationStampAccountingMetadataMixin
 
 
 class TransformationStampAccountingMetadata(
@@ -21,49 +19,39 @@ class TransformationStampAccountingMetadata(
     Stamp accounting related metadata into the document.
     """
 
-    # TODO: There is an issue if there are no arguments.
-    # I assume that setting and saving the arguments is a step which also does some
-    # sort of cache invalidation. Probably without arguments this is not correctly
-    # triggered. Needs investigation and fix.
-    arguments = ('fake_argument',)
+    # Note: The digest of the stamped values is the only argument. It is part
+    # of the cache hash of the transformation, so that cached page images
+    # are not used anymore once the stamped values change. It is kept up to
+    # date by the signal handlers.
+    arguments = ('digest',)
     label = _('Stamp accounting metadata')
     name = 'stamp_accounting'
 
     class Form(Form):
-        fake_argument = forms.IntegerField(
+        digest = forms.CharField(
             widget=forms.HiddenInput,
             required=False)
 
     # TODO: check if it can be removed
     # Seems to have in this class the role to prepare arguments. Without arguments this
     # may not be needed at all here.
+    @profile_render(name='stamp_accounting')
     def execute_on(self, *args, **kwargs):
         # Prepare all arguments
         super().execute_on(*args, **kwargs)
         self._prepare_arguments()
 
         # Let the mixin do the work
-        return self.stamp_accounting_data(self.image)
+        return self.stamp_accounting_data(
+            self.image, output_size=stamp_output_size.get())
 
     def _prepare_arguments(self):
+        stamp_data = stamp_data_provider.get(
+            document_id=self.get_document_id(), digest=self.digest)
 
-        document = self.get_document()
-        document_metadata = document.metadata
-
-        def metadata_value(type_name):
-            try:
-                return document_metadata.get(
-                    metadata_type__name=type_name).value
-            except DocumentMetadata.DoesNotExist as e:
-                # TODO: This case is exceptional, work on better handling of this
-                # situation.
-                return ''
-
-        self.acct_doc_number = metadata_value(setting_acct_doc_number.value)
-        self.acct_booked_stamp = 'BOOKED ' + metadata_value(
-            setting_acct_booked_date.value)
-        self.acct_assignment = metadata_value(setting_acct_assignment.value)
-
+        self.acct_doc_number = stamp_data.acct_doc_number
+        self.acct_booked_stamp = 'BOOKED ' + stamp_data.acct_booked_date
+        self.acct_assignment = stamp_data.acct_assignment
 
     def get_document(self):
         """
@@ -74,6 +62,15 @@ class TransformationStampAccountingMetadata(
         document = _document_from_file_or_version_page(file_or_version_page)
         return document
 
+    def get_document_id(self):
+        """
+        Get the id of the Document to which this transformation is applied
+        without loading the page, version and document instances.
+        """
+        return document_id_for_page(
+            content_type_id=self.object_layer.content_type_id,
+            object_id=self.object_layer.object_id)
+
 # TODO: This should be provided by the page model to get the parent.
 # This is internal knowledge of the documents app and should be moved
 # into the mayan-edms repository.
@@ -1,8 +1,17 @@
 from django.conf.urls import url
 
+from .profiling import profile_view
 from .views import (
+    AccountingDocumentBulkBookView,
     AccountingDocumentEditView,
+    BookedDocumentExportView,
+    CabinetChoiceSearchView,
+    DocumentTypeChoiceSearchView,
     PreProcessDocumentEditView,
+    PreProcessDocumentTypeRefreshView,
+    PreProcessQueueStartView,
+    TagChoiceSearchView,
+    ViewMetricsView,
 )
 
 
@@ -11,8 +20,53 @@ urlpatterns = [
         regex=r'^documents/(?P<document_id>\d+)/accounting/$',
         name='document_acct_edit_view', view=AccountingDocumentEditView.as_view()
     ),
+    url(
+        regex=r'^documents/multiple/accounting/book/$',
+        name='document_multiple_acct_book',
+        view=AccountingDocumentBulkBookView.as_view()
+    ),
     url(
         regex=r'^documents/(?P<document_id>\d+)/pre-process/$',
         name='document_pre_process_view', view=PreProcessDocumentEditView.as_view()
     ),
+    url(
+        regex=r'^documents/(?P<document_id>\d+)/pre-process/document_type/$',
+        name='document_pre_process_document_type',
+        view=PreProcessDocumentTypeRefreshView.as_view()
+    ),
+    url(
+        regex=r'^cabinets/(?P<cabinet_id>\d+)/pre-process/$',
+        name='cabinet_pre_process_queue_start',
+        view=PreProcessQueueStartView.as_view()
+    ),
+    url(
+        regex=r'^documents/multiple/pre-process/$',
+        name='document_multiple_pre_process_queue_start',
+        view=PreProcessQueueStartView.as_view()
+    ),
+    url(
+        regex=r'^documents/booked/export/$', name='booked_document_export',
+        view=BookedDocumentExportView.as_view()
+    ),
+    url(
+        regex=r'^metrics/$', name='view_metrics',
+        view=ViewMetricsView.as_view()
+    ),
+    url(
+        regex=r'^choices/cabinets/$', name='cabinet_choices',
+        view=CabinetChoiceSearchView.as_view()
+    ),
+    url(
+        regex=r'^choices/document_types/$', name='document_type_choices',
+        view=DocumentTypeChoiceSearchView.as_view()
+    ),
+    url(
+        regex=r'^choices/tags/$', name='tag_choices',
+        view=TagChoiceSearchView.as_view()
+    ),
 ]
+
+# Note: Profiles a sampled fraction of the requests, see the setting
+# "BOTECH_PROFILER_REQUEST_RATE".
+for urlpattern in urlpatterns:
+    urlpattern.callback = profile_view(view=urlpattern.callback)
@@ -1,38 +1,55 @@
 from datetime import date
+import hmac
 
 from django.conf import settings
 from django.contrib import messages
 from django.core.exceptions import ValidationError
-from django.http import HttpResponseRedirect
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.core.paginator import Paginator
+from django.http import (
+    Http404, HttpResponse, HttpResponseRedirect, JsonResponse,
+    StreamingHttpResponse)
+from django.shortcuts import get_object_or_404
+from django.template.loader import render_to_string
 from django.urls import reverse, reverse_lazy
-from django.utils.translation import ugettext_lazy as _
+from django.utils.translation import ugettext_lazy as _, ungettext
+from django.views.generic.base import View
 from django.views.generic.detail import SingleObjectMixin
+from stronghold.views import StrongholdPublicMixin
 
 from mayan.apps.acls.models import AccessControlList
-from mayan.apps.cabinets.forms import CabinetListForm
+from mayan.apps.cabinets.events import (
+    event_cabinet_document_added, event_cabinet_document_removed)
 from mayan.apps.cabinets.models import Cabinet
-from mayan.apps.converter.layers import layer_decorations
-from mayan.apps.converter.models import (
-    ObjectLayer, LayerTransformation)
+from mayan.apps.cabinets.permissions import (
+    permission_cabinet_add_document, permission_cabinet_view)
 from mayan.apps.converter.transformations import TransformationResize
-from mayan.apps.documents.models import Document
+from mayan.apps.documents.events import event_document_edited
+from mayan.apps.documents.models import Document, DocumentType
 from mayan.apps.documents.forms.document_forms import DocumentPropertiesForm
 from mayan.apps.documents.forms.document_type_forms import DocumentTypeFilteredSelectForm
 from mayan.apps.documents.forms.document_version_forms import (
     DocumentVersionPreviewForm)
 from mayan.apps.documents.permissions import (
-    permission_document_edit)
+    permission_document_edit,
+    permission_document_type_view,
+    permission_document_view)
 from mayan.apps.documents.settings import (
     setting_preview_height,
     setting_preview_width)
+from mayan.apps.document_comments.events import (
+    event_document_comment_created)
 from mayan.apps.document_comments.models import Comment
 from mayan.apps.metadata.api import save_metadata_list
-from mayan.apps.metadata.models import DocumentMetadata, MetadataType
+from mayan.apps.metadata.events import event_document_metadata_removed
+from mayan.apps.metadata.models import DocumentMetadata
 from mayan.apps.metadata.permissions import (
-    permission_document_metadata_edit,
     permission_document_metadata_remove)
-from mayan.apps.tags.forms import TagMultipleSelectionForm
+from mayan.apps.permissions.classes import Permission
+from mayan.apps.tags.events import event_tag_attached, event_tag_removed
 from mayan.apps.tags.models import Tag
+from mayan.apps.tags.permissions import permission_tag_attach
 from mayan.apps.views.mixins import (
     MultipleObjectViewMixin,
     RestrictedQuerysetViewMixin,
@@ -40,21 +57,36 @@ from mayan.apps.views.mixins import (
 from mayan.apps.views.generics import (
     ConfirmView, MultiFormView, MultipleObjectFormActionView)
 
-from .fixes import save_metadata
+from .accounting import (
+    AccountingSnapshot, Booking,
+    attach_stamp_accounting_metadata_transformations, book_documents)
+from .classes import (
+    PreProcessQueue, deferred_events, metadata_type_resolver)
+from .exports import EXPORT_FORMATS, iter_booked_documents
+from .fixes import (
+    change_document_type, get_metadata_formset_initial, save_metadata)
+from .instrumentation import InstrumentedViewMixin, view_metrics
 from .forms import (
-    CommentForm, OptionalCommentForm, DocumentForm, DocumentMetadataFormSet)
+    BulkBookingForm, CabinetDeltaForm, CommentForm, OptionalCommentForm,
+    DocumentForm, DocumentMetadataFormSet, DocumentTypeRefreshForm,
+    TagDeltaForm)
+from .models import AccountingDocumentNumber, AccountingNumberSequence
+from .permissions import permission_view_metrics
 from .settings import (
-    setting_botech_booked_tag,
     setting_acct_assignment,
     setting_acct_booked_date,
     setting_acct_doc_number,
     setting_acct_entity,
     setting_acct_fiscal_year,
-    setting_acct_number_range)
-from .transformations import TransformationStampAccountingMetadata
+    setting_acct_number_range,
+    setting_botech_booked_tag,
+    setting_view_instrumentation,
+    setting_view_metrics_token)
+from .tasks import task_pre_process_warm
 
 
 class AccountingDocumentEditView(
+        InstrumentedViewMixin,
         RestrictedQuerysetViewMixin,
         SingleObjectMixin,
         RedirectionViewMixin,
@@ -128,6 +160,8 @@ class AccountingDocumentEditView(
         # Note: SingleObjectMixin depends on this to render the context. Even
         # though it does define "get_object()", it is not using it.
         self.object = self.get_object()
+        self.snapshot = AccountingSnapshot(
+            document=self.object, user=request.user)
 
         # TODO: Find a better place. This view shall not be usable if the
         # document number has already been set. Should be a generic check if
@@ -214,7 +248,7 @@ class AccountingDocumentEditView(
         return kwargs
 
     def get_form_extra_kwargs__properties(self):
-        document = self.get_object()
+        document = self.object
         return {
             'instance': document,
         }
@@ -233,79 +267,57 @@ class AccountingDocumentEditView(
         }
 
     def get_initial__metadata(self):
-        document = self.object
-        metadata_queryset = self._get_accounting_metadata()
-        metadata = {}
-
-        # TODO: The handling looks very complicated and may be due to the
-        # "multi document" support in the edit metadata view. There is no
-        # reason why for a single document there could ever by two values for a
-        # given metadata type.
-        for document_metadata in metadata_queryset:
-            # Metadata value cannot be None here, fallback to an empty
-            # string
-            value = document_metadata.value or ''
-            if document_metadata.metadata_type in metadata:
-                if value not in metadata[document_metadata.metadata_type]:
-                    metadata[document_metadata.metadata_type].append(value)
-            else:
-                metadata[document_metadata.metadata_type] = [value] if value else ''
-
-        def value_to_initial(value):
-            return ', '.join(value) if value else ''
-
-
-        initial = []
-        for key, value in metadata.items():
-            value = value_to_initial(value)
-            # TODO: Why can the form not get the document_metadata object?
-            initial.append(
-                {
-                    'document_type': document.document_type,
-                    'metadata_type': key,
-                    'update': False,
-                    'value': value,
-                    'value_existing': value
-                }
-            )
-        return initial
+        return get_metadata_formset_initial(
+            document=self.object,
+            document_metadata_list=self.snapshot.get_editable_metadata()
+        )
 
     def get_initial__comment(self):
-        document = self.object
         initial = {
             'booked_date': date.today().isoformat(),
         }
 
-        metadata_type = MetadataType.objects.get(
-            name=setting_acct_booked_date.value)
-        try:
-            document_metadata = DocumentMetadata.objects.get(
-                metadata_type=metadata_type,
-                document=document)
+        document_metadata = self.snapshot.get_metadata(
+            setting=setting_acct_booked_date)
+        if document_metadata:
             initial['booked_date'] = document_metadata.value
-        except DocumentMetadata.DoesNotExist:
-            pass
 
-        metadata_type = MetadataType.objects.get(
-            name=setting_acct_assignment.value)
-        try:
-            document_metadata = DocumentMetadata.objects.get(
-                metadata_type=metadata_type,
-                document=document)
+        document_metadata = self.snapshot.get_metadata(
+            setting=setting_acct_assignment)
+        if document_metadata:
             initial['text'] = document_metadata.value
-        except DocumentMetadata.DoesNotExist:
-            pass
+
+        doc_number = AccountingNumberSequence.objects.peek(
+            entity=self.snapshot.get_value(setting=setting_acct_entity) or '',
+            fiscal_year=self.snapshot.get_value(
+                setting=setting_acct_fiscal_year) or '',
+            number_range=self.snapshot.get_value(
+                setting=setting_acct_number_range) or ''
+        )
+        if doc_number:
+            initial['doc_number'] = doc_number
+            initial['doc_number_proposed'] = doc_number
 
         return initial
 
     def post(self, request, *args, **kwargs):
         forms_to_validate = [form for name, form in self.forms.items()
                  if name not in self.skip_form_validation]
-        if all([form.is_valid() for form in forms_to_validate]):
+        with self.instrument(phase='validation'):
+            is_valid = all([form.is_valid() for form in forms_to_validate])
+        if is_valid:
             return self.forms_valid(forms=self.forms)
         else:
             return self.forms_invalid(forms=self.forms)
 
+    def forms_valid(self, forms):
+        # Note: MultiFormView ignores the result of "all_forms_valid" and
+        # always redirects, the form is shown again if the booking failed.
+        response = self.all_forms_valid(forms=forms)
+        if response:
+            return response
+
+        return HttpResponseRedirect(redirect_to=self.get_success_url())
 
     def all_forms_valid(self, forms):
         """
@@ -315,27 +327,59 @@ class AccountingDocumentEditView(
         does allow to change values.
         """
 
-        self.form_valid_metadata(forms['metadata'])
-        self.form_valid_comment(forms['comment'])
-        self.tag_document_as_booked()
-        self.attach_stamp_accounting_metadata_transformation()
+        # Note: The unique constraint of the document number registry is the
+        # final check for duplicates, the booking is applied as a whole or
+        # not at all.
+        try:
+            with AccountingDocumentNumber.objects.enforce_unique():
+                with transaction.atomic():
+                    self.form_valid_metadata(forms['metadata'])
+                    self.form_valid_comment(forms['comment'])
+                    self.tag_document_as_booked()
+                    self.attach_stamp_accounting_metadata_transformation()
+        except ValidationError as exception:
+            forms['comment'].add_error(field=None, error=exception)
+            return self.forms_invalid(forms=forms)
+        except IntegrityError:
+            messages.error(
+                message=_(
+                    'Document number "%s" is already used for the same '
+                    'entity, fiscal year and number range.'
+                ) % forms['comment'].cleaned_data['doc_number'],
+                request=self.request
+            )
+            return self.forms_invalid(forms=forms)
+
 
+    def _add_message_on_commit(self, level, message):
+        # Note: The booking may still be rolled back, the message is only
+        # shown once it has been committed.
+        transaction.on_commit(
+            lambda: messages.add_message(
+                level=level, message=message, request=self.request)
+        )
 
     def form_valid_metadata(self, form):
-        metadata_queryset = self._get_accounting_metadata()
+        editable_metadata_type_ids = set(
+            document_metadata.metadata_type_id for document_metadata
+            in self.snapshot.get_editable_metadata()
+        )
         document = self.object
 
         errors = []
         for form in form.forms:
             if form.cleaned_data['update']:
-                if metadata_queryset.filter(
-                        metadata_type=form.cleaned_data['metadata_type_id']).exists():
+                metadata_type_id = int(form.cleaned_data['metadata_type_id'])
+                if metadata_type_id in editable_metadata_type_ids:
                     try:
-                        # TODO: Use save_metadata directly and simplify
-                        save_metadata_list(
-                            metadata_list=[form.cleaned_data], document=document,
-                            _user=self.request.user
-                        )
+                        # Note: The savepoint keeps the transaction usable if
+                        # saving a single entry fails.
+                        with transaction.atomic():
+                            # TODO: Use save_metadata directly and simplify
+                            save_metadata_list(
+                                metadata_list=[form.cleaned_data],
+                                document=document, _user=self.request.user
+                            )
                     except Exception as exception:
                         errors.append(exception)
 
@@ -355,14 +399,17 @@ class AccountingDocumentEditView(
                 }, request=self.request
             )
         else:
-            messages.success(
-                message=_(
+            self._add_message_on_commit(
+                level=messages.SUCCESS, message=_(
                     'Metadata for document %s edited successfully.'
-                ) % document, request=self.request
+                ) % document
             )
 
     def form_valid_comment(self, form):
         acct_doc_number = form.cleaned_data['doc_number']
+        if form.is_doc_number_proposed():
+            acct_doc_number = self._allocate_acct_doc_number(
+                proposed=acct_doc_number)
         self._set_acct_doc_number(acct_doc_number)
 
         acct_booked_date = form.cleaned_data['booked_date']
@@ -371,44 +418,64 @@ class AccountingDocumentEditView(
         comment_text = form.cleaned_data['text']
         self._set_assignment_comment_if_provided(comment_text)
 
+    def _allocate_acct_doc_number(self, proposed):
+        # Note: The metadata form is already saved, the number range may have
+        # been changed with it.
+        entity, fiscal_year, number_range, doc_number = (
+            AccountingDocumentNumber.objects.get_values(
+                document_id=self.object.pk)
+        )
+        acct_doc_number = AccountingNumberSequence.objects.allocate(
+            entity=entity, fiscal_year=fiscal_year, number_range=number_range
+        )
+        if not acct_doc_number:
+            raise ValidationError(
+                message=_(
+                    'The number range "%s" does not hand out document '
+                    'numbers, enter the document number.'
+                ) % number_range
+            )
+
+        if acct_doc_number != proposed:
+            self._add_message_on_commit(
+                level=messages.INFO, message=_(
+                    'The proposed document number %(proposed)s has been '
+                    'taken meanwhile, the document got %(doc_number)s.'
+                ) % {
+                    'doc_number': acct_doc_number, 'proposed': proposed
+                }
+            )
+
+        return acct_doc_number
+
     def _set_acct_doc_number(self, acct_doc_number):
         self._ensure_no_acct_doc_number()
 
         document = self.object
-        metadata_type = MetadataType.objects.get(
-            name=setting_acct_doc_number.value)
+        metadata_type_id = metadata_type_resolver.get_id(
+            required=True, setting=setting_acct_doc_number)
 
         document_metadata = DocumentMetadata(
             document=document,
-            metadata_type=metadata_type,
+            metadata_type_id=metadata_type_id,
             value=acct_doc_number)
         document_metadata._event_actor = self.request.user
         document_metadata.save()
 
     def _ensure_no_acct_doc_number(self):
-        metadata_type = MetadataType.objects.get(
-            name=setting_acct_doc_number.value)
-        document = self.object
-
-        document_metadata = DocumentMetadata.objects.filter(
-            metadata_type=metadata_type,
-            document=document)
-        if document_metadata.exists():
+        if self.snapshot.has_doc_number:
             raise NotImplementedError('Handling for this case is not yet implemented')
 
 
     def _set_assignment_comment_if_provided(self, comment_text):
         document = self.object
-        metadata_type = MetadataType.objects.get(
-            name=setting_acct_assignment.value)
 
-        try:
-            document_metadata = DocumentMetadata.objects.get(
-                metadata_type=metadata_type,
-                document=document)
-        except DocumentMetadata.DoesNotExist:
+        document_metadata = self.snapshot.get_metadata(
+            setting=setting_acct_assignment)
+        if not document_metadata:
             document_metadata = DocumentMetadata(
-                metadata_type=metadata_type,
+                metadata_type_id=metadata_type_resolver.get_id(
+                    required=True, setting=setting_acct_assignment),
                 document=document)
 
         document_metadata.value = comment_text
@@ -417,84 +484,202 @@ class AccountingDocumentEditView(
 
     def _set_acct_booked_date(self, booked_date):
         document = self.object
-        metadata_type = MetadataType.objects.get(
-            name=setting_acct_booked_date.value)
 
-        document_metadata, created = DocumentMetadata.objects.get_or_create(
-            metadata_type=metadata_type,
-            document=document)
+        document_metadata = self.snapshot.get_metadata(
+            setting=setting_acct_booked_date)
+        if not document_metadata:
+            document_metadata = DocumentMetadata(
+                metadata_type_id=metadata_type_resolver.get_id(
+                    required=True, setting=setting_acct_booked_date),
+                document=document)
         document_metadata.value = booked_date
         document_metadata._event_actor = self.request.user
         document_metadata.save()
 
     def tag_document_as_booked(self):
         document = self.object
-        booked_tag = self._get_booked_tag()
+        booked_tag = self.snapshot.booked_tag
+        if not booked_tag:
+            raise ValidationError(
+                message=_(
+                    'The tag "%s" does not exist, create it to book documents.'
+                ) % setting_botech_booked_tag.value
+            )
 
         # TODO: This is a case which should result at least in a warning, since
         # normally this should not happen.
         #
         # Note that attaching the tag does trigger a workflow.
-        if document.tags.filter(pk=booked_tag.pk).exists():
+        if booked_tag.is_attached:
             raise NotImplementedError()
 
         booked_tag._event_actor = self.request.user
         booked_tag.attach_to(document)
 
-        messages.success(
-            message=_(
+        self._add_message_on_commit(
+            level=messages.SUCCESS, message=_(
                 'Attached booked tag to document %s'
-            ) % document, request=self.request)
+            ) % document)
 
     def attach_stamp_accounting_metadata_transformation(self):
         # TODO: Handle the case that this transformation is already attached
-
         document = self.object
-        active_version = document.versions.filter(active=True).first()
-        first_page = active_version.version_pages.first()
+        first_pages = {}
+        if self.snapshot.first_page:
+            first_pages[document.pk] = self.snapshot.first_page
+
+        attach_stamp_accounting_metadata_transformations(
+            documents=(document,), first_pages=first_pages)
+
+
+class AccountingDocumentBulkBookView(MultipleObjectFormActionView):
+    """
+    Book many documents at once, e.g. at the end of the month.
+
+    Takes the booked date once and a document number per document. All
+    documents are checked and written in one transaction, the result is
+    reported per document.
+    """
+
+    form_class = BulkBookingForm
+    object_permission = permission_document_edit
+    pk_url_kwarg = 'document_id'
+    post_action_redirect = reverse_lazy(viewname='documents:document_list')
+    source_queryset = Document.valid.all()
+    success_message = _('%(count)d document booked.')
+    success_message_plural = _('%(count)d documents booked.')
 
-        object_layer, created = ObjectLayer.objects.get_for(
-            layer=layer_decorations, obj=first_page
+    def get_extra_context(self):
+        return {
+            'submit_label': _('Save and mark as booked'),
+            'title': ungettext(
+                singular='Book the selected document',
+                plural='Book the selected documents',
+                number=self.object_list.count()
+            ),
+        }
+
+    def get_form_extra_kwargs(self):
+        return {
+            'document_list': self.object_list,
+            'initial': {'booked_date': date.today().isoformat()},
+        }
+
+    def view_action(self, form=None):
+        booked_date = form.cleaned_data['booked_date']
+        results = book_documents(
+            bookings=[
+                Booking(
+                    document=document, doc_number=doc_number,
+                    booked_date=booked_date
+                ) for document, doc_number in form.get_doc_numbers()
+            ], user=self.request.user
         )
 
-        layer_transformation = LayerTransformation(
-            object_layer = object_layer,
-            # TODO: Has to be found out for the given layer
-            order = 1,
-            name = TransformationStampAccountingMetadata.name,
-            arguments = '',
+        count = 0
+        for result in results:
+            if result.error:
+                messages.error(
+                    message=_(
+                        'Error booking document %(document)s: %(error)s'
+                    ) % {
+                        'document': result.document, 'error': result.error
+                    }, request=self.request
+                )
+            else:
+                count += 1
+
+        if count:
+            if count == 1:
+                message = self.success_message
+            else:
+                message = self.success_message_plural
+
+            messages.success(
+                message=message % {'count': count}, request=self.request)
+
+
+class PreProcessQueueStartView(View):
+    """
+    Start the pre processing of a list of documents.
+
+    The documents come either from the selection in a document list or from
+    a cabinet. They are kept in the session and the pre processing view
+    moves on to the next one after each submit.
+    """
+
+    def get(self, request, *args, **kwargs):
+        queryset = AccessControlList.objects.restrict_queryset(
+            queryset=self.get_document_queryset(),
+            permission=permission_document_edit, user=request.user
         )
-        layer_transformation.save()
+        document_ids = self.get_document_ids(queryset=queryset)
 
-    def _get_booked_tag(self):
-        return Tag.objects.get(label=setting_botech_booked_tag.value)
+        if not document_ids:
+            messages.error(
+                message=_('No documents to pre process.'), request=request
+            )
+            return HttpResponseRedirect(
+                redirect_to=request.META.get(
+                    'HTTP_REFERER', reverse(viewname='documents:document_list')
+                )
+            )
 
+        queue = PreProcessQueue.create(
+            session=request.session, document_ids=document_ids
+        )
 
-    def _get_accounting_metadata(self):
-        """
-        Create a QuerySet with the Accounting related Metadata of this document.
-        """
-        document = self.object
-        user = self.request.user
+        return HttpResponseRedirect(
+            redirect_to=queue.get_url(document_id=document_ids[0])
+        )
+
+    def get_document_ids(self, queryset):
+        if 'cabinet_id' in self.kwargs:
+            return list(
+                queryset.order_by('label', 'pk').values_list('pk', flat=True)
+            )
+
+        # Note: Keep the order of the selection in the document list.
+        allowed_ids = set(queryset.values_list('pk', flat=True))
+        return [
+            document_id for document_id in self._get_selected_ids()
+            if document_id in allowed_ids
+        ]
+
+    def get_document_queryset(self):
+        if 'cabinet_id' in self.kwargs:
+            cabinet = get_object_or_404(
+                klass=AccessControlList.objects.restrict_queryset(
+                    queryset=Cabinet.objects.all(),
+                    permission=permission_cabinet_view, user=self.request.user
+                ), pk=self.kwargs['cabinet_id']
+            )
+            return Document.valid.filter(cabinets=cabinet)
 
-        metadata = AccessControlList.objects.restrict_queryset(
-            queryset=document.metadata.all(),
-            permission=permission_document_metadata_edit,
-            user=user
+        return Document.valid.filter(pk__in=self._get_selected_ids())
+
+    def _get_selected_ids(self):
+        id_list = self.request.GET.get(
+            'id_list', self.request.POST.get('id_list', '')
         )
 
-        # TODO: Use a list of type ids or similar to filter
-        metadata = metadata.filter(
-            metadata_type__name__in=[
-                setting_acct_entity.value,
-                setting_acct_fiscal_year.value,
-                setting_acct_number_range.value,
-            ])
+        document_ids = []
+        for value in id_list.split(','):
+            try:
+                document_id = int(value)
+            except ValueError:
+                continue
+            if document_id not in document_ids:
+                document_ids.append(document_id)
+
+        return document_ids
 
-        return metadata
+    def post(self, request, *args, **kwargs):
+        return self.get(request, *args, **kwargs)
 
 
 class PreProcessDocumentEditView(
+        InstrumentedViewMixin,
         RestrictedQuerysetViewMixin,
         SingleObjectMixin,
         RedirectionViewMixin,
@@ -504,12 +689,12 @@ class PreProcessDocumentEditView(
     """
 
     form_classes = {
-        'cabinets': CabinetListForm,
+        'cabinets': CabinetDeltaForm,
         'comment': OptionalCommentForm,
         'metadata': DocumentMetadataFormSet,
         'preview': DocumentVersionPreviewForm,
         'properties': DocumentForm,
-        'tags': TagMultipleSelectionForm,
+        'tags': TagDeltaForm,
     }
     skip_form_validation = {
         'preview',
@@ -517,7 +702,7 @@ class PreProcessDocumentEditView(
     prefixes = {
         'cabinets': 'cabinets',
         'comment': 'comment',
-        'metadata': DocumentMetadataFormSet,
+        'metadata': 'metadata',
         'preview': 'preview',
         'properties': 'properties',
         'tags': 'tags',
@@ -532,9 +717,23 @@ class PreProcessDocumentEditView(
         # Note: SingleObjectMixin depends on this to render the context. Even
         # though it does define "get_object()", it is not using it.
         self.object = self.get_object()
+        self.queue = PreProcessQueue.get(
+            session=request.session, queue_id=request.GET.get('queue')
+        )
 
         return super().dispatch(request, *args, **kwargs)
 
+    def get(self, request, *args, **kwargs):
+        next_document_id = self._get_next_document_id()
+        if next_document_id:
+            # Note: Only the preview images are prepared in advance. The form
+            # data is loaded fresh, cabinets and tags may change meanwhile.
+            task_pre_process_warm.apply_async(
+                kwargs={'document_id': next_document_id}
+            )
+
+        return super().get(request, *args, **kwargs)
+
     def post(self, request, *args, **kwargs):
         # TODO: Implement a better solution to update only the document type so
         # that the remainder of the form works.
@@ -543,7 +742,9 @@ class PreProcessDocumentEditView(
 
         forms_to_validate = [form for name, form in self.forms.items()
                  if name not in self.skip_form_validation]
-        if all([form.is_valid() for form in forms_to_validate]):
+        with self.instrument(phase='validation'):
+            is_valid = all([form.is_valid() for form in forms_to_validate])
+        if is_valid:
             return self.forms_valid(forms=self.forms)
         else:
             return self.forms_invalid(forms=self.forms)
@@ -551,17 +752,25 @@ class PreProcessDocumentEditView(
     def post_refresh_document_type(self, request, *args, **kwargs):
         form = self.forms['properties']
         if form.is_valid():
-            self.form_valid_properties(form)
+            with deferred_events() as event_queue:
+                self.event_queue = event_queue
+                self.form_valid_properties(form)
         else:
             return self.forms_invalid(forms=[form])
         return HttpResponseRedirect(request.get_full_path())
 
     def all_forms_valid(self, forms):
-        self.form_valid_properties(forms['properties'])
-        self.form_valid_cabinets(forms['cabinets'])
-        self.form_valid_tags(forms['tags'])
-        self.form_valid_metadata(forms['metadata'])
-        self.form_valid_comment(forms['comment'])
+        # Note: All changes are applied in one transaction. The events are
+        # committed afterwards and only once each, so that the triggered
+        # workflows see the complete result of the submit.
+        with deferred_events() as event_queue:
+            self.event_queue = event_queue
+
+            self.form_valid_properties(forms['properties'])
+            self.form_valid_cabinets(forms['cabinets'])
+            self.form_valid_tags(forms['tags'])
+            self.form_valid_metadata(forms['metadata'])
+            self.form_valid_comment(forms['comment'])
 
     def form_valid_properties(self, form):
         # Note: Manually save by intention since changing the document type has
@@ -572,42 +781,60 @@ class PreProcessDocumentEditView(
         # Note: The form.instance contains already the modified values after
         # the call to ModelForm.clean, that's why we use the instance from self.object
         new_document_type = form.cleaned_data['document_type']
-        document.document_type_change(
-            new_document_type, _user=user)
+        change_document_type(
+            document=document, document_type=new_document_type, _user=user,
+            event_queue=self.event_queue)
 
+        form.instance._event_ignore = True
         form.save()
+        self.event_queue.add(
+            actor=user, event_type=event_document_edited, target=document)
 
     def form_valid_cabinets(self, form):
-        document = self.get_object()
-        current_cabinets = set(document.cabinets.all())
-        target_cabinets = set(form.cleaned_data['cabinets'])
+        document = self.object
+        user = self.request.user
+
+        # Note: Only the changes the user made are applied, each as one bulk
+        # write into the relation table.
+        to_remove = form.get_removed()
+        to_add = form.get_added()
 
-        to_remove = current_cabinets - target_cabinets
-        to_add = target_cabinets - current_cabinets
+        if to_remove:
+            document.cabinets.remove(*to_remove)
+        if to_add:
+            document.cabinets.add(*to_add)
 
         for cabinet in to_remove:
-            cabinet._event_actor = self.request.user
-            cabinet.document_remove(document)
+            self.event_queue.add(
+                action_object=cabinet, actor=user,
+                event_type=event_cabinet_document_removed, target=document)
 
         for cabinet in to_add:
-            cabinet._event_actor = self.request.user
-            cabinet.document_add(document)
+            self.event_queue.add(
+                action_object=cabinet, actor=user,
+                event_type=event_cabinet_document_added, target=document)
 
     def form_valid_tags(self, form):
-        document = self.get_object()
-        current_tags= set(document.tags.all())
-        target_tags = set(form.cleaned_data['tags'])
+        document = self.object
+        user = self.request.user
 
-        to_remove = current_tags - target_tags
-        to_add = target_tags - current_tags
+        to_remove = form.get_removed()
+        to_add = form.get_added()
+
+        if to_remove:
+            document.tags.remove(*to_remove)
+        if to_add:
+            document.tags.add(*to_add)
 
         for tag in to_remove:
-            tag._event_actor = self.request.user
-            tag.remove_from(document)
+            self.event_queue.add(
+                action_object=tag, actor=user, event_type=event_tag_removed,
+                target=document)
 
         for tag in to_add:
-            tag._event_actor = self.request.user
-            tag.attach_to(document)
+            self.event_queue.add(
+                action_object=tag, actor=user, event_type=event_tag_attached,
+                target=document)
 
     def form_valid_metadata(self, form):
         document = self.object
@@ -615,10 +842,14 @@ class PreProcessDocumentEditView(
         for form in form.forms:
             if form.cleaned_data['update']:
                 try:
-                    save_metadata(
-                        metadata_dict=form.cleaned_data, document=document,
-                        create=True, _user=self.request.user
-                    )
+                    # Note: The savepoint keeps the transaction usable if
+                    # saving a single entry fails.
+                    with transaction.atomic():
+                        save_metadata(
+                            metadata_dict=form.cleaned_data, document=document,
+                            create=True, _user=self.request.user,
+                            event_queue=self.event_queue
+                        )
                 except Exception as exception:
                     errors.append(exception)
 
@@ -629,11 +860,24 @@ class PreProcessDocumentEditView(
                     document_metadata = document.metadata.get(
                         metadata_type=form.cleaned_data['metadata_type_id'])
                     document_metadata._event_actor = self.request.user
-                    document_metadata.delete()
+                    document_metadata._event_ignore = True
+                    with transaction.atomic():
+                        document_metadata.delete()
                 except DocumentMetadata.DoesNotExist:
                     # TODO: Double check if it's save to ignore this or if a special
                     # handling might be required here.
                     pass
+                except Exception as exception:
+                    errors.append(exception)
+
+                    if settings.DEBUG or settings.TESTING:
+                        raise
+                else:
+                    self.event_queue.add(
+                        action_object=document_metadata.metadata_type,
+                        actor=self.request.user,
+                        event_type=event_document_metadata_removed,
+                        target=document)
 
         for error in errors:
             exception_message = _exception_to_message(error)
@@ -660,11 +904,21 @@ class PreProcessDocumentEditView(
                 text=text,
             )
             comment._event_actor = user
+            comment._event_ignore = True
             comment.save()
+            self.event_queue.add(
+                action_object=document, actor=user,
+                event_type=event_document_comment_created, target=comment)
 
     def get_form_extra_kwargs__properties(self):
         document = self.get_object()
         return {
+            'document_type_queryset': _get_choice_queryset(
+                queryset=DocumentType.objects.all(),
+                permission=permission_document_type_view,
+                user=self.request.user, current=DocumentType.objects.filter(
+                    pk=document.document_type_id)
+            ),
             'instance': document,
         }
 
@@ -683,80 +937,47 @@ class PreProcessDocumentEditView(
 
     def get_form_extra_kwargs__cabinets(self):
         return {
-            'queryset': Cabinet.objects.all(),
+            'queryset': _get_choice_queryset(
+                queryset=Cabinet.objects.all(),
+                permission=permission_cabinet_add_document,
+                user=self.request.user, current=self.object.cabinets.all()
+            ),
         }
 
     def get_form_extra_kwargs__tags(self):
         return {
-            'queryset': Tag.objects.all(),
+            'queryset': _get_choice_queryset(
+                queryset=Tag.objects.all(), permission=permission_tag_attach,
+                user=self.request.user, current=self.object.tags.all()
+            ),
         }
 
     def get_initial__cabinets(self):
         document = self.object
+        cabinets = list(document.cabinets.all())
         return {
-            'cabinets': document.cabinets.all(),
+            'cabinets': cabinets,
+            'shown': cabinets,
         }
 
     def get_initial__metadata(self):
-        document = self.object
-        user = self.request.user
-
-        metadata_queryset = AccessControlList.objects.restrict_queryset(
-            queryset=document.metadata.all(),
-            permission=permission_document_metadata_edit,
-            user=user
+        return get_metadata_formset_initial(
+            document=self.object, include_addable=True, user=self.request.user
         )
-        existing_metadata_types = set()
-        metadata = {}
-
-        # TODO: The handling looks very complicated and may be due to the
-        # "multi document" support in the edit metadata view. There is no
-        # reason why for a single document there could ever by two values for a
-        # given metadata type.
-        for document_metadata in metadata_queryset:
-            existing_metadata_types.add(document_metadata.metadata_type)
-            # Metadata value cannot be None here, fallback to an empty
-            # string
-            value = document_metadata.value or ''
-            if document_metadata.metadata_type in metadata:
-                if value not in metadata[document_metadata.metadata_type]:
-                    metadata[document_metadata.metadata_type].append(value)
-            else:
-                metadata[document_metadata.metadata_type] = [value] if value else ''
-
-        # TODO: Check if this can be made in a more efficient query
-        all_metadata_types = set(
-            dtmt.metadata_type for dtmt in document.document_type.metadata.all())
-        addable_metadata_types = all_metadata_types - existing_metadata_types
-
-        for metadata_type in addable_metadata_types:
-            metadata[metadata_type] = ''
-
-        def value_to_initial(value):
-            return ', '.join(value) if value else ''
-
-        initial = []
-        for key, value in metadata.items():
-            value = value_to_initial(value)
-            # TODO: Why can the form not get the document_metadata object?
-            initial.append(
-                {
-                    'document_type': document.document_type,
-                    'metadata_type': key,
-                    'update': False,
-                    'value': value,
-                    'value_existing': value
-                }
-            )
-        return initial
 
     def get_initial__tags(self):
         document = self.object
+        tags = list(document.tags.all())
         return {
-            'tags': document.tags.all(),
+            'shown': tags,
+            'tags': tags,
         }
 
     def get_success_url(self):
+        next_document_id = self._get_next_document_id()
+        if next_document_id:
+            return self.queue.get_url(document_id=next_document_id)
+
         document_id = self._get_document_id_from_request()
 
         return reverse(
@@ -769,14 +990,34 @@ class PreProcessDocumentEditView(
         document_id = self.kwargs.get(self.pk_url_kwarg)
         return document_id
 
+    def _get_next_document_id(self):
+        if self.queue:
+            return self.queue.get_next_document_id(document_id=self.object.pk)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         document = self.object
         forms = context['forms']
 
+        subtitle = document.label
+        if self.queue:
+            position = self.queue.get_position(document_id=document.pk)
+            if position:
+                subtitle = _(
+                    '%(label)s (%(position)d of %(count)d)'
+                ) % {
+                    'count': len(self.queue.document_ids),
+                    'label': document.label,
+                    'position': position,
+                }
+
         context.update({
             'title': _('Pre process document'),
-            'subtitle': document.label,
+            'subtitle': subtitle,
+            'document_type_refresh_url': reverse(
+                viewname='botech_edms:document_pre_process_document_type',
+                kwargs={'document_id': document.pk}
+            ),
             'extra_buttons': [
                 {
                     'name': 'button-refresh-document-type',
@@ -801,6 +1042,7 @@ class PreProcessDocumentEditView(
                     },
                 },
                 {
+                    'id': 'pre-process-cabinets',
                     'name': 'botech/appearance/generic_form_group_subtemplate.html',
                     'context': {
                         'form': forms['cabinets'],
@@ -808,6 +1050,7 @@ class PreProcessDocumentEditView(
                     },
                 },
                 {
+                    'id': 'pre-process-tags',
                     'name': 'botech/appearance/generic_form_group_subtemplate.html',
                     'context': {
                         'form': forms['tags'],
@@ -815,6 +1058,7 @@ class PreProcessDocumentEditView(
                     },
                 },
                 {
+                    'id': 'pre-process-metadata',
                     'name': 'botech/appearance/generic_form_group_subtemplate.html',
                     'context': {
                         'form': forms['metadata'],
@@ -842,3 +1086,267 @@ def _exception_to_message(error):
         exception_message = ', '.join(error.messages)
     else:
         exception_message = force_text(s=error)
+
+
+def _get_choice_queryset(queryset, permission, user, current=None):
+    """
+    Return the objects which the user may choose, like ChoiceSearchView.
+
+    The objects in "current" remain valid, so that the values the document
+    has already are accepted when they are submitted back.
+    """
+    query = Q(
+        pk__in=AccessControlList.objects.restrict_queryset(
+            queryset=queryset, permission=permission, user=user
+        ).values('pk')
+    )
+    if current is not None:
+        query |= Q(pk__in=current.values('pk'))
+
+    return queryset.filter(query)
+
+
+class PreProcessDocumentTypeRefreshView(
+        RestrictedQuerysetViewMixin,
+        SingleObjectMixin,
+        View):
+    """
+    Change the document type from the pre processing view in place.
+
+    Answers with the re-rendered parts of the pre processing view which
+    depend on the document type, so that the browser can replace them
+    without losing the input in the other parts of the form.
+
+    The workflows of the new document type are launched by a task after the
+    change has been committed. The answer does not wait for them, changes
+    which they make afterwards are only shown after the next page load.
+    """
+
+    membership_forms = (
+        (
+            'cabinets', CabinetDeltaForm, Cabinet,
+            permission_cabinet_add_document
+        ),
+        ('tags', TagDeltaForm, Tag, permission_tag_attach),
+    )
+    object_permission = permission_document_edit
+    pk_url_kwarg = 'document_id'
+    source_queryset = Document.valid.all()
+    subtemplate_name = 'botech/appearance/generic_form_group_subtemplate.html'
+
+    def post(self, request, *args, **kwargs):
+        self.object = self.get_object()
+
+        form = DocumentTypeRefreshForm(
+            data=request.POST, prefix='properties',
+            queryset=_get_choice_queryset(
+                queryset=DocumentType.objects.all(),
+                permission=permission_document_type_view, user=request.user,
+                current=DocumentType.objects.filter(
+                    pk=self.object.document_type_id)
+            )
+        )
+        if not form.is_valid():
+            return JsonResponse(data={'errors': form.errors}, status=400)
+
+        document_type = form.cleaned_data['document_type']
+        if document_type != self.object.document_type:
+            with deferred_events() as event_queue:
+                change_document_type(
+                    document=self.object, document_type=document_type,
+                    _user=request.user, event_queue=event_queue)
+
+        fragments = {
+            'pre-process-metadata': self.render_fragment(
+                form=DocumentMetadataFormSet(
+                    initial=get_metadata_formset_initial(
+                        document=self.object, include_addable=True,
+                        user=request.user
+                    ), prefix='metadata'
+                ), form_display_mode_table=True,
+                title=_('Document metadata')
+            )
+        }
+
+        for name, form_class, model, permission in self.membership_forms:
+            form = self.get_membership_form(
+                form_class=form_class, model=model, name=name,
+                permission=permission)
+            if form:
+                fragment_id = 'pre-process-{}'.format(name)
+                fragments[fragment_id] = self.render_fragment(
+                    form=form, title=form_class.field_label)
+
+        return JsonResponse(data={'fragments': fragments})
+
+    def get_membership_form(self, form_class, model, name, permission):
+        """
+        Return a new form if the membership did change since the page was
+        rendered, None otherwise.
+
+        The changes of the workflow are merged into what the user did select
+        so far.
+        """
+        queryset = _get_choice_queryset(
+            queryset=model.objects.all(), permission=permission,
+            user=self.request.user, current=getattr(self.object, name).all()
+        )
+        bound_form = form_class(
+            data=self.request.POST, prefix=name, queryset=queryset
+        )
+        if not bound_form.is_valid():
+            return None
+
+        shown = set(bound_form.cleaned_data['shown'])
+        current = set(getattr(self.object, name).all())
+        if current == shown:
+            return None
+
+        selected = set(bound_form.cleaned_data[name])
+        selected = (selected | (current - shown)) - (shown - current)
+
+        return form_class(
+            initial={name: list(selected), 'shown': list(current)},
+            prefix=name, queryset=queryset
+        )
+
+    def render_fragment(self, form, **extra_context):
+        return render_to_string(
+            context=dict(form=form, **extra_context), request=self.request,
+            template_name=self.subtemplate_name
+        )
+
+
+class ChoiceSearchView(View):
+    """
+    Search endpoint for the select2 widgets in "widgets.py".
+
+    Answers with one page of the objects which the user may use and whose
+    label contains the search term.
+    """
+
+    paginate_by = 20
+    permission = None
+    search_field = 'label'
+
+    def get(self, request, *args, **kwargs):
+        queryset = AccessControlList.objects.restrict_queryset(
+            queryset=self.get_source_queryset(), permission=self.permission,
+            user=request.user
+        )
+
+        term = request.GET.get('term', '').strip()
+        if term:
+            queryset = queryset.filter(
+                **{'{}__icontains'.format(self.search_field): term}
+            )
+
+        paginator = Paginator(
+            object_list=queryset.order_by(self.search_field, 'pk'),
+            per_page=self.paginate_by
+        )
+        page = paginator.get_page(number=request.GET.get('page'))
+
+        return JsonResponse(
+            data={
+                'pagination': {'more': page.has_next()},
+                'results': [
+                    {'id': instance.pk, 'text': str(instance)}
+                    for instance in page.object_list
+                ],
+            }
+        )
+
+    def get_source_queryset(self):
+        raise NotImplementedError
+
+
+class CabinetChoiceSearchView(ChoiceSearchView):
+    permission = permission_cabinet_add_document
+
+    def get_source_queryset(self):
+        return Cabinet.objects.all()
+
+
+class DocumentTypeChoiceSearchView(ChoiceSearchView):
+    permission = permission_document_type_view
+
+    def get_source_queryset(self):
+        return DocumentType.objects.all()
+
+
+class TagChoiceSearchView(ChoiceSearchView):
+    permission = permission_tag_attach
+
+    def get_source_queryset(self):
+        return Tag.objects.all()
+
+
+class BookedDocumentExportView(View):
+    """
+    Download the booked documents which the user may view together with
+    their accounting metadata as CSV or JSON lines.
+    """
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get('format', 'csv')
+        try:
+            iter_lines, content_type, extension = EXPORT_FORMATS[export_format]
+        except KeyError:
+            raise Http404('Unknown export format "{}".'.format(export_format))
+
+        queryset = AccessControlList.objects.restrict_queryset(
+            queryset=Document.valid.all(), permission=permission_document_view,
+            user=request.user
+        )
+
+        response = StreamingHttpResponse(
+            content_type=content_type, streaming_content=iter_lines(
+                rows=iter_booked_documents(queryset=queryset)
+            )
+        )
+        response['Content-Disposition'] = (
+            'attachment; filename="booked_documents_{}.{}"'.format(
+                date.today().isoformat(), extension
+            )
+        )
+
+        return response
+
+
+class ViewMetricsView(StrongholdPublicMixin, View):
+    """
+    Serve the summed up view metrics of this process in the Prometheus text
+    format.
+
+    Each worker process keeps its own sums. Only available if the setting
+    "BOTECH_VIEW_INSTRUMENTATION" is enabled.
+
+    The view is exempt from the login, so that a scraper can read it with
+    the token of the setting "BOTECH_VIEW_METRICS_TOKEN". Users need the
+    permission to view the metrics.
+    """
+
+    def get(self, request, *args, **kwargs):
+        if not setting_view_instrumentation.value:
+            raise Http404('The view instrumentation is disabled.')
+
+        token = setting_view_metrics_token.value
+        authorization = request.META.get('HTTP_AUTHORIZATION', '')
+        if token and hmac.compare_digest(
+            authorization.encode(), 'Bearer {}'.format(token).encode()
+        ):
+            pass
+        elif request.user.is_authenticated:
+            Permission.check_user_permissions(
+                permissions=(permission_view_metrics,), user=request.user
+            )
+        else:
+            response = HttpResponse(status=401)
+            response['WWW-Authenticate'] = 'Bearer'
+            return response
+
+        return HttpResponse(
+            content=view_metrics.render_prometheus(),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
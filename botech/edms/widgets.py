@@ -0,0 +1,74 @@
+from django import forms
+from django.urls import reverse
+
+
+class AjaxSelectMixin:
+    """
+    Select2 widget which loads its choices from a search view.
+
+    Only the selected choices are rendered as options, all others are
+    fetched page by page while the user types. The search view answers in
+    the format select2 expects: "results" and "pagination".
+    """
+
+    def __init__(self, url_name, attrs=None, choices=()):
+        self.url_name = url_name
+        super().__init__(attrs=attrs, choices=choices)
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(
+            base_attrs=base_attrs, extra_attrs=extra_attrs
+        )
+        attrs.setdefault('class', 'select2')
+        attrs.update(
+            {
+                'data-ajax--cache': 'true',
+                'data-ajax--delay': 250,
+                'data-ajax--type': 'GET',
+                'data-ajax--url': reverse(viewname=self.url_name),
+            }
+        )
+        return attrs
+
+    def optgroups(self, name, value, attrs=None):
+        """
+        Return only the selected options, the same as Django's
+        AutocompleteSelect does.
+        """
+        selected_choices = {
+            str(item) for item in value if item not in ('', None)
+        }
+        options = []
+
+        if not self.is_required and not self.allow_multiple_selected:
+            options.append(
+                self.create_option(
+                    name=name, value='', label='', selected=False, index=0
+                )
+            )
+
+        if selected_choices:
+            field = self.choices.field
+            lookup = '{}__in'.format(field.to_field_name or 'pk')
+            queryset = self.choices.queryset.filter(
+                **{lookup: selected_choices}
+            )
+            for index, instance in enumerate(queryset, start=len(options)):
+                option_value = self.choices.choice(instance)[0]
+                options.append(
+                    self.create_option(
+                        name=name, value=option_value,
+                        label=field.label_from_instance(instance),
+                        selected=True, index=index
+                    )
+                )
+
+        return [(None, options, 0)]
+
+
+class AjaxSelect(AjaxSelectMixin, forms.Select):
+    pass
+
+
+class AjaxSelectMultiple(AjaxSelectMixin, forms.SelectMultiple):
+    pass